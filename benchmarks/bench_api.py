@@ -0,0 +1,43 @@
+"""
+SwitchBot API クライアントのベンチマーク
+リクエスト署名（ヘッダー生成）とレスポンスの整形を計測する
+"""
+
+from typing import Dict
+from unittest import mock
+
+from src.switchbot_api import SwitchBotAPI
+
+from .harness import measure
+from .synthetic import generate_status
+
+
+def run(config: Dict) -> Dict[str, Dict]:
+    api = SwitchBotAPI("bench-token-" + "x" * 84, "bench-secret-" + "y" * 19)
+    operations = config["signatures"]
+    repeat = config["repeat"]
+    results = {}
+
+    def sign():
+        for _ in range(operations):
+            api._generate_headers()
+
+    results["api.sign_headers"] = measure(sign, operations, repeat)
+
+    # ネットワークを除いた整形処理のみを計測する
+    status = generate_status(config["seed"])
+
+    def build_samples():
+        with mock.patch.object(api, "get_device_status", return_value=status):
+            for _ in range(operations):
+                api.get_temperature_data("BENCH000000")
+
+    results["api.build_sample"] = measure(build_samples, operations, repeat)
+
+    def build_sample_tuples():
+        with mock.patch.object(api, "get_device_status", return_value=status):
+            for _ in range(operations):
+                api.get_sample("BENCH000000")
+
+    results["api.build_sample_tuple"] = measure(build_sample_tuples, operations, repeat)
+    return results
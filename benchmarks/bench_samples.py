@@ -0,0 +1,83 @@
+"""
+サンプル表現のベンチマーク
+サンプル辞書・ Sample ・ SampleBatch のメモリ使用量と、スプールへの記録・保存・直近データ取得の速度を比較する
+"""
+
+import json
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+from src.data_storage import CachedStorage, create_storage
+from src.sample import Sample, SampleBatch
+
+from .harness import measure, measure_memory
+from .synthetic import generate_samples
+
+
+def _with_memory(result: Dict, size: int, count: int) -> Dict:
+    result["bytes"] = size
+    result["bytes_per_sample"] = round(size / count, 1) if count else None
+    return result
+
+
+def run(config: Dict) -> Dict[str, Dict]:
+    def generate():
+        return generate_samples(config["devices"], config["days"], config["interval_minutes"], seed=config["seed"])
+
+    dicts: List[Dict] = list(generate())
+    samples = [Sample.from_dict(data) for data in dicts]
+    batch = SampleBatch(samples)
+    count = len(dicts)
+    repeat = config["repeat"]
+    results = {}
+
+    # 保持したままのメモリ量（生成途中の一時オブジェクトは含まない）
+    builders = {
+        "dict": lambda: list(generate()),
+        "sample": lambda: [Sample.from_dict(data) for data in generate()],
+        "batch": lambda: SampleBatch(generate()),
+    }
+    for name, build in builders.items():
+        results[f"samples.memory.{name}"] = _with_memory(
+            measure(build, count, repeat), measure_memory(build), count
+        )
+
+    # スプールへの記録と同じ形式での JSON 化
+    def encode_dicts():
+        for seq, data in enumerate(dicts):
+            json.dumps({'seq': seq, 'data': data}, ensure_ascii=False, separators=(',', ':'))
+
+    def encode_samples():
+        for seq, sample in enumerate(samples):
+            json.dumps({'seq': seq, 's': sample}, ensure_ascii=False, separators=(',', ':'))
+
+    results["samples.spool_encode.dict"] = measure(encode_dicts, count, repeat)
+    results["samples.spool_encode.sample"] = measure(encode_samples, count, repeat)
+
+    with tempfile.TemporaryDirectory(prefix="switchbot-bench-") as workdir:
+        path = Path(workdir) / "samples.db"
+        state = {}
+
+        def reset():
+            for candidate in (path, path.with_name(path.name + "-wal")):
+                candidate.unlink(missing_ok=True)
+            state["storage"] = create_storage("sqlite", path)
+
+        for name, records in (("dict", dicts), ("sample", samples), ("batch", batch)):
+            results[f"samples.sqlite_save.{name}"] = measure(
+                lambda records=records: state["storage"].save_batch(records), count, repeat, setup=reset
+            )
+
+        reset()
+        storage = state["storage"]
+        storage.save_batch(batch)
+        results["samples.recent_24h.dict"] = measure(lambda: storage.get_recent_data(24), 1, repeat)
+        results["samples.recent_24h.batch"] = measure(lambda: storage.get_recent_batch(24), 1, repeat)
+
+        cached = CachedStorage(storage, cache_size=max(1, int(24 * 60 / config["interval_minutes"]) + 1))
+        cached.get_recent_batch(24)  # キャッシュは最初の読み込みで初期化される
+        results["samples.recent_24h_cached.dict"] = measure(lambda: cached.get_recent_data(24), 1, repeat)
+        results["samples.recent_24h_cached.batch"] = measure(lambda: cached.get_recent_batch(24), 1, repeat)
+
+    return results
@@ -0,0 +1,44 @@
+"""
+Google Sheets クライアントのベンチマーク
+ネットワークを除いた append_temperature_data の行組み立て処理を計測する
+"""
+
+import logging
+from typing import Dict, List
+
+from src.google_sheets import GoogleSheetsClient
+
+from .harness import measure
+from .synthetic import generate_samples
+
+
+class _InMemoryWorksheet:
+    """append_row を記録するだけのワークシート"""
+
+    def __init__(self):
+        self.rows: List[List] = []
+
+    def append_row(self, row_data: List):
+        self.rows.append(row_data)
+
+
+def run(config: Dict) -> Dict[str, Dict]:
+    # 認証を行わずにクライアントを組み立てる
+    client = GoogleSheetsClient.__new__(GoogleSheetsClient)
+    client.spreadsheet_id = "bench"
+    client.logger = logging.getLogger("benchmarks.sheets")
+    client.gc = None
+
+    samples = list(generate_samples(1, config["days"], config["interval_minutes"], seed=config["seed"]))
+    samples = samples[:config["sheet_appends"]]
+
+    def reset():
+        client.worksheet = _InMemoryWorksheet()
+
+    def append_all():
+        for data in samples:
+            client.append_temperature_data(data)
+
+    return {
+        "sheets.append_row": measure(append_all, len(samples), config["repeat"], setup=reset),
+    }
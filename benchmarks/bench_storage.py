@@ -0,0 +1,80 @@
+"""
+データストレージのベンチマーク
+単発/一括保存、直近データ取得、古いデータの削除を CSV と SQLite で計測する
+"""
+
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+from src.data_storage import CachedStorage, create_storage
+
+from .harness import measure
+from .synthetic import generate_samples
+
+BACKENDS = {"sqlite": "bench.db", "csv": "bench.csv"}
+
+
+def _fresh_storage(backend: str, path: Path):
+    for candidate in (path, path.with_suffix(".tmp")):
+        candidate.unlink(missing_ok=True)
+    return create_storage(backend, path)
+
+
+def run(config: Dict) -> Dict[str, Dict]:
+    samples: List[Dict] = list(generate_samples(
+        config["devices"], config["days"], config["interval_minutes"], seed=config["seed"]
+    ))
+    single_samples = samples[:config["single_inserts"]]
+    repeat = config["repeat"]
+    retention_days = max(1, int(config["days"] / 2))
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix="switchbot-bench-") as workdir:
+        workdir = Path(workdir)
+        for backend, filename in BACKENDS.items():
+            path = workdir / filename
+            state = {}
+
+            def reset():
+                state["storage"] = _fresh_storage(backend, path)
+
+            def insert_single():
+                storage = state["storage"]
+                for data in single_samples:
+                    storage.save_temperature_data(data)
+
+            results[f"storage.{backend}.insert_single"] = measure(
+                insert_single, len(single_samples), repeat, setup=reset
+            )
+
+            results[f"storage.{backend}.insert_batch"] = measure(
+                lambda: state["storage"].save_batch(samples), len(samples), repeat, setup=reset
+            )
+
+            # 以降の計測用に全データを投入したファイルを用意しておく
+            populated = workdir / f"populated-{filename}"
+            _fresh_storage(backend, path).save_batch(samples)
+            shutil.copyfile(path, populated)
+            storage = create_storage(backend, path)
+
+            results[f"storage.{backend}.recent_24h"] = measure(
+                lambda: storage.get_recent_data(24), 1, repeat
+            )
+
+            cached = CachedStorage(storage, cache_size=max(1, int(24 * 60 / config["interval_minutes"]) + 1))
+            cached.get_recent_batch(24)  # キャッシュは最初の読み込みで初期化される
+            results[f"storage.{backend}.recent_24h_cached"] = measure(
+                lambda: cached.get_recent_data(24), 1, repeat
+            )
+
+            def restore():
+                shutil.copyfile(populated, path)
+                state["storage"] = create_storage(backend, path)
+
+            results[f"storage.{backend}.cleanup"] = measure(
+                lambda: state["storage"].cleanup_old_data(retention_days), len(samples), repeat, setup=restore
+            )
+
+    return results
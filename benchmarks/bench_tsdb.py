@@ -0,0 +1,54 @@
+"""
+時系列データベース送信のベンチマーク
+line protocol への変換と gzip 圧縮、ローカルの InfluxDB 模倣サーバーへのスプール経由の送信を計測する
+"""
+
+import gzip
+import logging
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+from loadtest.fake_servers import FakeInfluxServer
+from src.sample import Sample
+from src.spool import Spool, SpoolDrainer
+from src.tsdb import LineProtocolSink, encode_lines
+
+from .harness import measure
+from .synthetic import generate_samples
+
+
+def run(config: Dict) -> Dict[str, Dict]:
+    dicts: List[Dict] = list(generate_samples(
+        config["devices"], config["days"], config["interval_minutes"], seed=config["seed"]
+    ))
+    samples = [Sample.from_dict(data) for data in dicts]
+    count = len(samples)
+    repeat = config["repeat"]
+    results = {}
+
+    results["tsdb.encode.dict"] = measure(lambda: encode_lines(dicts), count, repeat)
+    results["tsdb.encode.sample"] = measure(lambda: encode_lines(samples), count, repeat)
+
+    payload, _ = encode_lines(samples)
+    results["tsdb.gzip"] = measure(lambda: gzip.compress(payload, compresslevel=5), count, repeat)
+    results["tsdb.gzip"]["compression_ratio"] = round(len(payload) / len(gzip.compress(payload, compresslevel=5)), 1)
+
+    # 送信エラーのログで計測がぶれないようにする
+    logging.getLogger("src.tsdb").setLevel(logging.ERROR)
+    with FakeInfluxServer() as server, tempfile.TemporaryDirectory(prefix="switchbot-bench-") as workdir:
+        sink = LineProtocolSink(server.write_url(), max_batch_age=0)
+        results["tsdb.write"] = measure(lambda: sink(samples), count, repeat)
+
+        # スプールに記録済みのサンプルを再送ワーカーで送り切るまで
+        drainers: List[SpoolDrainer] = []
+
+        def reset():
+            spool = Spool(Path(workdir) / f"spool-{len(drainers)}", fsync_batch=count + 1, fsync_interval=3600)
+            for sample in samples:
+                spool.append(sample)
+            drainers.append(SpoolDrainer(spool, {}, batch_sinks={"tsdb": sink}))
+
+        results["tsdb.spool_drain"] = measure(lambda: drainers[-1].drain_once(), count, repeat, setup=reset)
+
+    return results
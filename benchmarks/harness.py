@@ -0,0 +1,49 @@
+"""
+マイクロベンチマークの計測ヘルパー
+"""
+
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, Optional
+
+
+def measure(
+    func: Callable[[], object],
+    operations: int = 1,
+    repeat: int = 5,
+    setup: Optional[Callable[[], object]] = None
+) -> Dict:
+    """func を repeat 回実行し、所要時間の中央値・最小値と処理速度を返す
+
+    operations は func 1 回あたりの処理件数（ ops/s の算出に使う）。
+    setup は各回の計測前に実行され、計測時間には含まれない。
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    median = statistics.median(timings)
+    return {
+        "seconds": median,
+        "min_seconds": min(timings),
+        "operations": operations,
+        "ops_per_sec": operations / median if median > 0 else None,
+        "repeat": repeat,
+    }
+
+
+def measure_memory(build: Callable[[], object]) -> int:
+    """build が返すオブジェクトを保持したまま、確保されているメモリのバイト数を返す"""
+    tracemalloc.start()
+    try:
+        result = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+マイクロベンチマークの実行スクリプト
+結果を JSON に保存し、ベースラインとの比較で性能の劣化を検出する
+
+使用例:
+    python -m benchmarks.run                         # 実行して results/latest.json に保存
+    python -m benchmarks.run --save-baseline         # 結果をベースラインとして保存
+    python -m benchmarks.run --compare               # ベースラインと比較（劣化があれば終了コード 1 ）
+    python -m benchmarks.run --devices 10 --days 30  # データ量を変更
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict
+
+# プロジェクトのルートパスを sys.path に追加
+sys.path.append(str(Path(__file__).parent.parent))
+
+RESULTS_DIR = Path(__file__).parent / "results"
+SUITES = ("storage", "api", "sheets", "samples", "tsdb")
+
+
+def load_suite(name: str):
+    """スイートのモジュールを読み込む（依存関係がない場合は None ）"""
+    try:
+        if name == "storage":
+            from benchmarks import bench_storage as module
+        elif name == "api":
+            from benchmarks import bench_api as module
+        elif name == "samples":
+            from benchmarks import bench_samples as module
+        elif name == "tsdb":
+            from benchmarks import bench_tsdb as module
+        else:
+            from benchmarks import bench_sheets as module
+        return module
+    except ImportError as e:
+        print(f"スイート '{name}' をスキップします（依存関係がインストールされていません: {e}）")
+        return None
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> int:
+    """ベースラインと比較し、劣化したベンチマークの数を返す"""
+    regressions = 0
+    print(f"\n{'benchmark':45} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, current in sorted(results["results"].items()):
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name:45} {'-':>12} {current['seconds']:12.6f} {'new':>8}")
+            continue
+        change = (current["seconds"] - base["seconds"]) / base["seconds"]
+        mark = ""
+        if change > threshold:
+            regressions += 1
+            mark = "  <-- 劣化"
+        print(f"{name:45} {base['seconds']:12.6f} {current['seconds']:12.6f} {change:+8.1%}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SwitchBot Temperature Logger ベンチマーク")
+    parser.add_argument("--suite", action="append", choices=SUITES, help="実行するスイート（複数指定可）")
+    parser.add_argument("--devices", type=int, default=5, help="合成データのデバイス数")
+    parser.add_argument("--days", type=float, default=14, help="合成データの日数")
+    parser.add_argument("--interval-minutes", type=int, default=30, help="合成データの記録間隔（分）")
+    parser.add_argument("--single-inserts", type=int, default=200, help="単発保存の件数")
+    parser.add_argument("--signatures", type=int, default=5000, help="署名生成の回数")
+    parser.add_argument("--sheet-appends", type=int, default=500, help="Google Sheets への追加件数")
+    parser.add_argument("--repeat", type=int, default=5, help="各ベンチマークの繰り返し回数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR / "latest.json", help="結果の出力先")
+    parser.add_argument("--baseline", type=Path, default=RESULTS_DIR / "baseline.json", help="ベースラインのファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="結果をベースラインとして保存する")
+    parser.add_argument("--compare", action="store_true", help="ベースラインと比較する")
+    parser.add_argument("--threshold", type=float, default=0.2, help="劣化とみなす所要時間の増加率")
+    args = parser.parse_args()
+
+    # ベンチマーク中のログ出力は計測対象から外す
+    logging.disable(logging.WARNING)
+
+    config = {
+        "devices": args.devices,
+        "days": args.days,
+        "interval_minutes": args.interval_minutes,
+        "single_inserts": args.single_inserts,
+        "signatures": args.signatures,
+        "sheet_appends": args.sheet_appends,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+
+    results = {}
+    for name in args.suite or SUITES:
+        module = load_suite(name)
+        if module is None:
+            continue
+        print(f"スイート '{name}' を実行しています...")
+        results.update(module.run(config))
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": config,
+        },
+        "results": results,
+    }
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"結果を保存しました: {args.output}")
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"ベースラインを保存しました: {args.baseline}")
+
+    if args.compare:
+        if not args.baseline.exists():
+            print(f"ベースラインが見つかりません: {args.baseline}")
+            sys.exit(1)
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline.get("meta", {}).get("config") != config:
+            print("注意: ベースラインと計測条件が異なります")
+        regressions = compare(report, baseline, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    for name, result in sorted(results.items()):
+        ops = f"{result['ops_per_sec']:,.0f} ops/s" if result["ops_per_sec"] else "-"
+        memory = f"  {result['bytes'] / 1024:,.0f} KiB ({result['bytes_per_sample']} B/件)" if "bytes" in result else ""
+        print(f"{name:45} {result['seconds']:10.6f} s  {ops}{memory}")
+
+
+if __name__ == "__main__":
+    main()
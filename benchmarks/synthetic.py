@@ -0,0 +1,59 @@
+"""
+ベンチマーク用の合成データ生成
+N 台のデバイス × M 日分のサンプルを再現可能な乱数で生成する
+"""
+
+import math
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+
+def device_ids(devices: int) -> List[str]:
+    """ベンチマーク用のデバイス ID 一覧"""
+    return [f"BENCH{index:06d}" for index in range(devices)]
+
+
+def generate_samples(
+    devices: int,
+    days: float,
+    interval_minutes: int = 30,
+    end: Optional[datetime] = None,
+    seed: int = 0
+) -> Iterator[Dict]:
+    """時刻昇順でサンプル辞書を生成（日周変動 + ノイズ）"""
+    rng = random.Random(seed)
+    end = end or datetime.now().replace(second=0, microsecond=0)
+    steps = int(days * 24 * 60 / interval_minutes)
+    start = end - timedelta(minutes=interval_minutes * steps)
+    ids = device_ids(devices)
+    offsets = [rng.uniform(-3.0, 3.0) for _ in ids]
+
+    for step in range(steps):
+        timestamp = start + timedelta(minutes=interval_minutes * step)
+        iso = timestamp.isoformat()
+        phase = math.sin(2 * math.pi * (timestamp.hour * 60 + timestamp.minute) / 1440)
+        for device_id, offset in zip(ids, offsets):
+            yield {
+                "timestamp": iso,
+                "device_id": device_id,
+                "temperature": round(22.0 + offset + 4.0 * phase + rng.gauss(0, 0.3), 1),
+                "humidity": round(50.0 - 10.0 * phase + rng.gauss(0, 1.0), 1),
+                "light_level": max(1, min(20, int(10 + 8 * phase + rng.gauss(0, 1)))),
+                "device_type": "Hub 2",
+                "version": "V1.0-BENCH",
+            }
+
+
+def generate_status(seed: int = 0) -> Dict:
+    """SwitchBot API のステータスレスポンス本体（ body ）を生成"""
+    rng = random.Random(seed)
+    return {
+        "deviceId": "BENCH000000",
+        "deviceType": "Hub 2",
+        "hubDeviceId": "BENCH000000",
+        "temperature": round(rng.uniform(15, 30), 1),
+        "humidity": rng.randint(30, 70),
+        "lightLevel": rng.randint(1, 20),
+        "version": "V1.0-BENCH",
+    }
@@ -12,15 +12,97 @@ class Settings:
         self.SWITCHBOT_TOKEN = os.getenv("SWITCHBOT_TOKEN")
         self.SWITCHBOT_SECRET = os.getenv("SWITCHBOT_SECRET")
         self.SWITCHBOT_DEVICE_ID = os.getenv("SWITCHBOT_DEVICE_ID")
+        # 複数デバイスを記録する場合はカンマ区切りで指定（未指定時は SWITCHBOT_DEVICE_ID ）
+        self.SWITCHBOT_DEVICE_IDS = [
+            device_id.strip()
+            for device_id in os.getenv("SWITCHBOT_DEVICE_IDS", self.SWITCHBOT_DEVICE_ID or "").split(",")
+            if device_id.strip()
+        ]
+        self.SWITCHBOT_API_BASE_URL = os.getenv("SWITCHBOT_API_BASE_URL", "https://api.switch-bot.com/v1.1")
+        self.SWITCHBOT_RETRY_BACKOFF = float(os.getenv("SWITCHBOT_RETRY_BACKOFF", "1.0"))
+        # 複数デバイスを並行して取得する数
+        self.COLLECTION_CONCURRENCY = int(os.getenv("COLLECTION_CONCURRENCY", "1"))
+        
+        # 分担収集ワーカー設定（ main.py --worker ）
+        # 同じ WORKER_LEASE_DB_PATH を共有するワーカー間でデバイスを分担する（同一ホストのローカルファイルシステムのみ）
+        self.WORKER_ID = os.getenv("WORKER_ID")
+        self.WORKER_LEASE_DB_PATH = self.BASE_DIR / os.getenv("WORKER_LEASE_DB_PATH", "data/leases.db")
+        self.WORKER_LEASE_TTL = float(os.getenv("WORKER_LEASE_TTL", "60"))
+        self.WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1800"))
+        
+        # 適応的な取得間隔の設定（値の変化としきい値への近さで間隔を MIN 〜 MAX の間で伸縮する）
+        # 有効にする場合は Cloud Scheduler を POLLING_MIN_INTERVAL ごとに実行し、取得時刻を迎えたデバイスだけを取得する
+        self.POLLING_ADAPTIVE = os.getenv("POLLING_ADAPTIVE", "false").lower() == "true"
+        self.POLLING_MIN_INTERVAL = float(os.getenv("POLLING_MIN_INTERVAL", "300"))
+        self.POLLING_MAX_INTERVAL = float(os.getenv("POLLING_MAX_INTERVAL", "3600"))
+        # 全デバイス合計の 1 日の API 呼び出し数の上限（ SwitchBot API の上限は 1 日 10,000 回）
+        self.POLLING_DAILY_BUDGET = int(os.getenv("POLLING_DAILY_BUDGET", "9000"))
+        self.POLLING_STATE_PATH = self.BASE_DIR / os.getenv("POLLING_STATE_PATH", "data/polling_state.json")
+        # 複数インスタンス・ Cloud Functions では共有の保存先（ gs://bucket/prefix またはディレクトリ）を指定する
+        self.POLLING_STATE_STORE = self._store_location(os.getenv("POLLING_STATE_STORE"))
         
         # データベース設定
         self.DATABASE_TYPE = os.getenv("DATABASE_TYPE", "sqlite")
         self.DATABASE_PATH = self.BASE_DIR / os.getenv("DATABASE_PATH", "data/temperature.db")
         self.CSV_PATH = self.BASE_DIR / os.getenv("CSV_PATH", "data/temperature.csv")
         
+        # スナップショット設定（ SQLite の変更ブロックを保存する先。 gs://bucket/prefix またはディレクトリ）
+        self.SNAPSHOT_STORE = self._store_location(os.getenv("SNAPSHOT_STORE"))
+        self.SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "300"))
+        self.SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "5"))
+        self.SNAPSHOT_BLOCK_SIZE = int(os.getenv("SNAPSHOT_BLOCK_SIZE", str(256 * 1024)))
+        
+        # 直近データキャッシュ設定（デバイスごとの保持件数、0 で無効）
+        self.RECENT_CACHE_SIZE = int(os.getenv("RECENT_CACHE_SIZE", "1440"))
+        self.RECENT_CACHE_WARM_HOURS = int(os.getenv("RECENT_CACHE_WARM_HOURS", "24"))
+        
+        # クエリ結果キャッシュ設定（保持する結果の数、0 で無効）
+        self.QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "64"))
+        self.QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))
+        self.QUERY_CACHE_MAX_ROWS = int(os.getenv("QUERY_CACHE_MAX_ROWS", "200000"))
+        
+        # スプール設定（ストレージ/ Google Sheets へ送信する前の一時保存先）
+        self.SPOOL_DIR = self.BASE_DIR / os.getenv("SPOOL_DIR", "data/spool")
+        self.SPOOL_FSYNC_BATCH = int(os.getenv("SPOOL_FSYNC_BATCH", "16"))
+        self.SPOOL_FSYNC_INTERVAL = float(os.getenv("SPOOL_FSYNC_INTERVAL", "1.0"))
+        self.SPOOL_DRAIN_TIMEOUT = float(os.getenv("SPOOL_DRAIN_TIMEOUT", "30"))
+        # シンクごとの未送信サンプル数・経過秒数の上限（超えた分は破棄する。 0 は無制限）
+        self.SPOOL_MAX_PENDING = int(os.getenv("SPOOL_MAX_PENDING", "100000"))
+        self.SPOOL_MAX_AGE = float(os.getenv("SPOOL_MAX_AGE", str(7 * 86400)))
+        
+        # 時系列データベース設定（ InfluxDB の書き込み URL を指定した場合のみスプールから line protocol で送信）
+        # 例: http://localhost:8086/api/v2/write?org=my-org&bucket=switchbot
+        self.TSDB_WRITE_URL = os.getenv("TSDB_WRITE_URL")
+        self.TSDB_TOKEN = os.getenv("TSDB_TOKEN")
+        self.TSDB_MEASUREMENT = os.getenv("TSDB_MEASUREMENT", "environment")
+        self.TSDB_BATCH_SIZE = int(os.getenv("TSDB_BATCH_SIZE", "5000"))
+        self.TSDB_MAX_BATCH_AGE = float(os.getenv("TSDB_MAX_BATCH_AGE", "5"))
+        self.TSDB_GZIP = os.getenv("TSDB_GZIP", "true").lower() == "true"
+        
+        # アラート設定（ルールの JSON ファイルを指定した場合のみ有効）
+        alert_rules_file = os.getenv("ALERT_RULES_FILE")
+        self.ALERT_RULES_FILE = self.BASE_DIR / alert_rules_file if alert_rules_file else None
+        self.ALERT_STATE_PATH = self.BASE_DIR / os.getenv("ALERT_STATE_PATH", "data/alert_state.json")
+        # Cloud Functions では /tmp が消えるため、共有の保存先（ gs://bucket/prefix またはディレクトリ）を指定する
+        self.ALERT_STATE_STORE = self._store_location(os.getenv("ALERT_STATE_STORE"))
+        # 評価中は状態をメモリ上に保持し、この秒数ごと（と実行の終了時）に保存する
+        self.ALERT_STATE_SAVE_INTERVAL = float(os.getenv("ALERT_STATE_SAVE_INTERVAL", "60"))
+        self.ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL")
+        
+        # プロファイリング設定（ --profile / profile=true のレポートの保存先。 gs://bucket/prefix も可）
+        self.PROFILE_DIR = self._store_location(os.getenv("PROFILE_DIR", "data/profiles"))
+        self.PROFILE_COLLAPSED = os.getenv("PROFILE_COLLAPSED", "true").lower() == "true"
+        # 1 回のリクエストで繰り返す収集回数の上限（実際に SwitchBot API を呼び出すため）
+        self.PROFILE_MAX_CYCLES = int(os.getenv("PROFILE_MAX_CYCLES", "10"))
+        
         # ログ設定
         self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
         self.LOG_FILE = self.BASE_DIR / os.getenv("LOG_FILE", "logs/temperature_logger.log")
+        # text または json（ Cloud Logging 向けの 1 行 JSON ）
+        self.LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+        # 同じ箇所からのログを LOG_RATE_LIMIT_INTERVAL 秒あたり何件まで出力するか（ 0 で無制限）
+        self.LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "0"))
+        self.LOG_RATE_LIMIT_INTERVAL = float(os.getenv("LOG_RATE_LIMIT_INTERVAL", "60"))
         
         # データ保持設定
         self.DATA_RETENTION_DAYS = int(os.getenv("DATA_RETENTION_DAYS", "30"))
@@ -28,10 +110,18 @@ class Settings:
         # ディレクトリを作成
         self._create_directories()
     
+    def _store_location(self, value):
+        """保存先の指定（ gs:// 以外の相対パスはプロジェクトルートからのパスにする）"""
+        if not value or value.startswith("gs://"):
+            return value
+        return str(self.BASE_DIR / value)
+    
     def _create_directories(self):
         """必要なディレクトリを作成"""
         self.DATABASE_PATH.parent.mkdir(parents=True, exist_ok=True)
         self.CSV_PATH.parent.mkdir(parents=True, exist_ok=True)
+        self.SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+        self.WORKER_LEASE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
         self.LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
     
     def validate(self):
@@ -39,7 +129,7 @@ class Settings:
         required_settings = [
             ("SWITCHBOT_TOKEN", self.SWITCHBOT_TOKEN),
             ("SWITCHBOT_SECRET", self.SWITCHBOT_SECRET),
-            ("SWITCHBOT_DEVICE_ID", self.SWITCHBOT_DEVICE_ID)
+            ("SWITCHBOT_DEVICE_IDS（または SWITCHBOT_DEVICE_ID ）", self.SWITCHBOT_DEVICE_IDS)
         ]
         
         missing_settings = [name for name, value in required_settings if not value]
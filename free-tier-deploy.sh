@@ -35,6 +35,7 @@ if [ -z "$SWITCHBOT_DEVICE_ID" ]; then
 fi
 
 # デプロイ実行
+# SPOOL_DIR の /tmp はインスタンスの入れ替わりで消えるため、送信前のサンプルは失われうる（ README の注意を参照）
 gcloud functions deploy $FUNCTION_NAME \
     --runtime $RUNTIME \
     --trigger-http \
@@ -44,7 +45,7 @@ gcloud functions deploy $FUNCTION_NAME \
     --timeout $TIMEOUT \
     --memory $MEMORY \
     --region $REGION \
-    --set-env-vars "SWITCHBOT_TOKEN=$SWITCHBOT_TOKEN,SWITCHBOT_SECRET=$SWITCHBOT_SECRET,SWITCHBOT_DEVICE_ID=$SWITCHBOT_DEVICE_ID,DATABASE_TYPE=sqlite,DATABASE_PATH=/tmp/temperature.db,LOG_LEVEL=INFO,DATA_RETENTION_DAYS=60"
+    --set-env-vars "SWITCHBOT_TOKEN=$SWITCHBOT_TOKEN,SWITCHBOT_SECRET=$SWITCHBOT_SECRET,SWITCHBOT_DEVICE_ID=$SWITCHBOT_DEVICE_ID,DATABASE_TYPE=sqlite,DATABASE_PATH=/tmp/temperature.db,SPOOL_DIR=/tmp/spool,LOG_LEVEL=INFO,LOG_FORMAT=json,DATA_RETENTION_DAYS=60"
 
 echo "デプロイが完了しました!"
 echo "Function URL: https://$REGION-$(gcloud config get-value project).cloudfunctions.net/$FUNCTION_NAME"
@@ -0,0 +1,354 @@
+"""
+負荷試験用のローカルサーバー
+SwitchBot API v1.1 と Google Sheets API （トークン発行を含む）、 InfluxDB の書き込み API を模倣し、遅延やエラーを注入できる
+"""
+
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+STATUS_PATH = re.compile(r"^/v1\.1/devices/([^/]+)/status$")
+SPREADSHEET_PATH = re.compile(r"^/v4/spreadsheets/([^/:]+)$")
+BATCH_UPDATE_PATH = re.compile(r"^/v4/spreadsheets/([^/]+):batchUpdate$")
+VALUES_PATH = re.compile(r"^/v4/spreadsheets/([^/]+)/values/([^/:]+)$")
+APPEND_PATH = re.compile(r"^/v4/spreadsheets/([^/]+)/values/([^/]+):append$")
+TOKEN_PATH = "/token"
+WRITE_PATH = "/api/v2/write"
+
+
+class _FaultInjection:
+    """遅延と 429 / 5xx エラーの注入設定"""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 rate_429: float = 0.0, rate_5xx: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self) -> Optional[int]:
+        """遅延を入れ、エラーにする場合はステータスコードを返す"""
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms))
+            roll = self._rng.random()
+        if delay:
+            time.sleep(delay / 1000)
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.rate_5xx:
+            return 503
+        return None
+
+
+class _LocalServer:
+    """スレッドで動くローカル HTTP サーバーの共通処理"""
+
+    def __init__(self, faults: _FaultInjection, host: str = "127.0.0.1", port: int = 0):
+        self.faults = faults
+        self.stats: Dict[str, int] = {}
+        self._stats_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, handler: BaseHTTPRequestHandler, method: str):
+        raise NotImplementedError
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # ヘッダーと本文を別パケットで送るため、 Nagle による遅延を避ける
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server.handle(self, "GET")
+
+            def do_POST(self):
+                server.handle(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, payload: Dict):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class FakeSwitchBotServer(_LocalServer):
+    """SwitchBot API v1.1 の /devices と /devices/{id}/status を模倣するサーバー"""
+
+    def __init__(self, devices: int = 1000, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 rate_429: float = 0.0, rate_5xx: float = 0.0, seed: int = 0, **kwargs):
+        super().__init__(_FaultInjection(latency_ms, jitter_ms, rate_429, rate_5xx, seed), **kwargs)
+        self.device_ids: List[str] = [f"LOAD{index:08X}" for index in range(devices)]
+        self._known = set(self.device_ids)
+        self._rng = random.Random(seed)
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.address}/v1.1"
+
+    def handle(self, handler, method: str):
+        self.count("requests")
+        if method != "GET":
+            handler.send_json(405, {"statusCode": 405, "message": "method not allowed"})
+            return
+
+        # 署名ヘッダーが揃っていないリクエストは実 API と同様に拒否する
+        if not all(handler.headers.get(name) for name in ("Authorization", "sign", "t", "nonce")):
+            self.count("unauthorized")
+            handler.send_json(401, {"message": "Unauthorized"})
+            return
+
+        status = self.faults.apply()
+        if status is not None:
+            self.count(f"injected_{status}")
+            handler.send_json(status, {"message": "injected error"})
+            return
+
+        if handler.path == "/v1.1/devices":
+            body = {
+                "deviceList": [
+                    {"deviceId": device_id, "deviceName": f"Load {device_id}", "deviceType": "Hub 2",
+                     "hubDeviceId": device_id}
+                    for device_id in self.device_ids
+                ],
+                "infraredRemoteList": [],
+            }
+            handler.send_json(200, {"statusCode": 100, "body": body, "message": "success"})
+            return
+
+        match = STATUS_PATH.match(handler.path)
+        if match and match.group(1) in self._known:
+            self.count("status_ok")
+            handler.send_json(200, {
+                "statusCode": 100,
+                "body": {
+                    "deviceId": match.group(1),
+                    "deviceType": "Hub 2",
+                    "hubDeviceId": match.group(1),
+                    "temperature": round(self._rng.uniform(15, 30), 1),
+                    "humidity": self._rng.randint(30, 70),
+                    "lightLevel": self._rng.randint(1, 20),
+                    "version": "V1.0-LOAD",
+                },
+                "message": "success",
+            })
+            return
+
+        # 実 API は未知のデバイスにも HTTP 200 と statusCode 190 を返す
+        handler.send_json(200, {"statusCode": 190, "message": "device not found", "body": {}})
+
+
+class FakeSheetsServer(_LocalServer):
+    """Google Sheets API を模倣し、追加された行を保持するサーバー
+
+    gspread が使うスプレッドシートのメタデータ取得、値の取得・追加、 batchUpdate （行の挿入）と、
+    サービスアカウントのトークン発行（ token_uri ）に応答する。ワークシートは 1 枚だけで、
+    先頭に挿入された行はヘッダーとして rows とは別に保持する。
+    """
+
+    SHEET_TITLE = "Sheet1"
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 rate_429: float = 0.0, rate_5xx: float = 0.0, seed: int = 0, **kwargs):
+        super().__init__(_FaultInjection(latency_ms, jitter_ms, rate_429, rate_5xx, seed), **kwargs)
+        self.rows: List[List] = []
+        self.header: List = []
+        self._header_pending = False
+        self._tokens = set()
+        self._rows_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return self.address
+
+    @property
+    def token_uri(self) -> str:
+        return f"{self.address}{TOKEN_PATH}"
+
+    def handle(self, handler, method: str):
+        self.count("requests")
+        length = int(handler.headers.get("Content-Length") or 0)
+        payload = handler.rfile.read(length) if length else b""
+        path = handler.path.split("?", 1)[0]
+
+        if method == "POST" and path == TOKEN_PATH:
+            # 署名付き JWT の検証は省略し、アクセストークンを発行する
+            token = uuid.uuid4().hex
+            with self._rows_lock:
+                self._tokens.add(token)
+            self.count("tokens")
+            handler.send_json(200, {"access_token": token, "expires_in": 3600, "token_type": "Bearer"})
+            return
+
+        authorization = handler.headers.get("Authorization", "")
+        with self._rows_lock:
+            authorized = authorization.startswith("Bearer ") and authorization[7:] in self._tokens
+        if not authorized:
+            self.count("unauthorized")
+            handler.send_json(401, {"error": {"code": 401, "message": "unauthorized"}})
+            return
+
+        status = self.faults.apply()
+        if status is not None:
+            self.count(f"injected_{status}")
+            handler.send_json(status, {"error": {"code": status, "message": "injected error"}})
+            return
+
+        if method == "GET" and SPREADSHEET_PATH.match(path):
+            self.count("metadata")
+            handler.send_json(200, self._metadata(SPREADSHEET_PATH.match(path).group(1)))
+            return
+
+        if method == "GET" and VALUES_PATH.match(path):
+            with self._rows_lock:
+                values = [list(self.header)] if self.header else []
+            handler.send_json(200, {"range": f"'{self.SHEET_TITLE}'!A1:Z1", "majorDimension": "ROWS",
+                                    "values": values})
+            return
+
+        if method == "POST" and BATCH_UPDATE_PATH.match(path):
+            updates = json.loads(payload or b"{}").get("requests", [])
+            with self._rows_lock:
+                for request in updates:
+                    inserted = request.get("insertDimension", {}).get("range", {})
+                    if inserted.get("startIndex") == 0:
+                        self._header_pending = True
+            handler.send_json(200, {"spreadsheetId": BATCH_UPDATE_PATH.match(path).group(1),
+                                    "replies": [{} for _ in updates]})
+            return
+
+        if method == "POST" and APPEND_PATH.match(path):
+            values = json.loads(payload or b"{}").get("values", [])
+            with self._rows_lock:
+                if self._header_pending and values:
+                    # 先頭への行挿入に続く値の書き込みはヘッダー行
+                    self.header, values = values[0], values[1:]
+                    self._header_pending = False
+                self.rows.extend(values)
+            self.count("rows", len(values))
+            handler.send_json(200, {"updates": {"updatedRows": len(values)}})
+            return
+
+        handler.send_json(404, {"error": {"code": 404, "message": "not found"}})
+
+    def _metadata(self, spreadsheet_id: str) -> Dict:
+        with self._rows_lock:
+            row_count = len(self.rows) + (1 if self.header else 0)
+        return {
+            "spreadsheetId": spreadsheet_id,
+            "properties": {"title": f"Load test {spreadsheet_id}", "locale": "ja_JP",
+                           "timeZone": "Asia/Tokyo"},
+            "sheets": [{
+                "properties": {
+                    "sheetId": 0,
+                    "title": self.SHEET_TITLE,
+                    "index": 0,
+                    "sheetType": "GRID",
+                    "gridProperties": {"rowCount": max(1000, row_count), "columnCount": 26},
+                },
+            }],
+        }
+
+
+class FakeInfluxServer(_LocalServer):
+    """InfluxDB v2 の書き込み API を模倣し、受け取ったポイントを (タグ, 時刻) で数えるサーバー
+
+    gzip 圧縮された本文も受け付ける。 429 / 503 を注入した場合は Retry-After ヘッダーを付ける。
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 rate_429: float = 0.0, rate_5xx: float = 0.0, seed: int = 0,
+                 retry_after: float = 1.0, **kwargs):
+        super().__init__(_FaultInjection(latency_ms, jitter_ms, rate_429, rate_5xx, seed), **kwargs)
+        self.retry_after = retry_after
+        # (measurement とタグ, 時刻) の集合（再送による重複は 1 件として数える）
+        self.points = set()
+        self._points_lock = threading.Lock()
+
+    def write_url(self, org: str = "loadtest", bucket: str = "switchbot") -> str:
+        return f"{self.address}{WRITE_PATH}?org={org}&bucket={bucket}"
+
+    def handle(self, handler, method: str):
+        self.count("requests")
+        length = int(handler.headers.get("Content-Length") or 0)
+        payload = handler.rfile.read(length) if length else b""
+
+        if method != "POST" or handler.path.split("?", 1)[0] != WRITE_PATH:
+            handler.send_json(404, {"code": "not found", "message": "path not found"})
+            return
+
+        status = self.faults.apply()
+        if status is not None:
+            self.count(f"injected_{status}")
+            body = b'{"code":"unavailable","message":"injected error"}'
+            handler.send_response(status)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.send_header("Retry-After", str(self.retry_after))
+            handler.end_headers()
+            handler.wfile.write(body)
+            return
+
+        try:
+            if handler.headers.get("Content-Encoding") == "gzip":
+                self.count("bytes_compressed", len(payload))
+                payload = gzip.decompress(payload)
+            lines = payload.decode("utf-8").splitlines()
+            points = [line.rsplit(" ", 2) for line in lines if line]
+            keys = [(point[0], point[2]) for point in points if len(point) == 3]
+        except (OSError, UnicodeDecodeError) as e:
+            handler.send_json(400, {"code": "invalid", "message": str(e)})
+            return
+        if len(keys) != len(points):
+            handler.send_json(400, {"code": "invalid", "message": "unable to parse points"})
+            return
+
+        with self._points_lock:
+            self.points.update(keys)
+        self.count("lines", len(keys))
+        self.count("bytes", len(payload))
+        handler.send_response(204)
+        handler.send_header("Content-Length", "0")
+        handler.end_headers()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+エンドツーエンドの負荷試験ドライバー
+ローカルの SwitchBot / Google Sheets （ / InfluxDB ）模倣サーバーに対して収集サイクルを実行し、
+スループット、サイクル所要時間（ p50 / p99 ）、メモリ使用量のピーク、データ欠損を報告する
+
+使用例:
+    python -m loadtest.run --devices 1000 --cycles 3 --concurrency 16
+    python -m loadtest.run --devices 1000 --latency-ms 50 --rate-429 0.02 --rate-5xx 0.01
+    python -m loadtest.run --entry http --output loadtest-report.json
+    python -m loadtest.run --devices 1000 --tsdb --tsdb-rate-429 0.1
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import resource
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List
+
+# プロジェクトのルートパスを sys.path に追加
+sys.path.append(str(Path(__file__).parent.parent))
+
+from loadtest.fake_servers import FakeInfluxServer, FakeSheetsServer, FakeSwitchBotServer
+from src.google_sheets import save_to_sheets
+from src.tsdb import LineProtocolSink
+
+
+def service_account_info(sheets_server: FakeSheetsServer) -> Dict:
+    """模倣サーバーからトークンを発行させるサービスアカウント情報（鍵は実行ごとに生成）"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_key = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode("ascii")
+    return {
+        "type": "service_account",
+        "project_id": "loadtest",
+        "private_key_id": "loadtest",
+        "private_key": private_key,
+        "client_email": "loadtest@loadtest.iam.gserviceaccount.com",
+        "token_uri": sheets_server.token_uri,
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    """values の q 分位点（線形補間）"""
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[max(0, min(98, int(q * 100) - 1))]
+
+
+def configure(settings, args, workdir: Path, api_server: FakeSwitchBotServer, sheets_server: FakeSheetsServer):
+    """負荷試験用に設定と環境変数を書き換える"""
+    settings.SWITCHBOT_TOKEN = "loadtest-token"
+    settings.SWITCHBOT_SECRET = "loadtest-secret"
+    settings.SWITCHBOT_DEVICE_IDS = api_server.device_ids
+    settings.SWITCHBOT_API_BASE_URL = api_server.base_url
+    settings.SWITCHBOT_RETRY_BACKOFF = args.retry_backoff
+    settings.COLLECTION_CONCURRENCY = args.concurrency
+    settings.DATABASE_TYPE = "sqlite"
+    settings.DATABASE_PATH = workdir / "temperature.db"
+    settings.SPOOL_DIR = workdir / "spool"
+    settings.SPOOL_DRAIN_TIMEOUT = args.drain_timeout
+    settings.LOG_FILE = workdir / "loadtest.log"
+    settings.LOG_LEVEL = args.log_level
+    # Google Sheets は実際のクライアント（ gspread ）の送信先だけを模倣サーバーに向ける
+    os.environ["GOOGLE_SHEETS_SPREADSHEET_ID"] = "loadtest"
+    os.environ["GOOGLE_SERVICE_ACCOUNT_KEY"] = json.dumps(service_account_info(sheets_server))
+    os.environ["GOOGLE_SHEETS_API_BASE_URL"] = sheets_server.base_url
+
+
+def run_cycle(main_module, entry: str):
+    """収集サイクルを 1 回実行"""
+    if entry == "http":
+        from flask import Flask, request
+
+        app = Flask("loadtest")
+        with app.test_request_context(json={"action": "collect"}):
+            main_module.collect_temperature_data(request)
+    else:
+        main_module.log_temperature_data()
+
+
+def run(args) -> Dict:
+    with tempfile.TemporaryDirectory(prefix="switchbot-loadtest-") as workdir, \
+            FakeSwitchBotServer(args.devices, args.latency_ms, args.jitter_ms,
+                                args.rate_429, args.rate_5xx, seed=args.seed) as api_server, \
+            FakeSheetsServer(args.sheets_latency_ms, args.jitter_ms,
+                             args.sheets_rate_429, args.sheets_rate_5xx, seed=args.seed + 1) as sheets_server, \
+            FakeInfluxServer(args.tsdb_latency_ms, args.jitter_ms, args.tsdb_rate_429, args.tsdb_rate_5xx,
+                             seed=args.seed + 2, retry_after=args.tsdb_retry_after) as tsdb_server:
+        workdir = Path(workdir)
+
+        import main as main_module
+        from config.settings import settings
+        from src.metrics import metrics
+
+        configure(settings, args, workdir, api_server, sheets_server)
+        main_module.configure_logging()
+
+        storage = main_module.get_storage()
+        sinks = {"sheets": save_to_sheets} if not args.no_sheets else {}
+        batch_sinks = {"storage": lambda records: storage.save_batch(records) is not None}
+        if args.tsdb:
+            batch_sinks["tsdb"] = LineProtocolSink(tsdb_server.write_url(), batch_size=args.tsdb_batch_size,
+                                                   max_batch_age=args.tsdb_max_batch_age, retry_backoff=0.05)
+        main_module.get_spool_drainer(sinks=sinks, batch_sinks=batch_sinks)
+
+        # tracemalloc は処理を大きく遅くするため、指定時のみ有効にする
+        if args.trace_memory:
+            tracemalloc.start()
+        cycle_seconds = []
+        started = time.perf_counter()
+        for cycle in range(args.cycles):
+            cycle_start = time.perf_counter()
+            run_cycle(main_module, args.entry)
+            cycle_seconds.append(time.perf_counter() - cycle_start)
+            print(f"サイクル {cycle + 1}/{args.cycles}: {cycle_seconds[-1]:.2f} 秒")
+        collect_seconds = time.perf_counter() - started
+
+        drain_start = time.perf_counter()
+        drained = main_module.flush_spool(stop=True)
+        drain_seconds = time.perf_counter() - drain_start
+        traced_peak = None
+        if args.trace_memory:
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        # Linux では KiB 単位（模倣サーバーも同じプロセスで動くため、その分を含む）
+        rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+        with sqlite3.connect(settings.DATABASE_PATH) as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM temperature_data").fetchone()[0]
+
+        api_requests = metrics.get("switchbot_api_requests_total")
+        api_latency = metrics.get("switchbot_api_request_seconds")
+        fetched = int(api_requests.value(endpoint="status", result="success"))
+        expected = args.devices * args.cycles
+
+        return {
+            "config": vars(args),
+            "cycles": {
+                "count": len(cycle_seconds),
+                "p50_seconds": percentile(cycle_seconds, 0.5),
+                "p99_seconds": percentile(cycle_seconds, 0.99),
+                "max_seconds": max(cycle_seconds),
+            },
+            "throughput_samples_per_sec": fetched / collect_seconds if collect_seconds else None,
+            "api": {
+                "requests": api_server.stats.get("requests", 0),
+                "injected_429": api_server.stats.get("injected_429", 0),
+                "injected_503": api_server.stats.get("injected_503", 0),
+                "retries": int(metrics.get("switchbot_api_retries_total").value(endpoint="status")),
+                "latency_p50_bucket_seconds": api_latency.quantile(0.5, endpoint="status"),
+                "latency_p99_bucket_seconds": api_latency.quantile(0.99, endpoint="status"),
+            },
+            "drain": {"completed": drained, "seconds": drain_seconds},
+            "sheets": {
+                "requests": sheets_server.stats.get("requests", 0),
+                "tokens": sheets_server.stats.get("tokens", 0),
+                "metadata": sheets_server.stats.get("metadata", 0),
+                "unauthorized": sheets_server.stats.get("unauthorized", 0),
+                "injected_429": sheets_server.stats.get("injected_429", 0),
+                "injected_503": sheets_server.stats.get("injected_503", 0),
+            } if not args.no_sheets else None,
+            "tsdb": {
+                "requests": tsdb_server.stats.get("requests", 0),
+                "injected_429": tsdb_server.stats.get("injected_429", 0),
+                "injected_503": tsdb_server.stats.get("injected_503", 0),
+                "lines": tsdb_server.stats.get("lines", 0),
+                "bytes": tsdb_server.stats.get("bytes", 0),
+                "bytes_compressed": tsdb_server.stats.get("bytes_compressed", 0),
+            } if args.tsdb else None,
+            "memory": {"rss_peak_bytes": rss_peak, "traced_peak_bytes": traced_peak},
+            "samples": {
+                "expected": expected,
+                "fetched": fetched,
+                "fetch_failed": expected - fetched,
+                "stored": stored,
+                "sheet_rows": len(sheets_server.rows),
+                # 取得できたのに保存されなかったサンプル（スプールが正しければ 0 ）
+                "lost_in_storage": fetched - stored,
+                "lost_in_sheets": 0 if args.no_sheets else fetched - len(sheets_server.rows),
+                "lost_in_tsdb": fetched - len(tsdb_server.points) if args.tsdb else 0,
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SwitchBot Temperature Logger 負荷試験")
+    parser.add_argument("--devices", type=int, default=1000, help="模倣するデバイス数")
+    parser.add_argument("--cycles", type=int, default=3, help="収集サイクルの回数")
+    parser.add_argument("--entry", choices=("cli", "http"), default="cli",
+                        help="cli: log_temperature_data, http: collect_temperature_data")
+    parser.add_argument("--concurrency", type=int, default=16, help="COLLECTION_CONCURRENCY")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="SwitchBot API の応答遅延（ミリ秒）")
+    parser.add_argument("--jitter-ms", type=float, default=5.0, help="応答遅延のゆらぎ（ミリ秒）")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="SwitchBot API が 429 を返す割合")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="SwitchBot API が 503 を返す割合")
+    parser.add_argument("--sheets-latency-ms", type=float, default=50.0, help="Sheets の応答遅延（ミリ秒）")
+    parser.add_argument("--sheets-rate-429", type=float, default=0.0, help="Sheets が 429 を返す割合")
+    parser.add_argument("--sheets-rate-5xx", type=float, default=0.0, help="Sheets が 503 を返す割合")
+    parser.add_argument("--no-sheets", action="store_true", help="Sheets への送信を行わない")
+    parser.add_argument("--tsdb", action="store_true", help="InfluxDB 模倣サーバーへも line protocol で送信する")
+    parser.add_argument("--tsdb-latency-ms", type=float, default=10.0, help="InfluxDB の応答遅延（ミリ秒）")
+    parser.add_argument("--tsdb-rate-429", type=float, default=0.0, help="InfluxDB が 429 を返す割合")
+    parser.add_argument("--tsdb-rate-5xx", type=float, default=0.0, help="InfluxDB が 503 を返す割合")
+    parser.add_argument("--tsdb-retry-after", type=float, default=0.2, help="InfluxDB が返す Retry-After（秒）")
+    parser.add_argument("--tsdb-batch-size", type=int, default=5000, help="TSDB_BATCH_SIZE")
+    parser.add_argument("--tsdb-max-batch-age", type=float, default=1.0, help="TSDB_MAX_BATCH_AGE（秒）")
+    parser.add_argument("--retry-backoff", type=float, default=0.05, help="SWITCHBOT_RETRY_BACKOFF（秒）")
+    parser.add_argument("--drain-timeout", type=float, default=300.0, help="スプール送信完了を待つ秒数")
+    parser.add_argument("--log-level", default="WARNING", help="負荷試験中のログレベル")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="tracemalloc で Python のメモリ確保量のピークを計測する（低速になる）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    parser.add_argument("--output", type=Path, help="結果を JSON で保存するファイル")
+    args = parser.parse_args()
+
+    report = run(args)
+    report["config"]["output"] = str(args.output) if args.output else None
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    logging.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,11 @@ SwitchBot Temperature Logger
 SwitchBot ハブ 2 の気温データを自動で記録するメインスクリプト
 """
 
+import os
+import sqlite3
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # プロジェクトのルートパスを sys.path に追加
@@ -12,64 +16,431 @@ sys.path.append(str(Path(__file__).parent))
 
 from src.switchbot_api import SwitchBotAPI
 from src.data_storage import create_storage
-from src.logger_config import setup_logging
+from src.spool import Spool, SpoolDrainer, SpoolLockedError
+from src.alerts import AlertingStorage, create_alert_engine
+from src.polling import create_polling_policy
+from src.tsdb import create_tsdb_sink
+from src.metrics import metrics
+from src.logger_config import setup_logging, flush_logging, get_logger
 from config.settings import settings
 
-def log_temperature_data():
-    """温度データを取得して記録する"""
-    logger = setup_logging(settings.LOG_FILE, settings.LOG_LEVEL)
+logger = get_logger(__name__)
+
+COLLECTION_CYCLE_SECONDS = metrics.histogram(
+    "collection_cycle_seconds", "温度データ収集 1 回あたりの所要時間（取得からスプール記録まで）"
+)
+COLLECTION_CYCLES = metrics.counter(
+    "collection_cycles_total", "温度データ収集の実行回数（結果別）"
+)
+
+def configure_logging():
+    """ログ設定を初期化（2 回目以降の呼び出しは既存の設定を使う）"""
+    return setup_logging(
+        settings.LOG_FILE,
+        settings.LOG_LEVEL,
+        json_format=settings.LOG_FORMAT.lower() == "json",
+        rate_limit=settings.LOG_RATE_LIMIT,
+        rate_limit_interval=settings.LOG_RATE_LIMIT_INTERVAL
+    )
+
+_snapshot_manager = None
+_snapshot_manager_loaded = False
+
+def get_snapshot_manager():
+    """SQLite のスナップショット管理を取得（ SNAPSHOT_STORE が未設定、または CSV の場合は None ）"""
+    global _snapshot_manager, _snapshot_manager_loaded
     
-    try:
-        # SwitchBot API クライアントを作成
-        api = SwitchBotAPI(settings.SWITCHBOT_TOKEN, settings.SWITCHBOT_SECRET)
-        
-        # データストレージを作成
+    if not _snapshot_manager_loaded:
+        _snapshot_manager_loaded = True
+        if settings.SNAPSHOT_STORE and settings.DATABASE_TYPE.lower() != "csv":
+            from src.object_store import create_object_store
+            from src.snapshot import SnapshotManager
+            try:
+                _snapshot_manager = SnapshotManager(
+                    settings.DATABASE_PATH,
+                    create_object_store(settings.SNAPSHOT_STORE),
+                    block_size=settings.SNAPSHOT_BLOCK_SIZE,
+                    keep=settings.SNAPSHOT_KEEP,
+                    min_interval=settings.SNAPSHOT_INTERVAL,
+                    on_merge=_invalidate_storage_caches
+                )
+            except Exception as e:
+                logger.error(f"スナップショットの保存先を初期化できませんでした: {e}")
+    
+    return _snapshot_manager
+
+def _invalidate_storage_caches():
+    """他のインスタンスの行を取り込んだ後、直近データ・クエリ結果のキャッシュを破棄する"""
+    if _storage is not None:
+        _storage.invalidate_caches()
+
+def snapshot_database(force: bool = False) -> bool:
+    """データベースのスナップショットを保存（ force でなければ間隔と更新の有無を確認する）"""
+    manager = get_snapshot_manager()
+    if manager is None:
+        return False
+    if force:
+        return manager.snapshot() is not None
+    return manager.snapshot_if_due()
+
+# ウォームスタート時に直近データキャッシュを再利用するため、インスタンスを保持する
+_storage = None
+
+def get_storage():
+    """設定に応じたデータストレージを取得（プロセス内で共有）"""
+    global _storage
+    
+    if _storage is None:
         if settings.DATABASE_TYPE.lower() == "csv":
-            storage = create_storage("csv", settings.CSV_PATH)
+            storage_type, path = "csv", settings.CSV_PATH
         else:
-            storage = create_storage("sqlite", settings.DATABASE_PATH)
+            storage_type, path = "sqlite", settings.DATABASE_PATH
+            # コールドスタートでデータベースがなければ最新のスナップショットから復元する
+            manager = get_snapshot_manager()
+            if manager is not None and not path.exists():
+                manager.restore()
+        _storage = create_storage(
+            storage_type,
+            path,
+            cache_size=settings.RECENT_CACHE_SIZE,
+            cache_warm_hours=settings.RECENT_CACHE_WARM_HOURS,
+            result_cache_size=settings.QUERY_CACHE_SIZE,
+            result_cache_ttl=settings.QUERY_CACHE_TTL,
+            result_cache_rows=settings.QUERY_CACHE_MAX_ROWS
+        )
+        # 保存に成功したサンプルはアラートルールで評価する（スプールからの再送・直接の保存のどちらも）
+        alert_engine = get_alert_engine()
+        if alert_engine is not None:
+            _storage = AlertingStorage(_storage, alert_engine)
+    
+    return _storage
+
+_api = None
+
+def get_api():
+    """SwitchBot API クライアントを取得（プロセス内で接続を再利用する）"""
+    global _api
+    
+    if _api is None:
+        _api = SwitchBotAPI(
+            settings.SWITCHBOT_TOKEN,
+            settings.SWITCHBOT_SECRET,
+            base_url=settings.SWITCHBOT_API_BASE_URL,
+            retry_backoff=settings.SWITCHBOT_RETRY_BACKOFF,
+            pool_size=max(10, settings.COLLECTION_CONCURRENCY)
+        )
+    
+    return _api
+
+_alert_engine = None
+_alert_engine_loaded = False
+
+def get_alert_engine():
+    """アラートエンジンを取得（ ALERT_RULES_FILE が未設定の場合は None ）"""
+    global _alert_engine, _alert_engine_loaded
+    
+    if not _alert_engine_loaded:
+        _alert_engine = create_alert_engine(
+            settings.ALERT_RULES_FILE,
+            state_path=settings.ALERT_STATE_PATH,
+            webhook_url=settings.ALERT_WEBHOOK_URL,
+            state_store=settings.ALERT_STATE_STORE,
+            save_interval=settings.ALERT_STATE_SAVE_INTERVAL
+        )
+        _alert_engine_loaded = True
+    
+    return _alert_engine
+
+def flush_alerts() -> bool:
+    """アラートの状態を保存し、送信待ちの通知を送り終えるまで待機"""
+    if _alert_engine is None:
+        return True
+    _alert_engine.save_state()
+    return _alert_engine.notifier.flush(settings.SPOOL_DRAIN_TIMEOUT)
+
+_polling_policy = None
+_polling_policy_loaded = False
+
+def get_polling_policy():
+    """適応的な取得間隔のポリシーを取得（ POLLING_ADAPTIVE が無効の場合は None ）"""
+    global _polling_policy, _polling_policy_loaded
+    
+    if not _polling_policy_loaded:
+        # アラートルールのしきい値に近づいたデバイスは間隔を縮める
+        alert_engine = get_alert_engine()
+        _polling_policy = create_polling_policy(
+            settings.POLLING_ADAPTIVE,
+            settings.POLLING_MIN_INTERVAL,
+            settings.POLLING_MAX_INTERVAL,
+            settings.POLLING_DAILY_BUDGET,
+            rules=alert_engine.rules if alert_engine else None,
+            state_path=settings.POLLING_STATE_PATH,
+            state_store=settings.POLLING_STATE_STORE
+        )
+        _polling_policy_loaded = True
+    
+    return _polling_policy
+
+_drainer = None
+
+def _build_sinks(storage):
+    """スプールの再送先を構築（ストレージは重複を無視する一括保存で再送する）"""
+    sinks = {}
+    batch_sinks = {'storage': lambda records: storage.save_batch(records) is not None}
+    
+    # Google Sheets にも保存（環境変数が設定されている場合）
+    if os.getenv('GOOGLE_SHEETS_SPREADSHEET_ID'):
+        try:
+            from src.google_sheets import save_to_sheets
+            sinks['sheets'] = save_to_sheets
+        except ImportError:
+            logger.debug("Google Sheets 連携モジュールがインポートできませんでした")
+    
+    # 時系列データベースにも送信（書き込み URL が設定されている場合）
+    tsdb_sink = create_tsdb_sink(
+        settings.TSDB_WRITE_URL,
+        token=settings.TSDB_TOKEN,
+        measurement=settings.TSDB_MEASUREMENT,
+        batch_size=settings.TSDB_BATCH_SIZE,
+        max_batch_age=settings.TSDB_MAX_BATCH_AGE,
+        compress=settings.TSDB_GZIP
+    )
+    if tsdb_sink is not None:
+        batch_sinks['tsdb'] = tsdb_sink
+    
+    return sinks, batch_sinks
+
+def get_spool_drainer(sinks=None, batch_sinks=None):
+    """スプールと再送ワーカーを取得（初回呼び出し時に未送信分の再送を開始）
+    
+    sinks / batch_sinks を指定した場合は初回作成時に既定の再送先の代わりに使う
+    """
+    global _drainer
+    
+    if _drainer is None:
+        spool = Spool(
+            settings.SPOOL_DIR,
+            fsync_batch=settings.SPOOL_FSYNC_BATCH,
+            fsync_interval=settings.SPOOL_FSYNC_INTERVAL
+        )
+        if sinks is None and batch_sinks is None:
+            sinks, batch_sinks = _build_sinks(get_storage())
+        _drainer = SpoolDrainer(spool, sinks, batch_sinks=batch_sinks,
+                                max_pending=settings.SPOOL_MAX_PENDING, max_age=settings.SPOOL_MAX_AGE)
+    
+    _drainer.start()
+    return _drainer
+
+def flush_spool(stop: bool = False) -> bool:
+    """未送信のサンプルを再送し終えるまで待機"""
+    if _drainer is None:
+        return True
+    
+    if stop:
+        _drainer.stop(timeout=settings.SPOOL_DRAIN_TIMEOUT)
+        return not any(_drainer.spool.pending(_drainer.sink_names).values())
+    return _drainer.wait_idle(settings.SPOOL_DRAIN_TIMEOUT)
+
+def spool_failures() -> dict:
+    """未送信のサンプルが残っているシンクの状態を返す（すべて送信済みなら空）"""
+    if _drainer is None:
+        return {}
+    return {name: status for name, status in _drainer.sink_status().items() if status['pending']}
+
+def log_temperature_data() -> str:
+    """温度データを取得してスプールに記録し、結果（ success / partial / skipped / fetch_failed / error ）を返す"""
+    with COLLECTION_CYCLE_SECONDS.time():
+        result = _collect_once()
+    COLLECTION_CYCLES.inc(result=result)
+    return result
+
+def parse_profile_cycles(value) -> int:
+    """プロファイリングの繰り返し回数を検証（未指定は 1 、整数でない・範囲外の場合は ValueError ）"""
+    if value is None or value == '':
+        return 1
+    try:
+        cycles = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"profile_cycles は整数で指定してください: {value}")
+    if not 1 <= cycles <= settings.PROFILE_MAX_CYCLES:
+        raise ValueError(f"profile_cycles は 1 〜 {settings.PROFILE_MAX_CYCLES} で指定してください: {value}")
+    return cycles
+
+def combine_results(results: list) -> str:
+    """複数回の収集結果（ log_temperature_data の戻り値）を 1 つにまとめる"""
+    if results and all(result in ("success", "skipped") for result in results):
+        return "success" if "success" in results else "skipped"
+    if results and all(result in ("fetch_failed", "error") for result in results):
+        return "error" if "error" in results else "fetch_failed"
+    return "partial" if results else "error"
+
+def profile_collection(cycles: int = 1) -> dict:
+    """収集処理（スプールの送信まで）を cycles 回プロファイリングし、要約（各回の収集結果を含む）を返す"""
+    from src.profiling import profile_cycles
+    from src.object_store import create_object_store
+    
+    results = []
+    
+    def cycle():
+        results.append(log_temperature_data())
+        flush_spool()
+    
+    summary = profile_cycles(
+        cycle,
+        create_object_store(settings.PROFILE_DIR),
+        repeat=max(1, cycles),
+        collapsed=settings.PROFILE_COLLAPSED
+    )
+    logger.info(f"プロファイルを保存しました: {', '.join(summary['reports'])}")
+    summary['results'] = results
+    summary['collection'] = combine_results(results)
+    return summary
+
+def _collect_device(api, drainer, device_id: str) -> bool:
+    """1 台分の温度データを取得してスプールに記録"""
+    policy = get_polling_policy()
+    try:
+        sample = api.get_sample(device_id)
+    except Exception as e:
+        logger.error(f"デバイス {device_id} のデータ取得中にエラーが発生しました: {e}")
+        sample = None
+    
+    if policy is not None:
+        # 再試行も 1 日の呼び出し数に含める
+        policy.record(device_id, sample, calls=max(1, api.last_request_count()))
+    
+    if not sample:
+        logger.error(f"デバイス {device_id} の温度データの取得に失敗しました")
+        return False
+    
+    # まずスプールに記録し、ストレージと Google Sheets への保存は再送ワーカーに任せる
+    # （保存の成否は flush_spool / spool_failures で確認する）
+    seq = drainer.spool.append(sample)
+    drainer.notify()
+    logger.info(f"スプールに記録しました: 温度: {sample.temperature}°C, "
+              f"湿度: {sample.humidity}%, "
+              f"照度: {sample.light_level} "
+              f"(デバイス {device_id}, スプール #{seq})")
+    return True
+
+def _collect_devices(api, drainer, device_ids) -> dict:
+    """指定されたデバイスを取得してスプールに記録し、デバイスごとの結果を返す"""
+    if settings.COLLECTION_CONCURRENCY > 1 and len(device_ids) > 1:
+        with ThreadPoolExecutor(max_workers=settings.COLLECTION_CONCURRENCY) as executor:
+            results = list(executor.map(lambda device_id: _collect_device(api, drainer, device_id), device_ids))
+    else:
+        results = [_collect_device(api, drainer, device_id) for device_id in device_ids]
+    return dict(zip(device_ids, results))
+
+def _collect_once() -> str:
+    """設定された全デバイスの温度データを 1 回取得してスプールに記録し、結果を返す"""
+    try:
+        # SwitchBot API クライアントを取得
+        api = get_api()
+        
+        # スプールを取得（前回までの未送信分もバックグラウンドで再送される）
+        drainer = get_spool_drainer()
+        
+        # 適応的な取得間隔が有効な場合は、取得時刻を迎えたデバイスだけを予約して取得する
+        device_ids = settings.SWITCHBOT_DEVICE_IDS
+        policy = get_polling_policy()
+        if policy is not None:
+            device_ids = policy.claim_due_devices(device_ids)
+            if not device_ids:
+                return "skipped"
         
         # 温度データを取得
-        temperature_data = api.get_temperature_data(settings.SWITCHBOT_DEVICE_ID)
+        results = list(_collect_devices(api, drainer, device_ids).values())
+        if policy is not None:
+            policy.save_state()
         
-        if temperature_data:
-            # データを保存
-            success = storage.save_temperature_data(temperature_data)
-            if success:
-                logger.info(f"温度: {temperature_data['temperature']}°C, "
-                          f"湿度: {temperature_data['humidity']}%, "
-                          f"照度: {temperature_data['light_level']}")
-                
-                # Google Sheets にも保存（環境変数が設定されている場合）
-                try:
-                    from src.google_sheets import save_to_sheets
-                    if save_to_sheets(temperature_data):
-                        logger.info("Google Sheets への保存も完了しました")
-                    else:
-                        logger.warning("Google Sheets への保存に失敗しました")
-                except ImportError:
-                    logger.debug("Google Sheets 連携モジュールがインポートできませんでした")
-                except Exception as e:
-                    logger.warning(f"Google Sheets 連携エラー: {e}")
-                    
-            else:
-                logger.error("データの保存に失敗しました")
-        else:
-            logger.error("温度データの取得に失敗しました")
+        if results and all(results):
+            return "success"
+        if any(results):
+            return "partial"
+        return "fetch_failed"
             
     except Exception as e:
         logger.error(f"ログ処理中にエラーが発生しました: {e}")
+        return "error"
+
+def run_worker() -> bool:
+    """分担収集ワーカーとして、停止されるまで担当デバイスの取得を続ける"""
+    import signal
+    from src.sharding import LeaseStore, ShardedWorker
+    
+    try:
+        settings.validate()
+    except ValueError as e:
+        logger.error(f"設定エラー: {e}")
+        return False
+    
+    api = get_api()
+    try:
+        drainer = get_spool_drainer()
+    except SpoolLockedError as e:
+        logger.error(str(e))
+        return False
+    
+    def collect(device_ids):
+        with COLLECTION_CYCLE_SECONDS.time():
+            results = _collect_devices(api, drainer, device_ids)
+        COLLECTION_CYCLES.inc(result="success" if all(results.values()) else "partial")
+        return results
+    
+    worker = ShardedWorker(
+        LeaseStore(settings.WORKER_LEASE_DB_PATH, lease_ttl=settings.WORKER_LEASE_TTL),
+        settings.SWITCHBOT_DEVICE_IDS,
+        collect,
+        worker_id=settings.WORKER_ID,
+        poll_interval=settings.WORKER_POLL_INTERVAL
+    )
+    
+    # SIGTERM / SIGINT ではリースを返却してから終了し、担当デバイスをすぐに引き継がせる
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: worker.stop())
+    
+    worker.run()
+    drained = flush_spool(stop=True)
+    flush_alerts()
+    return drained
+
+def run_polling() -> bool:
+    """適応的な取得間隔で、停止されるまで取得を続ける"""
+    import signal
+    import threading
+    
+    try:
+        settings.validate()
+    except ValueError as e:
+        logger.error(f"設定エラー: {e}")
+        return False
+    
+    policy = get_polling_policy()
+    if policy is None:
+        logger.error("POLLING_ADAPTIVE=true を設定してください")
+        return False
+    
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    
+    logger.info(f"適応的な間隔での取得を開始します（デバイス {len(settings.SWITCHBOT_DEVICE_IDS)} 台、"
+                f"1 日 {settings.POLLING_DAILY_BUDGET} 回まで）")
+    while not stop.is_set():
+        log_temperature_data()
+        delay = policy.next_due(settings.SWITCHBOT_DEVICE_IDS) - time.time()
+        stop.wait(min(max(1.0, delay), settings.POLLING_MAX_INTERVAL))
+    
+    drained = flush_spool(stop=True)
+    flush_alerts()
+    return drained
 
 def cleanup_old_data():
     """古いデータをクリーンアップする"""
-    logger = setup_logging(settings.LOG_FILE, settings.LOG_LEVEL)
-    
     try:
-        # データストレージを作成
-        if settings.DATABASE_TYPE.lower() == "csv":
-            storage = create_storage("csv", settings.CSV_PATH)
-        else:
-            storage = create_storage("sqlite", settings.DATABASE_PATH)
+        # データストレージを取得
+        storage = get_storage()
         
         # 古いデータを削除
         deleted_count = storage.cleanup_old_data(settings.DATA_RETENTION_DAYS)
@@ -80,20 +451,19 @@ def cleanup_old_data():
 
 def test_connection():
     """API 接続をテストする"""
-    logger = setup_logging(settings.LOG_FILE, settings.LOG_LEVEL, console_output=True)
-    
     try:
         settings.validate()
         logger.info("設定の検証が完了しました")
         
-        api = SwitchBotAPI(settings.SWITCHBOT_TOKEN, settings.SWITCHBOT_SECRET)
+        api = get_api()
+        device_id = settings.SWITCHBOT_DEVICE_IDS[0]
         
         logger.info("API 接続をテストしています...")
-        if api.test_connection(settings.SWITCHBOT_DEVICE_ID):
+        if api.test_connection(device_id):
             logger.info("✓ API 接続テストに成功しました")
             
             # テストデータを取得
-            data = api.get_temperature_data(settings.SWITCHBOT_DEVICE_ID)
+            data = api.get_temperature_data(device_id)
             if data:
                 logger.info(f"取得したデータ:")
                 logger.info(f"  温度: {data['temperature']}°C")
@@ -114,13 +484,11 @@ def test_connection():
 
 def list_devices():
     """登録済みデバイス一覧を表示する"""
-    logger = setup_logging(settings.LOG_FILE, settings.LOG_LEVEL, console_output=True)
-    
     try:
         settings.validate()
         logger.info("デバイス一覧を取得しています...")
         
-        api = SwitchBotAPI(settings.SWITCHBOT_TOKEN, settings.SWITCHBOT_SECRET)
+        api = get_api()
         device_data = api.get_device_list()
         
         if device_data:
@@ -164,8 +532,6 @@ def list_devices():
 
 def test_sheets_connection():
     """Google Sheets 接続をテストする"""
-    logger = setup_logging(settings.LOG_FILE, settings.LOG_LEVEL, console_output=True)
-    
     try:
         from src.google_sheets import create_sheets_client_from_env
         
@@ -207,6 +573,56 @@ def test_sheets_connection():
         logger.error(f"✗ Google Sheets テスト中にエラーが発生しました: {e}")
         return False
 
+def import_data(source_path: Path = None, migrate: bool = False, workers: int = None,
+                default_device_id: str = None) -> bool:
+    """CSV ファイルのインポート、または CSV ⇔ SQLite の移行を行う"""
+    from src.migration import Importer
+    
+    if settings.DATABASE_TYPE.lower() == "csv":
+        target_type, target_path = "csv", settings.CSV_PATH
+        other_type, other_path = "sqlite", settings.DATABASE_PATH
+    else:
+        target_type, target_path = "sqlite", settings.DATABASE_PATH
+        other_type, other_path = "csv", settings.CSV_PATH
+    
+    # --migrate は設定されていない方のストレージから設定中のストレージへ移行する
+    source_type = other_type if migrate else "csv"
+    if migrate:
+        source_path = other_path
+    
+    alert_engine = get_alert_engine()
+    try:
+        logger.info(f"{source_path} ({source_type}) から {target_path} ({target_type}) へ読み込みます")
+        importer = Importer(
+            source_path,
+            target_type,
+            target_path,
+            source_type=source_type,
+            workers=workers,
+            default_device_id=default_device_id,
+            # 読み込んだサンプルもアラートルールで評価する（評価済みの時刻より前のサンプルは無視される）
+            on_rows=alert_engine.evaluate_batch if alert_engine is not None else None
+        )
+        result = importer.run()
+    except (OSError, ValueError, sqlite3.Error) as e:
+        logger.error(f"インポート中にエラーが発生しました: {e}")
+        return False
+    
+    logger.info(f"読み込み {result['rows_read']} 行 / 新規 {result['rows_inserted']} 件 / "
+                f"重複 {result['rows_duplicate']} 件 / 解析できない行 {result['rows_invalid']} 件")
+    logger.info(f"入力の期間: {result['source_min']} 〜 {result['source_max']}")
+    logger.info(f"書き込み先の同期間: {result['target_count']} 件 "
+                f"({result['target_min']} 〜 {result['target_max']})")
+    if result['ok']:
+        logger.info(f"✓ {len(result['ranges'])} 範囲の照合に成功しました")
+    else:
+        for entry in result['failed_ranges']:
+            logger.error(f"✗ 入力の {entry['rows'][0] + 1}〜{entry['rows'][1]} 行目 ({entry['min']} 〜 {entry['max']}) の "
+                         f"{entry['missing']} 件が書き込み先にありません")
+        logger.error("✗ 書き込み先にない行があります。同じコマンドを再実行すると最初から読み込み直します（書き込み済みの行は重複として除外されます）")
+    flush_alerts()
+    return result['ok']
+
 def main():
     """メインエントリーポイント"""
     import argparse
@@ -214,12 +630,24 @@ def main():
     parser = argparse.ArgumentParser(description='SwitchBot Temperature Logger')
     parser.add_argument('--test', action='store_true', help='API 接続をテストする')
     parser.add_argument('--once', action='store_true', help='1 回だけ実行する')
+    parser.add_argument('--profile', action='store_true', help='収集処理をプロファイリングしてレポートを保存する')
+    parser.add_argument('--profile-cycles', type=int, default=1, help='プロファイリングで収集を繰り返す回数（ PROFILE_MAX_CYCLES まで）')
+    parser.add_argument('--snapshot', action='store_true', help='データベースのスナップショットを保存する')
+    parser.add_argument('--worker', action='store_true', help='他のワーカーとデバイスを分担して収集を続ける')
+    parser.add_argument('--poll', action='store_true', help='デバイスごとの適応的な間隔で収集を続ける（ POLLING_ADAPTIVE=true ）')
     parser.add_argument('--cleanup', action='store_true', help='古いデータをクリーンアップする')
     parser.add_argument('--devices', action='store_true', help='登録済みデバイス一覧を表示する')
     parser.add_argument('--test-sheets', action='store_true', help='Google Sheets 接続をテストする')
+    parser.add_argument('--import', dest='import_path', metavar='CSV', help='CSV ファイルを設定中のストレージに一括インポートする')
+    parser.add_argument('--migrate', action='store_true', help='CSV と SQLite の間でデータを移行する（ DATABASE_TYPE の方へ）')
+    parser.add_argument('--workers', type=int, help='インポート時の解析プロセス数（既定は CPU 数）')
+    parser.add_argument('--device-id', help='インポートする CSV にデバイス ID の列がない場合に使うデバイス ID')
     
     args = parser.parse_args()
     
+    # ログ設定はプロセス内で 1 回だけ行う
+    configure_logging()
+    
     if args.test:
         success = test_connection()
         sys.exit(0 if success else 1)
@@ -236,9 +664,48 @@ def main():
         cleanup_old_data()
         sys.exit(0)
     
+    if args.snapshot:
+        get_storage()
+        success = snapshot_database(force=True)
+        sys.exit(0 if success else 1)
+    
+    if args.import_path or args.migrate:
+        success = import_data(
+            Path(args.import_path) if args.import_path else None,
+            migrate=args.migrate,
+            workers=args.workers,
+            default_device_id=args.device_id
+        )
+        sys.exit(0 if success else 1)
+    
+    if args.profile:
+        try:
+            cycles = parse_profile_cycles(args.profile_cycles)
+        except ValueError as e:
+            parser.error(str(e))
+        summary = profile_collection(cycles)
+        drained = flush_spool(stop=True)
+        for item in summary['hot_functions']:
+            print(f"{item['cumtime']:>10.4f}s  {item['calls']:>8}  {item['function']}")
+        print(f"レポート: {settings.PROFILE_DIR} ({', '.join(summary['reports'])})")
+        sys.exit(0 if summary['collection'] in ("success", "skipped") and drained else 1)
+    
     if args.once:
-        log_temperature_data()
-        sys.exit(0)
+        result = log_temperature_data()
+        drained = flush_spool(stop=True)
+        if not drained:
+            print("未送信のデータはスプールに残っています。次回実行時に再送されます。")
+        flush_alerts()
+        snapshot_database()
+        sys.exit(0 if result in ("success", "skipped") and drained else 1)
+    
+    if args.worker:
+        success = run_worker()
+        sys.exit(0 if success else 1)
+    
+    if args.poll:
+        success = run_polling()
+        sys.exit(0 if success else 1)
     
     # Google Cloud Functions でのスケジューリングを想定しているため、
     print("Google Cloud Functions でのスケジューリングを想定しているため、")
@@ -248,6 +715,37 @@ def main():
     print("テスト実行: python main.py --test")
     sys.exit(0)
 
+def _handle_query(request, request_json):
+    """保存済みデータを JSON / CSV で返す（ ETag / Last-Modified による条件付き取得に対応）"""
+    from flask import Response, jsonify
+    from src.query import (
+        QueryError, QueryParams, build_etag, content_type, format_http_date,
+        is_not_modified, run_query
+    )
+    
+    params = dict(request.args.items())
+    if request_json:
+        params.update({key: value for key, value in request_json.items() if key != 'action'})
+    
+    try:
+        query = QueryParams(params)
+    except QueryError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    storage = get_storage()
+    last_modified = storage.get_last_modified()
+    etag = build_etag(query, last_modified)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    # 相対期間の結果は書き込みがなくても変わるため、 Last-Modified は期間を指定した場合だけ返す
+    if last_modified is not None and not query.relative:
+        headers['Last-Modified'] = format_http_date(last_modified)
+    
+    # 前回の取得以降に書き込みがなく、相対期間の先頭も変わっていなければ本文を返さない
+    if is_not_modified(request.headers, etag, last_modified, relative=query.relative):
+        return Response(status=304, headers=headers)
+    
+    return Response(run_query(storage, query), headers=headers, content_type=content_type(query))
+
 # Google Cloud Functions 用のエントリーポイント
 def collect_temperature_data(request):
     """
@@ -257,7 +755,8 @@ def collect_temperature_data(request):
     import json
     from flask import jsonify
     
-    logger = setup_logging(settings.LOG_FILE, settings.LOG_LEVEL)
+    # ウォームスタート時は既存のログ設定がそのまま使われる
+    configure_logging()
     
     try:
         logger.info("Cloud Functions での温度データ収集を開始します")
@@ -275,6 +774,10 @@ def collect_temperature_data(request):
         if action == 'cleanup':
             cleanup_old_data()
             return jsonify({'status': 'success', 'message': 'データクリーンアップが完了しました'})
+        elif action == 'query':
+            return _handle_query(request, request_json)
+        elif action == 'metrics':
+            return metrics.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
         elif action == 'test':
             success = test_connection()
             if success:
@@ -282,13 +785,58 @@ def collect_temperature_data(request):
             else:
                 return jsonify({'status': 'error', 'message': 'API 接続テストに失敗しました'}), 500
         else:
-            # デフォルトアクション: 温度データ収集
-            log_temperature_data()
-            return jsonify({'status': 'success', 'message': '温度データの収集が完了しました'})
+            # デフォルトアクション: 温度データ収集（ profile=true の場合はプロファイリングしながら実行）
+            profile_param = request_json.get('profile') if request_json else request.args.get('profile')
+            profile = None
+            if str(profile_param).lower() in ('true', '1'):
+                try:
+                    cycles = parse_profile_cycles(
+                        request_json.get('profile_cycles') if request_json and 'profile_cycles' in request_json
+                        else request.args.get('profile_cycles')
+                    )
+                except ValueError as e:
+                    return jsonify({'status': 'error', 'message': str(e)}), 400
+                profile = profile_collection(cycles)
+                result = profile['collection']
+            else:
+                result = log_temperature_data()
+            
+            # インスタンスが停止される前に、可能な範囲でスプールを送信しておく
+            drained = flush_spool()
+            failed_sinks = spool_failures()
+            flush_alerts()
+            snapshot_database()
+            alert_engine = get_alert_engine()
+            
+            # 取得やストレージ・ Google Sheets への保存に失敗した場合は 500 を返す（サンプルはスプールに残る）
+            if result in ("success", "skipped") and drained:
+                status, message, status_code = 'success', '温度データの収集が完了しました', 200
+            elif result in ("fetch_failed", "error"):
+                status, message, status_code = 'error', '温度データの取得に失敗しました', 500
+            else:
+                status, message, status_code = 'partial', '一部のデバイスの取得、または保存先への送信に失敗しました', 500
+            response = {
+                'status': status,
+                'message': message,
+                'collection': result,
+                'spool_drained': drained,
+                'failed_sinks': failed_sinks,
+                'active_alerts': alert_engine.active_alerts() if alert_engine else [],
+                'metrics': metrics.snapshot()
+            }
+            if profile is not None:
+                response['profile'] = profile
+            policy = get_polling_policy()
+            if policy is not None:
+                response['polling'] = policy.stats()
+            return jsonify(response), status_code
             
     except Exception as e:
         logger.error(f"Cloud Functions 実行中にエラーが発生しました: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        # インスタンスが停止される前にキューに残ったログを出力しておく
+        flush_logging()
 
 if __name__ == "__main__":
     main()
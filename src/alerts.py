@@ -0,0 +1,532 @@
+"""
+アラートルールエンジン
+保存済みのサンプルをルールで評価し、状態が変化したときに通知を非同期で送信する
+"""
+
+import json
+import math
+import queue
+import threading
+import time
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+from .data_storage import DataStorage, SampleRow
+from .metrics import metrics
+from .sample import Sample, SampleBatch, SampleLike, sample_field, sample_time
+from .object_store import LocalDirectoryStore, ObjectStore, create_object_store
+
+ALERT_EVALUATIONS = metrics.counter("alert_evaluations_total", "アラートルールを評価したサンプル数")
+ALERT_TRANSITIONS = metrics.counter("alert_transitions_total", "アラートの発生/解消の回数（ルール・状態別）")
+ALERT_NOTIFY_FAILURES = metrics.counter("alert_notify_failures_total", "通知の送信に失敗した回数")
+
+FIELDS = ('temperature', 'humidity', 'light_level')
+STATE_KEY = "alert_state.json"
+# 他のプロセスとの競合で状態を保存できない場合に再試行する回数
+STATE_ATTEMPTS = 5
+
+
+class Rule(ABC):
+    """アラートルールの基底クラス
+
+    デバイスごとの状態は数値のリスト（ JSON に保存できる固定長）で保持する。
+    """
+
+    rule_type = ""
+
+    def __init__(self, name: str, field: str = 'temperature', device_ids: Optional[List[str]] = None):
+        if field not in FIELDS:
+            raise ValueError(f"ルール '{name}' の field が不正です: {field}")
+        self.name = name
+        self.field = field
+        self.device_ids = set(device_ids) if device_ids else None
+
+    def applies_to(self, device_id: str) -> bool:
+        return self.device_ids is None or device_id in self.device_ids
+
+    def initial_state(self) -> List:
+        return []
+
+    @abstractmethod
+    def check(self, state: List, timestamp: float, value: float) -> Optional[str]:
+        """状態を更新し、条件を満たしていればその説明を返す（満たさなければ None ）"""
+        pass
+
+
+class _BoundsMixin:
+    """above / below の上下限を持つルール"""
+
+    def _init_bounds(self, above: Optional[float], below: Optional[float]):
+        if above is None and below is None:
+            raise ValueError(f"ルール '{self.name}' には above または below が必要です")
+        self.above = above
+        self.below = below
+
+    def _out_of_bounds(self, value: float) -> Optional[str]:
+        if self.above is not None and value > self.above:
+            return f"{self.field}={value} が上限 {self.above} を超えています"
+        if self.below is not None and value < self.below:
+            return f"{self.field}={value} が下限 {self.below} を下回っています"
+        return None
+
+
+class ThresholdRule(_BoundsMixin, Rule):
+    """しきい値ルール"""
+
+    rule_type = "threshold"
+
+    def __init__(self, name: str, field: str = 'temperature', device_ids: Optional[List[str]] = None,
+                 above: Optional[float] = None, below: Optional[float] = None):
+        super().__init__(name, field, device_ids)
+        self._init_bounds(above, below)
+
+    def check(self, state: List, timestamp: float, value: float) -> Optional[str]:
+        return self._out_of_bounds(value)
+
+
+class SustainedRule(_BoundsMixin, Rule):
+    """しきい値を duration_minutes 分以上超え続けた場合のルール"""
+
+    rule_type = "sustained"
+
+    def __init__(self, name: str, field: str = 'temperature', device_ids: Optional[List[str]] = None,
+                 above: Optional[float] = None, below: Optional[float] = None,
+                 duration_minutes: float = 15):
+        super().__init__(name, field, device_ids)
+        self._init_bounds(above, below)
+        self.duration = duration_minutes * 60
+
+    def initial_state(self) -> List:
+        # [超過し始めた時刻]
+        return [None]
+
+    def check(self, state: List, timestamp: float, value: float) -> Optional[str]:
+        reason = self._out_of_bounds(value)
+        if reason is None:
+            state[0] = None
+            return None
+        if state[0] is None:
+            state[0] = timestamp
+        elapsed = timestamp - state[0]
+        if elapsed >= self.duration:
+            return f"{reason}（ {elapsed / 60:.0f} 分継続）"
+        return None
+
+
+class RateOfChangeRule(Rule):
+    """直前のサンプルからの変化量が per_minutes 分あたり max_change を超えた場合のルール"""
+
+    rule_type = "rate"
+
+    def __init__(self, name: str, field: str = 'temperature', device_ids: Optional[List[str]] = None,
+                 max_change: float = 1.0, per_minutes: float = 1):
+        super().__init__(name, field, device_ids)
+        self.max_change = max_change
+        self.per_minutes = per_minutes
+
+    def initial_state(self) -> List:
+        # [直前の時刻, 直前の値]
+        return [None, None]
+
+    def check(self, state: List, timestamp: float, value: float) -> Optional[str]:
+        previous_ts, previous_value = state
+        state[0], state[1] = timestamp, value
+        if previous_ts is None or timestamp <= previous_ts:
+            return None
+        change = (value - previous_value) / ((timestamp - previous_ts) / 60) * self.per_minutes
+        if abs(change) > self.max_change:
+            return f"{self.field} が {self.per_minutes} 分あたり {change:+.2f} 変化しました（上限 {self.max_change} ）"
+        return None
+
+
+class ZScoreRule(Rule):
+    """指数移動平均と分散から求めた z スコアで外れ値を検知するルール"""
+
+    rule_type = "zscore"
+
+    def __init__(self, name: str, field: str = 'temperature', device_ids: Optional[List[str]] = None,
+                 alpha: float = 0.1, threshold: float = 3.0, min_samples: int = 10):
+        super().__init__(name, field, device_ids)
+        if not 0 < alpha <= 1:
+            raise ValueError(f"ルール '{name}' の alpha は 0 より大きく 1 以下にしてください: {alpha}")
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_samples = min_samples
+
+    def initial_state(self) -> List:
+        # [サンプル数, 平均, 分散]
+        return [0, 0.0, 0.0]
+
+    def check(self, state: List, timestamp: float, value: float) -> Optional[str]:
+        count, mean, variance = state
+        result = None
+        if count >= self.min_samples and variance > 0:
+            z = (value - mean) / math.sqrt(variance)
+            if abs(z) > self.threshold:
+                result = f"{self.field}={value} が平均 {mean:.2f} から外れています（ z={z:+.2f} ）"
+
+        if count == 0:
+            mean = value
+        else:
+            diff = value - mean
+            increment = self.alpha * diff
+            mean += increment
+            variance = (1 - self.alpha) * (variance + diff * increment)
+        state[0], state[1], state[2] = count + 1, mean, variance
+        return result
+
+
+RULE_TYPES = {
+    rule_class.rule_type: rule_class
+    for rule_class in (ThresholdRule, SustainedRule, RateOfChangeRule, ZScoreRule)
+}
+
+
+def create_rule(config: Dict) -> Rule:
+    """設定（辞書）からルールを作成"""
+    options = dict(config)
+    rule_type = options.pop('type', None)
+    rule_class = RULE_TYPES.get(rule_type)
+    if rule_class is None:
+        raise ValueError(f"サポートされていないルールの種類です: {rule_type}")
+    name = options.pop('name', None) or f"{rule_type}-{options.get('field', 'temperature')}"
+    try:
+        return rule_class(name, **options)
+    except TypeError as e:
+        raise ValueError(f"ルール '{name}' の設定が不正です: {e}")
+
+
+def load_rules(path: Path) -> List[Rule]:
+    """JSON ファイル（ルール設定の配列）からルールを読み込む"""
+    with open(path, 'r', encoding='utf-8') as f:
+        configs = json.load(f)
+    rules = [create_rule(config) for config in configs]
+    names = [rule.name for rule in rules]
+    if len(names) != len(set(names)):
+        raise ValueError("ルール名が重複しています")
+    return rules
+
+
+class Notifier(ABC):
+    """通知先の基底クラス"""
+
+    @abstractmethod
+    def send(self, alert: Dict):
+        """アラートを送信（失敗時は例外を送出）"""
+        pass
+
+
+class LogNotifier(Notifier):
+    """ログに出力する通知先"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+    def send(self, alert: Dict):
+        if alert['state'] == 'firing':
+            self.logger.warning(f"アラート発生 [{alert['rule']}] デバイス {alert['device_id']}: {alert['message']}")
+        else:
+            self.logger.info(f"アラート解消 [{alert['rule']}] デバイス {alert['device_id']}")
+
+
+class WebhookNotifier(Notifier):
+    """アラートを JSON で POST する通知先"""
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, alert: Dict):
+        response = self.session.post(self.url, json=alert, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class AsyncNotifier:
+    """通知をキューに入れ、バックグラウンドスレッドで各通知先に送信する"""
+
+    def __init__(self, notifiers: List[Notifier], queue_size: int = 1000):
+        self.notifiers = notifiers
+        self.logger = logging.getLogger(__name__)
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="alert-notifier", daemon=True)
+                self._thread.start()
+
+    def notify(self, alert: Dict):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            ALERT_NOTIFY_FAILURES.inc(notifier="queue")
+            self.logger.error(f"通知キューが満杯のためアラートを破棄しました: {alert['rule']}")
+
+    def _run(self):
+        while True:
+            alert = self._queue.get()
+            try:
+                for notifier in self.notifiers:
+                    try:
+                        notifier.send(alert)
+                    except Exception as e:
+                        ALERT_NOTIFY_FAILURES.inc(notifier=type(notifier).__name__)
+                        self.logger.error(f"アラート通知の送信に失敗しました ({type(notifier).__name__}): {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """キューに残っている通知を送信し終えるまで待機"""
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(lambda: self._queue.unfinished_tasks == 0, timeout)
+
+
+class AlertEngine:
+    """保存済みサンプルにルールを適用し、状態の変化（発生/解消）を通知する
+
+    ルール×デバイスごとに [最後に評価した時刻, 発生中か, ルール固有の状態] をメモリ上に保持し、
+    評価では I/O を行わない。状態は save_interval 秒ごと（と flush 時）に store に保存し、
+    起動時に読み込んで再起動やインスタンスの入れ替わり後も引き継ぐ。
+
+    複数のプロセスが同じ store を使う場合は、保存時に保存先の最新の状態を読み込み、
+    より新しいサンプルまで評価された状態を優先して版を条件に書き込む（競合したら読み直して再試行）。
+    """
+
+    def __init__(self, rules: List[Rule], notifier: AsyncNotifier, store: Optional[ObjectStore] = None,
+                 state_key: str = STATE_KEY, save_interval: float = 60.0):
+        self.rules = rules
+        self.notifier = notifier
+        self.store = store
+        self.state_key = state_key
+        self.save_interval = save_interval
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._states: Dict[Tuple[str, str], List] = {}
+        # 保存先に未反映の状態のキー
+        self._dirty = set()
+        self._last_saved = time.monotonic()
+        self._apply_saved(self._read_state()[0])
+
+    def _read_state(self) -> Tuple[Optional[Dict], Optional[str]]:
+        """保存先の状態と版を読み込む（読み込めない場合は (None, None) ）"""
+        if self.store is None:
+            return None, None
+        try:
+            data, version = self.store.get_with_version(self.state_key)
+            return (json.loads(data) if data else None), version
+        except Exception as e:
+            self.logger.error(f"アラート状態の読み込みに失敗しました: {e}")
+            return None, None
+
+    def _apply_saved(self, saved: Optional[Dict]):
+        """保存先の状態を取り込む（未保存の状態は、保存先の方が新しいサンプルまで評価している場合だけ置き換える）"""
+        if not saved:
+            return
+        rule_names = {rule.name for rule in self.rules}
+        with self._lock:
+            for key, state in saved.items():
+                rule_name, _, device_id = key.partition('|')
+                if rule_name not in rule_names:
+                    continue
+                current = self._states.get((rule_name, device_id))
+                if (rule_name, device_id) in self._dirty and current is not None \
+                        and (state[0] is None or (current[0] is not None and current[0] >= state[0])):
+                    continue
+                self._states[(rule_name, device_id)] = state
+                self._dirty.discard((rule_name, device_id))
+
+    def save_state(self):
+        """未保存の状態を保存先の最新の状態に重ねて保存（他のプロセスと競合した場合は読み直して再試行）"""
+        if self.store is None:
+            return
+        for _ in range(STATE_ATTEMPTS):
+            with self._lock:
+                if not self._dirty:
+                    self._last_saved = time.monotonic()
+                    return
+            saved, version = self._read_state()
+            self._apply_saved(saved)
+            with self._lock:
+                written = set(self._dirty)
+                content = dict(saved or {})
+                content.update({f"{rule_name}|{device_id}": self._states[(rule_name, device_id)]
+                                for rule_name, device_id in written})
+                data = json.dumps(content).encode('utf-8')
+                self._dirty.clear()
+            try:
+                if self.store.put_if(self.state_key, data, version):
+                    self._last_saved = time.monotonic()
+                    return
+            except Exception as e:
+                with self._lock:
+                    self._dirty.update(written)
+                self.logger.error(f"アラート状態の保存に失敗しました: {e}")
+                return
+            with self._lock:
+                self._dirty.update(written)
+        self.logger.error("他のプロセスとの競合が続いたため、アラート状態を保存できませんでした")
+
+    def save_state_if_due(self):
+        """前回の保存から save_interval 秒以上経過していれば保存"""
+        if time.monotonic() - self._last_saved >= self.save_interval:
+            self.save_state()
+
+    def evaluate(self, data: SampleLike):
+        """1 件のサンプル（ Sample または辞書）を評価"""
+        device_id = sample_field(data, 'device_id')
+        timestamp = sample_time(data)
+        if device_id is None or timestamp is None:
+            return
+        ALERT_EVALUATIONS.inc()
+
+        with self._lock:
+            for rule in self.rules:
+                value = sample_field(data, rule.field)
+                if value is None or not rule.applies_to(device_id):
+                    continue
+                key = (rule.name, device_id)
+                state = self._states.get(key)
+                if state is None:
+                    state = [None, False, rule.initial_state()]
+                    self._states[key] = state
+                # スプールからの再送などで評価済みのサンプルは無視する
+                if state[0] is not None and timestamp <= state[0]:
+                    continue
+                state[0] = timestamp
+                self._dirty.add(key)
+
+                reason = rule.check(state[2], timestamp, float(value))
+                firing = reason is not None
+                if firing != state[1]:
+                    state[1] = firing
+                    self._dispatch(rule, data, firing, reason)
+
+    def evaluate_batch(self, records: Iterable[SampleLike]):
+        """複数のサンプルを時刻順に評価（保存の間隔を過ぎていれば状態を保存）"""
+        records = sorted(records, key=lambda item: sample_time(item) or 0.0)
+        if not records:
+            return
+        for data in records:
+            self.evaluate(data)
+        self.save_state_if_due()
+
+    def _dispatch(self, rule: Rule, data: SampleLike, firing: bool, reason: Optional[str]):
+        state = 'firing' if firing else 'resolved'
+        if isinstance(data, Sample):
+            data = data.to_dict()
+        ALERT_TRANSITIONS.inc(rule=rule.name, state=state)
+        self.notifier.notify({
+            'rule': rule.name,
+            'type': rule.rule_type,
+            'state': state,
+            'device_id': data.get('device_id'),
+            'field': rule.field,
+            'value': data.get(rule.field),
+            'timestamp': data.get('timestamp'),
+            'message': reason or f"{rule.field}={data.get(rule.field)} は正常範囲に戻りました",
+        })
+
+    def active_alerts(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {'rule': rule_name, 'device_id': device_id}
+                for (rule_name, device_id), state in sorted(self._states.items()) if state[1]
+            ]
+
+
+class AlertingStorage(DataStorage):
+    """保存に成功したサンプルをアラートルールで評価するストレージラッパー
+
+    ストレージへの直接の保存・スプールからの再送のどちらも評価する。評価に失敗しても
+    保存の結果は変えない（保存済みのサンプルを再送させない）。
+    """
+
+    def __init__(self, backend: DataStorage, engine: AlertEngine):
+        self.backend = backend
+        self.engine = engine
+        self.backend_name = backend.backend_name
+        self.result_cache = backend.result_cache
+        self.logger = logging.getLogger(__name__)
+
+    def _evaluate(self, records: List[SampleLike]):
+        try:
+            self.engine.evaluate_batch(records)
+        except Exception as e:
+            self.logger.error(f"アラートの評価中にエラーが発生しました: {e}")
+
+    def save_temperature_data(self, data: SampleLike) -> bool:
+        success = self.backend.save_temperature_data(data)
+        if success:
+            self._evaluate([data])
+        return success
+
+    def save_batch(self, records: Iterable[SampleLike]) -> Optional[int]:
+        records = records if isinstance(records, (list, SampleBatch)) else list(records)
+        saved_count = self.backend.save_batch(records)
+        if saved_count is not None:
+            self._evaluate(records)
+        return saved_count
+
+    def get_recent_data(self, hours: int = 24) -> List[Dict]:
+        return self.backend.get_recent_data(hours)
+
+    def get_recent_batch(self, hours: int = 24) -> SampleBatch:
+        return self.backend.get_recent_batch(hours)
+
+    def cleanup_old_data(self, days: int) -> int:
+        return self.backend.cleanup_old_data(days)
+
+    def iter_range(self, start: datetime, end: Optional[datetime] = None,
+                   device_id: Optional[str] = None) -> Iterator[Dict]:
+        return self.backend.iter_range(start, end, device_id)
+
+    def iter_range_rows(self, start: datetime, end: Optional[datetime] = None,
+                        device_id: Optional[str] = None) -> Iterator[SampleRow]:
+        return self.backend.iter_range_rows(start, end, device_id)
+
+    def get_last_modified(self) -> Optional[float]:
+        return self.backend.get_last_modified()
+
+    def invalidate_caches(self):
+        self.backend.invalidate_caches()
+
+
+def create_alert_engine(rules_file: Optional[Path], state_path: Optional[Path] = None,
+                        webhook_url: Optional[str] = None, state_store: Optional[str] = None,
+                        save_interval: float = 60.0) -> Optional[AlertEngine]:
+    """設定からアラートエンジンを作成（ルールファイルが未指定または読み込めない場合は None ）
+
+    state_store（ gs://bucket/prefix またはディレクトリ）を指定した場合はそこに、
+    それ以外は state_path のファイルに状態を保存する。
+    """
+    logger = logging.getLogger(__name__)
+    if not rules_file:
+        return None
+    try:
+        rules = load_rules(rules_file)
+    except (OSError, ValueError) as e:
+        logger.error(f"アラートルールの読み込みに失敗しました: {e}")
+        return None
+    if not rules:
+        return None
+
+    notifiers: List[Notifier] = [LogNotifier()]
+    if webhook_url:
+        notifiers.append(WebhookNotifier(webhook_url))
+    logger.debug(f"アラートルールを {len(rules)} 件読み込みました")
+    if state_store:
+        store, state_key = create_object_store(state_store), STATE_KEY
+    elif state_path:
+        store, state_key = LocalDirectoryStore(Path(state_path).parent), Path(state_path).name
+    else:
+        store, state_key = None, STATE_KEY
+    return AlertEngine(rules, AsyncNotifier(notifiers), store, state_key, save_interval=save_interval)
@@ -1,35 +1,157 @@
 import csv
+import os
 import sqlite3
 import logging
+from contextlib import closing
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import functools
+import heapq
+from operator import itemgetter
 from abc import ABC, abstractmethod
 
+from .metrics import metrics
+from .sample import Sample, SampleBatch, SampleLike, sample_time
+from .sample_cache import RecentSampleCache, RowFactory
+from .result_cache import QueryResultCache
+
+STORAGE_OPERATION_SECONDS = metrics.histogram(
+    "storage_operation_seconds", "データストレージ操作の所要時間"
+)
+# 間引き処理などで使う軽量な行: (timestamp, device_id, temperature, humidity, light_level)
+SampleRow = Tuple[str, str, Optional[float], Optional[float], Optional[float]]
+
+# CSV ファイルの列（保存順）
+CSV_COLUMNS = ('timestamp', 'device_id', 'temperature', 'humidity', 'light_level', 'device_type', 'version')
+
+STORAGE_CACHE_REQUESTS = metrics.counter(
+    "storage_cache_requests_total", "直近データキャッシュへの問い合わせ数（ hit / miss / bypass ）"
+)
+
+def _row_values(data: SampleLike) -> tuple:
+    """保存する列の値（辞書の時刻は受け取った文字列のまま保存する）"""
+    if isinstance(data, Sample):
+        return data.row()
+    return (
+        data.get('timestamp'),
+        data.get('device_id'),
+        data.get('temperature'),
+        data.get('humidity'),
+        data.get('light_level'),
+        data.get('device_type'),
+        data.get('version')
+    )
+
+def _read_lines(fd: int, start: int, end: int, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+    """ファイルの start から end までを行ごとに返す（ os.pread で読むため、同じファイルを複数箇所から並行して読める）"""
+    pending = b''
+    position = start
+    while position < end:
+        chunk = os.pread(fd, min(chunk_size, end - position), position)
+        if not chunk:
+            break
+        position += len(chunk)
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+def _instrumented(operation: str):
+    """ストレージ操作の所要時間を backend / operation ラベル付きで記録するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with STORAGE_OPERATION_SECONDS.time(backend=self.backend_name, operation=operation):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 class DataStorage(ABC):
     """データストレージの抽象基底クラス"""
     
+    # メトリクスのラベルに使うバックエンド名
+    backend_name = "unknown"
+    
+    # クエリ結果キャッシュ（ ResultCachingStorage でラップした場合のみ）
+    result_cache: Optional[QueryResultCache] = None
+    
+    # get_recent_data が新しい順に返すか（直近データキャッシュが同じ順に並べる）
+    recent_newest_first = False
+    
     @abstractmethod
-    def save_temperature_data(self, data: Dict) -> bool:
-        """温度データを保存"""
+    def save_temperature_data(self, data: SampleLike) -> bool:
+        """温度データ（ Sample または辞書）を保存"""
         pass
     
+    def save_batch(self, records: Iterable[SampleLike]) -> Optional[int]:
+        """複数の温度データをまとめて保存（新規に保存した件数、失敗時は None ）"""
+        saved_count = 0
+        for data in records:
+            if not self.save_temperature_data(data):
+                return None
+            saved_count += 1
+        return saved_count
+    
     @abstractmethod
     def get_recent_data(self, hours: int = 24) -> List[Dict]:
         """最近のデータを取得"""
         pass
     
+    def get_recent_batch(self, hours: int = 24) -> SampleBatch:
+        """最近のデータを新しい順に SampleBatch で取得"""
+        batch = SampleBatch()
+        for row in self.get_recent_data(hours):
+            try:
+                batch.append(row)
+            except (KeyError, TypeError, ValueError):
+                continue
+        return batch
+    
     @abstractmethod
     def cleanup_old_data(self, days: int) -> int:
         """古いデータを削除"""
         pass
+    
+    @abstractmethod
+    def iter_range(self, start: datetime, end: Optional[datetime] = None,
+                   device_id: Optional[str] = None) -> Iterator[Dict]:
+        """期間内のデータを時刻昇順で 1 件ずつ返す（ end は含まない）"""
+        pass
+    
+    def iter_range_rows(self, start: datetime, end: Optional[datetime] = None,
+                        device_id: Optional[str] = None) -> Iterator[SampleRow]:
+        """期間内の数値データを辞書ではなくタプルで時刻昇順に返す"""
+        for row in self.iter_range(start, end, device_id):
+            yield (row['timestamp'], row['device_id'], row.get('temperature'),
+                   row.get('humidity'), row.get('light_level'))
+    
+    @abstractmethod
+    def get_last_modified(self) -> Optional[float]:
+        """最後に書き込まれた時刻（エポック秒）を返す"""
+        pass
+    
+    def invalidate_caches(self):
+        """ストレージを介さずにデータが更新された場合（スナップショットの取り込みなど）にキャッシュを破棄"""
+        pass
+    
+    def recent_row_factory(self) -> Optional[RowFactory]:
+        """直近データキャッシュから get_recent_data と同じ形の行を組み立てる関数を返す（組み立てられない場合は None ）"""
+        return None
 
 class CSVStorage(DataStorage):
     """CSV ファイルによるデータストレージ"""
     
+    backend_name = "csv"
+    
     def __init__(self, file_path: Path):
         self.file_path = file_path
         self.logger = logging.getLogger(__name__)
+        # (device_id, timestamp) の重複排除インデックス（初回書き込み時に構築）
+        self._dedupe_index: Optional[set] = None
+        self._indexed_size = -1
         self._ensure_file_exists()
     
     def _ensure_file_exists(self):
@@ -38,33 +160,76 @@ class CSVStorage(DataStorage):
             self.file_path.parent.mkdir(parents=True, exist_ok=True)
             with open(self.file_path, 'w', newline='', encoding='utf-8') as f:
                 writer = csv.writer(f)
-                writer.writerow([
-                    'timestamp', 'device_id', 'temperature', 'humidity',
-                    'light_level', 'device_type', 'version'
-                ])
+                writer.writerow(CSV_COLUMNS)
     
-    def save_temperature_data(self, data: Dict) -> bool:
-        """温度データを CSV に保存"""
+    def _get_dedupe_index(self) -> set:
+        """重複排除インデックスを取得（他プロセスがファイルを更新していれば再構築）"""
+        current_size = self.file_path.stat().st_size
+        if self._dedupe_index is None or current_size != self._indexed_size:
+            index = set()
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                reader = csv.DictReader(f)
+                for row in reader:
+                    index.add((row['device_id'], row['timestamp']))
+            self._dedupe_index = index
+            self._indexed_size = current_size
+        return self._dedupe_index
+    
+    def _append_rows(self, records: List[SampleLike]) -> int:
+        """重複していない行だけを追記し、追記した件数を返す"""
+        return self.append_values([_row_values(data) for data in records])
+    
+    def append_values(self, values: List) -> int:
+        """CSV の列順の値（ timestamp, device_id, ... ）のうち重複していない行だけを追記"""
+        index = self._get_dedupe_index()
+        rows = []
+        for row in values:
+            key = (row[1], row[0])
+            if key in index:
+                continue
+            index.add(key)
+            rows.append(row)
+        
+        if rows:
+            try:
+                with open(self.file_path, 'a', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    writer.writerows(rows)
+            finally:
+                self._indexed_size = self.file_path.stat().st_size
+        return len(rows)
+    
+    @_instrumented("save")
+    def save_temperature_data(self, data: SampleLike) -> bool:
+        """温度データを CSV に保存（保存済みのサンプルは追記しない）"""
         try:
-            with open(self.file_path, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    data.get('timestamp'),
-                    data.get('device_id'),
-                    data.get('temperature'),
-                    data.get('humidity'),
-                    data.get('light_level'),
-                    data.get('device_type'),
-                    data.get('version')
-                ])
-            self.logger.info(f"データを保存しました: {data.get('timestamp')}")
+            values = _row_values(data)
+            if self.append_values([values]):
+                self.logger.info(f"データを保存しました: {values[0]}")
+            else:
+                self.logger.debug(f"保存済みのデータのためスキップしました: {values[0]}")
             return True
         except Exception as e:
+            self._dedupe_index = None
             self.logger.error(f"CSV への保存に失敗しました: {e}")
             return False
     
+    @_instrumented("save_batch")
+    def save_batch(self, records: Iterable[SampleLike]) -> Optional[int]:
+        """複数の温度データをまとめて CSV に保存"""
+        records = list(records)
+        try:
+            saved_count = self._append_rows(records)
+            self.logger.info(f"{saved_count} 件のデータを保存しました（重複 {len(records) - saved_count} 件）")
+            return saved_count
+        except Exception as e:
+            self._dedupe_index = None
+            self.logger.error(f"CSV への一括保存に失敗しました: {e}")
+            return None
+    
+    @_instrumented("get_recent_data")
     def get_recent_data(self, hours: int = 24) -> List[Dict]:
-        """最近のデータを CSV から取得"""
+        """最近のデータを CSV から時刻昇順で取得（スプールの再送などで前後した行も並べ直す）"""
         try:
             cutoff_time = datetime.now() - timedelta(hours=hours)
             recent_data = []
@@ -76,11 +241,13 @@ class CSVStorage(DataStorage):
                     if timestamp >= cutoff_time:
                         recent_data.append(row)
             
+            recent_data.sort(key=itemgetter('timestamp'))
             return recent_data
         except Exception as e:
             self.logger.error(f"CSV からのデータ取得に失敗しました: {e}")
             return []
     
+    @_instrumented("cleanup")
     def cleanup_old_data(self, days: int) -> int:
         """古いデータを削除"""
         try:
@@ -102,16 +269,116 @@ class CSVStorage(DataStorage):
                         deleted_count += 1
             
             temp_file.replace(self.file_path)
+            # 削除した行がインデックスに残らないよう、次回書き込み時に再構築する
+            self._dedupe_index = None
             self.logger.info(f"{deleted_count} 件の古いデータを削除しました")
             return deleted_count
             
         except Exception as e:
             self.logger.error(f"古いデータの削除に失敗しました: {e}")
             return 0
+    
+    # 時刻順に並んだ区間をいくつまで並行して読みながらマージするか（超えた場合はまとめて並べ替える）
+    MAX_MERGE_RUNS = 64
+    
+    def _sorted_runs(self, fd: int, start_key: bytes, end_key: Optional[bytes]) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """ヘッダーと、期間内の行が時刻昇順に並んでいる区間（バイト位置）の一覧を返す
+        
+        スプールの再送やインポートで追記された行はファイル内で時刻順になっていないため、
+        期間内の行の時刻が戻った位置で区間を分ける。時刻は先頭の列をそのまま比較する。
+        """
+        lines = _read_lines(fd, 0, os.fstat(fd).st_size)
+        header_line = next(lines, b'')
+        header = next(csv.reader([header_line.decode('utf-8')]), [])
+        runs = []
+        offset = len(header_line)
+        run_start = None
+        previous = None
+        for line in lines:
+            timestamp = line.split(b',', 1)[0]
+            if timestamp >= start_key and (end_key is None or timestamp < end_key):
+                if run_start is None:
+                    run_start = offset
+                elif timestamp < previous:
+                    runs.append((run_start, offset))
+                    run_start = offset
+                previous = timestamp
+            offset += len(line)
+        if run_start is not None:
+            runs.append((run_start, offset))
+        return header, runs
+    
+    def _iter_sorted(self, start: datetime, end: Optional[datetime], device_id: Optional[str],
+                     make_row) -> Iterator:
+        """期間内の行を make_row で変換し、ファイル全体を読み込まずに時刻昇順で返す
+        
+        時刻順に並んだ区間ごとに読み進めながらマージする（ほぼ整列済みのため区間は少ない）。
+        区間が MAX_MERGE_RUNS を超える場合だけ、期間内の行をまとめて並べ替える。
+        """
+        start_key = start.isoformat()
+        end_key = end.isoformat() if end else None
+        
+        with open(self.file_path, 'rb') as f:
+            fd = f.fileno()
+            header, runs = self._sorted_runs(
+                fd, start_key.encode('utf-8'), end_key.encode('utf-8') if end_key else None
+            )
+            
+            def read_run(run_start: int, run_end: int) -> Iterator:
+                lines = (line.decode('utf-8') for line in _read_lines(fd, run_start, run_end))
+                for row in csv.reader(lines):
+                    if not row:
+                        continue
+                    timestamp = row[0]
+                    if timestamp < start_key or (end_key is not None and timestamp >= end_key):
+                        continue
+                    if device_id is not None and row[1] != device_id:
+                        continue
+                    yield timestamp, make_row(header, row)
+            
+            readers = [read_run(run_start, run_end) for run_start, run_end in runs]
+            if len(readers) > self.MAX_MERGE_RUNS:
+                rows = [item for reader in readers for item in reader]
+                rows.sort(key=itemgetter(0))
+            else:
+                rows = heapq.merge(*readers, key=itemgetter(0))
+            for _, row in rows:
+                yield row
+    
+    def iter_range(self, start: datetime, end: Optional[datetime] = None,
+                   device_id: Optional[str] = None) -> Iterator[Dict]:
+        """期間内のデータを CSV から時刻昇順に 1 行ずつ返す"""
+        return self._iter_sorted(start, end, device_id, lambda header, row: dict(zip(header, row)))
+    
+    def iter_range_rows(self, start: datetime, end: Optional[datetime] = None,
+                        device_id: Optional[str] = None) -> Iterator[SampleRow]:
+        """期間内の数値データを辞書を作らずにタプルで時刻昇順に返す"""
+        return self._iter_sorted(
+            start, end, device_id,
+            lambda header, row: (row[0], row[1], row[2] or None, row[3] or None, row[4] or None)
+        )
+    
+    @staticmethod
+    def _cached_row(*values) -> Dict:
+        """csv.writer が書き込む文字列（欠損値は空文字列）で DictReader と同じ行を組み立てる"""
+        return dict(zip(CSV_COLUMNS, ('' if value is None else str(value) for value in values)))
+    
+    def recent_row_factory(self) -> Optional[RowFactory]:
+        return self._cached_row
+    
+    def get_last_modified(self) -> Optional[float]:
+        """CSV ファイルの更新時刻を返す"""
+        try:
+            return os.stat(self.file_path).st_mtime_ns / 1e9
+        except FileNotFoundError:
+            return None
 
 class SQLiteStorage(DataStorage):
     """SQLite データベースによるデータストレージ"""
     
+    backend_name = "sqlite"
+    recent_newest_first = True
+    
     def __init__(self, db_path: Path):
         self.db_path = db_path
         self.logger = logging.getLogger(__name__)
@@ -140,32 +407,76 @@ class SQLiteStorage(DataStorage):
                 CREATE INDEX IF NOT EXISTS idx_timestamp 
                 ON temperature_data(timestamp)
             """)
+            
+            self._ensure_unique_key(conn)
     
-    def save_temperature_data(self, data: Dict) -> bool:
-        """温度データを SQLite に保存"""
+    def _ensure_unique_key(self, conn: sqlite3.Connection):
+        """(device_id, timestamp) の一意制約を作成（既存の重複行は最古の 1 件を残して削除）"""
+        exists = conn.execute("""
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'index' AND name = 'idx_device_timestamp'
+        """).fetchone()
+        if exists:
+            return
+        
+        cursor = conn.execute("""
+            DELETE FROM temperature_data
+            WHERE id NOT IN (
+                SELECT MIN(id) FROM temperature_data
+                GROUP BY device_id, timestamp
+            )
+        """)
+        if cursor.rowcount:
+            self.logger.info(f"{cursor.rowcount} 件の重複データを削除しました")
+        
+        conn.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_device_timestamp
+            ON temperature_data(device_id, timestamp)
+        """)
+    
+    INSERT_SQL = """
+        INSERT OR IGNORE INTO temperature_data 
+        (timestamp, device_id, temperature, humidity, light_level, device_type, version)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+    
+    @_instrumented("save")
+    def save_temperature_data(self, data: SampleLike) -> bool:
+        """温度データを SQLite に保存（保存済みのサンプルは無視）"""
         try:
+            values = _row_values(data)
             with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
-                    INSERT INTO temperature_data 
-                    (timestamp, device_id, temperature, humidity, light_level, device_type, version)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    data.get('timestamp'),
-                    data.get('device_id'),
-                    data.get('temperature'),
-                    data.get('humidity'),
-                    data.get('light_level'),
-                    data.get('device_type'),
-                    data.get('version')
-                ))
-            
-            self.logger.info(f"データを保存しました: {data.get('timestamp')}")
+                cursor = conn.execute(self.INSERT_SQL, values)
+            
+            if cursor.rowcount:
+                self.logger.info(f"データを保存しました: {values[0]}")
+            else:
+                self.logger.debug(f"保存済みのデータのためスキップしました: {values[0]}")
             return True
             
         except Exception as e:
             self.logger.error(f"SQLite への保存に失敗しました: {e}")
             return False
     
+    @_instrumented("save_batch")
+    def save_batch(self, records: Iterable[SampleLike]) -> Optional[int]:
+        """複数の温度データを 1 トランザクションで SQLite に保存"""
+        records = records if isinstance(records, (list, SampleBatch)) else list(records)
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                before = conn.total_changes
+                rows = records.rows() if isinstance(records, SampleBatch) else map(_row_values, records)
+                conn.executemany(self.INSERT_SQL, rows)
+                saved_count = conn.total_changes - before
+            
+            self.logger.info(f"{saved_count} 件のデータを保存しました（重複 {len(records) - saved_count} 件）")
+            return saved_count
+            
+        except Exception as e:
+            self.logger.error(f"SQLite への一括保存に失敗しました: {e}")
+            return None
+    
+    @_instrumented("get_recent_data")
     def get_recent_data(self, hours: int = 24) -> List[Dict]:
         """最近のデータを SQLite から取得"""
         try:
@@ -185,6 +496,32 @@ class SQLiteStorage(DataStorage):
             self.logger.error(f"SQLite からのデータ取得に失敗しました: {e}")
             return []
     
+    @_instrumented("get_recent_data")
+    def get_recent_batch(self, hours: int = 24) -> SampleBatch:
+        """最近のデータを辞書を作らずに SampleBatch へ読み込む"""
+        batch = SampleBatch()
+        try:
+            cutoff_time = (datetime.now() - timedelta(hours=hours)).isoformat()
+            
+            with closing(sqlite3.connect(self.db_path)) as conn:
+                # 時刻の解析は SQLite 側で行う（ローカル時刻の ISO 形式をエポックミリ秒に変換）
+                # strftime('%s') は端数を四捨五入するため、秒までの部分とミリ秒を分けて変換する
+                cursor = conn.execute("""
+                    SELECT CAST(strftime('%s', substr(timestamp, 1, 19), 'utc') AS INTEGER) * 1000
+                               + CAST(substr(strftime('%f', timestamp), 4) AS INTEGER),
+                           device_id, temperature, humidity, light_level, device_type, version
+                    FROM temperature_data
+                    WHERE timestamp >= ?
+                    ORDER BY timestamp DESC
+                """, (cutoff_time,))
+                add = batch.add
+                for row in cursor:
+                    add(*row)
+        except Exception as e:
+            self.logger.error(f"SQLite からのデータ取得に失敗しました: {e}")
+        return batch
+    
+    @_instrumented("cleanup")
     def cleanup_old_data(self, days: int) -> int:
         """古いデータを削除"""
         try:
@@ -203,12 +540,240 @@ class SQLiteStorage(DataStorage):
         except Exception as e:
             self.logger.error(f"古いデータの削除に失敗しました: {e}")
             return 0
+    
+    def iter_range(self, start: datetime, end: Optional[datetime] = None,
+                   device_id: Optional[str] = None) -> Iterator[Dict]:
+        """期間内のデータを SQLite のカーソルから 1 行ずつ返す"""
+        conditions = ["timestamp >= ?"]
+        params = [start.isoformat()]
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(end.isoformat())
+        if device_id is not None:
+            conditions.append("device_id = ?")
+            params.append(device_id)
+        
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute(f"""
+                SELECT * FROM temperature_data
+                WHERE {' AND '.join(conditions)}
+                ORDER BY timestamp
+            """, params)
+            for row in cursor:
+                yield dict(row)
+    
+    def iter_range_rows(self, start: datetime, end: Optional[datetime] = None,
+                        device_id: Optional[str] = None,
+                        fetch_size: int = 5000) -> Iterator[SampleRow]:
+        """期間内の数値データを row_factory を使わずにタプルのまま返す"""
+        conditions = ["timestamp >= ?"]
+        params = [start.isoformat()]
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(end.isoformat())
+        if device_id is not None:
+            conditions.append("device_id = ?")
+            params.append(device_id)
+        
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            cursor = conn.execute(f"""
+                SELECT timestamp, device_id, temperature, humidity, light_level
+                FROM temperature_data
+                WHERE {' AND '.join(conditions)}
+                ORDER BY timestamp
+            """, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+    
+    def get_last_modified(self) -> Optional[float]:
+        """データベースファイル（ WAL を含む）の更新時刻を返す"""
+        mtimes = []
+        for path in (self.db_path, self.db_path.with_name(self.db_path.name + '-wal')):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                continue
+        return max(mtimes) / 1e9 if mtimes else None
+
+class CachedStorage(DataStorage):
+    """直近データをリングバッファに保持するストレージラッパー
+    
+    キャッシュは最初に直近データを読み込むときにバックエンドから初期化する（保存や削除だけの
+    プロセスではバックエンドを全件読み込まない）。 get_recent_data の行はバックエンドが返す形
+    （列・型・順序）で組み立て、組み立てられないバックエンド（ SQLite の id / created_at ）では
+    バックエンドに問い合わせる。
+    """
+    
+    backend_name = "cache"
+    
+    def __init__(self, backend: DataStorage, cache_size: int, warm_hours: int = 24,
+                 max_devices: int = 1000):
+        self.backend = backend
+        self.warm_hours = warm_hours
+        self.cache = RecentSampleCache(cache_size, max_devices=max_devices)
+        self.logger = logging.getLogger(__name__)
+    
+    def _warm(self):
+        """バックエンドから直近データを読み込む"""
+        covered_since = (datetime.now() - timedelta(hours=self.warm_hours)).timestamp()
+        token = self.cache.begin_warm()
+        rows = self.backend.get_recent_data(self.warm_hours)
+        if self.cache.warm(rows, covered_since, token):
+            self.logger.debug(f"直近データキャッシュを初期化しました: {self.cache.stats()}")
+    
+    @_instrumented("save")
+    def save_temperature_data(self, data: SampleLike) -> bool:
+        """バックエンドに保存し、成功したらキャッシュにも反映"""
+        success = self.backend.save_temperature_data(data)
+        if success:
+            self.cache.add(data)
+        return success
+    
+    @_instrumented("save_batch")
+    def save_batch(self, records: Iterable[SampleLike]) -> Optional[int]:
+        """バックエンドに一括保存し、成功したらキャッシュにも反映"""
+        records = list(records)
+        saved_count = self.backend.save_batch(records)
+        if saved_count is not None:
+            for data in sorted(records, key=lambda item: sample_time(item) or 0.0):
+                self.cache.add(data)
+        return saved_count
+    
+    @_instrumented("get_recent_data")
+    def get_recent_data(self, hours: int = 24) -> List[Dict]:
+        """キャッシュの範囲内なら I/O なしで返し、範囲外はバックエンドに問い合わせる"""
+        make_row = self.backend.recent_row_factory()
+        if make_row is None:
+            STORAGE_CACHE_REQUESTS.inc(result="bypass")
+            return self.backend.get_recent_data(hours)
+        if not self.cache.is_warm:
+            self._warm()
+        
+        cutoff = (datetime.now() - timedelta(hours=hours)).timestamp()
+        cached = self.cache.get_since(cutoff, make_row, self.backend.recent_newest_first)
+        if cached is not None:
+            STORAGE_CACHE_REQUESTS.inc(result="hit")
+            return cached
+        
+        STORAGE_CACHE_REQUESTS.inc(result="miss")
+        return self.backend.get_recent_data(hours)
+    
+    @_instrumented("get_recent_data")
+    def get_recent_batch(self, hours: int = 24) -> SampleBatch:
+        """キャッシュの範囲内なら辞書を作らずにリングバッファから SampleBatch を組み立てる"""
+        if not self.cache.is_warm:
+            self._warm()
+        
+        cutoff = (datetime.now() - timedelta(hours=hours)).timestamp()
+        cached = self.cache.get_batch_since(cutoff)
+        if cached is not None:
+            STORAGE_CACHE_REQUESTS.inc(result="hit")
+            return cached
+        
+        STORAGE_CACHE_REQUESTS.inc(result="miss")
+        return self.backend.get_recent_batch(hours)
+    
+    @_instrumented("cleanup")
+    def cleanup_old_data(self, days: int) -> int:
+        """バックエンドの古いデータを削除し、キャッシュからも除外"""
+        deleted_count = self.backend.cleanup_old_data(days)
+        cutoff = (datetime.now() - timedelta(days=days)).timestamp()
+        self.cache.prune_before(cutoff)
+        return deleted_count
+    
+    def iter_range(self, start: datetime, end: Optional[datetime] = None,
+                   device_id: Optional[str] = None) -> Iterator[Dict]:
+        """期間指定の読み込みはバックエンドに委譲"""
+        return self.backend.iter_range(start, end, device_id)
+    
+    def iter_range_rows(self, start: datetime, end: Optional[datetime] = None,
+                        device_id: Optional[str] = None) -> Iterator[SampleRow]:
+        return self.backend.iter_range_rows(start, end, device_id)
+    
+    def get_last_modified(self) -> Optional[float]:
+        return self.backend.get_last_modified()
+    
+    def invalidate_caches(self):
+        self.cache.invalidate()
+        self.backend.invalidate_caches()
+
+class ResultCachingStorage(DataStorage):
+    """読み込み結果を QueryResultCache に保持するストレージラッパー
+    
+    結果の読み込みとキャッシュへの登録はクエリ（ src/query.py ）が行い、このラッパーは
+    保存に成功したサンプルの時刻を含む範囲の結果だけを無効化する。
+    """
+    
+    backend_name = "result_cache"
+    
+    def __init__(self, backend: DataStorage, result_cache: QueryResultCache):
+        self.backend = backend
+        self.result_cache = result_cache
+    
+    def save_temperature_data(self, data: SampleLike) -> bool:
+        success = self.backend.save_temperature_data(data)
+        if success:
+            self.result_cache.invalidate_writes([data])
+        return success
+    
+    def save_batch(self, records: Iterable[SampleLike]) -> Optional[int]:
+        records = list(records)
+        saved_count = self.backend.save_batch(records)
+        if saved_count is not None:
+            self.result_cache.invalidate_writes(records)
+        return saved_count
+    
+    def get_recent_data(self, hours: int = 24) -> List[Dict]:
+        """直近データはバックエンド（直近データキャッシュを含む）に委譲"""
+        return self.backend.get_recent_data(hours)
+    
+    def get_recent_batch(self, hours: int = 24) -> SampleBatch:
+        return self.backend.get_recent_batch(hours)
+    
+    def cleanup_old_data(self, days: int) -> int:
+        deleted_count = self.backend.cleanup_old_data(days)
+        self.result_cache.clear()
+        return deleted_count
+    
+    def iter_range(self, start: datetime, end: Optional[datetime] = None,
+                   device_id: Optional[str] = None) -> Iterator[Dict]:
+        return self.backend.iter_range(start, end, device_id)
+    
+    def iter_range_rows(self, start: datetime, end: Optional[datetime] = None,
+                        device_id: Optional[str] = None) -> Iterator[SampleRow]:
+        return self.backend.iter_range_rows(start, end, device_id)
+    
+    def get_last_modified(self) -> Optional[float]:
+        return self.backend.get_last_modified()
+    
+    def invalidate_caches(self):
+        self.result_cache.clear()
+        self.backend.invalidate_caches()
 
-def create_storage(storage_type: str, file_path: Path) -> DataStorage:
-    """ストレージタイプに応じてインスタンスを作成"""
+def create_storage(storage_type: str, file_path: Path, cache_size: int = 0,
+                   cache_warm_hours: int = 24, result_cache_size: int = 0,
+                   result_cache_ttl: float = 300.0, result_cache_rows: int = 200000) -> DataStorage:
+    """ストレージタイプに応じてインスタンスを作成
+    
+    cache_size が 1 以上の場合はデバイスごとに cache_size 件を保持する
+    直近データキャッシュでラップする。 result_cache_size が 1 以上の場合は
+    さらにクエリ結果キャッシュでラップする
+    """
     if storage_type.lower() == "csv":
-        return CSVStorage(file_path)
+        storage = CSVStorage(file_path)
     elif storage_type.lower() == "sqlite":
-        return SQLiteStorage(file_path)
+        storage = SQLiteStorage(file_path)
     else:
-        raise ValueError(f"サポートされていないストレージタイプです: {storage_type}")
\ No newline at end of file
+        raise ValueError(f"サポートされていないストレージタイプです: {storage_type}")
+    
+    if cache_size > 0:
+        storage = CachedStorage(storage, cache_size, warm_hours=cache_warm_hours)
+    if result_cache_size > 0:
+        storage = ResultCachingStorage(
+            storage, QueryResultCache(result_cache_size, ttl=result_cache_ttl, max_rows=result_cache_rows)
+        )
+    return storage
\ No newline at end of file
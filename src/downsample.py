@@ -0,0 +1,189 @@
+"""
+描画向けのダウンサンプリング
+長期間の時系列を LTTB（ Largest-Triangle-Three-Buckets ）または
+バケットごとの最小/最大値で目標点数まで間引く
+"""
+
+import math
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Sequence
+
+from .data_storage import SampleRow
+
+FIELDS = ('temperature', 'humidity', 'light_level')
+METHODS = ('lttb', 'minmax')
+
+
+class SeriesColumns:
+    """1 デバイス分の時系列を列ごとの array に保持する"""
+
+    __slots__ = ('device_id', 'x', 'columns', 'ordered')
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        # 時刻は文字列を保持せずエポック秒だけを持ち、出力する点の分だけ文字列に戻す
+        self.x = array('d')
+        # 欠損値は NaN で保持する
+        self.columns = {field: array('d') for field in FIELDS}
+        # CSV は追記順のため、時刻順でない場合は間引き前に並べ替える
+        self.ordered = True
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def append(self, row: SampleRow):
+        x = datetime.fromisoformat(row[0]).timestamp()
+        if self.x and x < self.x[-1]:
+            self.ordered = False
+        self.x.append(x)
+        for field, value in zip(FIELDS, row[2:]):
+            self.columns[field].append(math.nan if value is None or value == '' else float(value))
+
+    def order(self) -> Sequence[int]:
+        """時刻順のインデックス"""
+        if self.ordered:
+            return range(len(self.x))
+        return sorted(range(len(self.x)), key=self.x.__getitem__)
+
+    def valid_indices(self, field: str, order: Sequence[int]) -> List[int]:
+        column = self.columns[field]
+        return [index for index in order if column[index] == column[index]]
+
+    def row(self, index: int, fields: Sequence[str] = FIELDS) -> Dict:
+        """index の点を行にする（ fields 以外のフィールドは None ）"""
+        result = {'timestamp': datetime.fromtimestamp(self.x[index]).isoformat(), 'device_id': self.device_id}
+        for field in FIELDS:
+            value = self.columns[field][index]
+            if field not in fields or value != value:
+                result[field] = None
+            elif field == 'light_level':
+                result[field] = int(value)
+            else:
+                result[field] = value
+        return result
+
+
+def load_columns(rows: Iterable[SampleRow]) -> Dict[str, SeriesColumns]:
+    """カーソルの行をデバイスごとの列データに詰め替える（行ごとの辞書は作らない）"""
+    series: Dict[str, SeriesColumns] = {}
+    for row in rows:
+        columns = series.get(row[1])
+        if columns is None:
+            columns = SeriesColumns(row[1])
+            series[row[1]] = columns
+        columns.append(row)
+    return series
+
+
+def lttb_indices(x: Sequence[float], y: Sequence[float], indices: List[int], threshold: int) -> List[int]:
+    """LTTB で残す点のインデックスを返す"""
+    n = len(indices)
+    if threshold >= n or n <= 2:
+        return list(indices)
+    if threshold < 3:
+        return [indices[0], indices[-1]]
+
+    every = (n - 2) / (threshold - 2)
+    sampled = [indices[0]]
+    a = 0
+
+    for i in range(threshold - 2):
+        # 次のバケットの平均点
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = 0.0
+        avg_y = 0.0
+        for k in range(avg_start, avg_end):
+            avg_x += x[indices[k]]
+            avg_y += y[indices[k]]
+        length = avg_end - avg_start
+        avg_x /= length
+        avg_y /= length
+
+        # 現在のバケットで、前回選んだ点・次バケットの平均点と作る三角形が最大の点を選ぶ
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax = x[indices[a]]
+        ay = y[indices[a]]
+        max_area = -1.0
+        next_a = range_start
+        for k in range(range_start, range_end):
+            index = indices[k]
+            area = abs((ax - avg_x) * (y[index] - ay) - (ax - x[index]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = k
+
+        sampled.append(indices[next_a])
+        a = next_a
+
+    sampled.append(indices[-1])
+    return sampled
+
+
+def minmax_indices(y: Sequence[float], indices: List[int], threshold: int) -> List[int]:
+    """両端の点と、バケットごとの最小値・最大値の点のインデックスを返す（最大 threshold 点）"""
+    n = len(indices)
+    if threshold >= n or n <= 2:
+        return list(indices)
+
+    first, last = indices[0], indices[-1]
+    buckets = max(1, (threshold - 2) // 2)
+    size = (n - 2) / buckets
+    selected = {first, last}
+    for bucket in range(buckets):
+        start = 1 + int(bucket * size)
+        end = min(1 + int((bucket + 1) * size), n - 1)
+        if start >= end:
+            continue
+        low = high = indices[start]
+        for k in range(start + 1, end):
+            index = indices[k]
+            if y[index] < y[low]:
+                low = index
+            if y[index] > y[high]:
+                high = index
+        if threshold - 2 < 2:
+            # 1 点しか残せない場合は、両端の平均から遠い方だけを残す
+            middle = (y[first] + y[last]) / 2
+            selected.add(low if abs(y[low] - middle) >= abs(y[high] - middle) else high)
+        else:
+            selected.add(low)
+            selected.add(high)
+    return list(selected)
+
+
+def downsample_series(series: SeriesColumns, points: int, method: str = 'lttb',
+                      fields: Sequence[str] = FIELDS) -> Dict[str, List[int]]:
+    """フィールドごとに、値のある点をそれぞれ最大 points 点まで間引いたインデックスを返す"""
+    order = series.order()
+    selections = {}
+    for field in fields:
+        indices = series.valid_indices(field, order)
+        if not indices:
+            continue
+        column = series.columns[field]
+        if method == 'minmax':
+            selections[field] = minmax_indices(column, indices, points)
+        else:
+            selections[field] = lttb_indices(series.x, column, indices, points)
+    return selections
+
+
+def downsample(rows: Iterable[SampleRow], points: int, method: str = 'lttb',
+               fields: Sequence[str] = FIELDS) -> Iterator[Dict]:
+    """デバイスごと・フィールドごとに目標点数まで間引いた行を時刻順に返す
+
+    温度・湿度・照度はそれぞれの形状で独立に点を選ぶ（各フィールド最大 points 点）。
+    行には、その時刻を選んだフィールドの値だけを入れ、他のフィールドは None にする。
+    """
+    if method not in METHODS:
+        raise ValueError(f"サポートされていない間引き方法です: {method}")
+    for series in load_columns(rows).values():
+        selected: Dict[int, List[str]] = {}
+        for field, indices in downsample_series(series, points, method, fields).items():
+            for index in indices:
+                selected.setdefault(index, []).append(field)
+        for index in sorted(selected, key=series.x.__getitem__):
+            yield series.row(index, selected[index])
@@ -12,18 +12,48 @@ from datetime import datetime
 
 import gspread
 from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+
+from .metrics import metrics
+from .sample import SampleLike, sample_field, sample_time
+
+SHEETS_OPERATION_SECONDS = metrics.histogram(
+    "sheets_operation_seconds", "Google Sheets クライアント操作の所要時間"
+)
+SHEETS_APPENDS = metrics.counter(
+    "sheets_appends_total", "Google Sheets へのデータ追加数（結果別）"
+)
+
+# gspread が送信先とする Sheets API のオリジン
+SHEETS_API_ORIGIN = "https://sheets.googleapis.com"
+
+
+class _BaseURLAdapter(HTTPAdapter):
+    """Sheets API へのリクエストを別のベース URL （負荷試験用の模倣サーバーなど）へ送るアダプター"""
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, request, **kwargs):
+        if request.url.startswith(SHEETS_API_ORIGIN):
+            request.url = self.base_url + request.url[len(SHEETS_API_ORIGIN):]
+        return super().send(request, **kwargs)
 
 
 class GoogleSheetsClient:
     """Google Sheets への書き込みクライアント"""
     
-    def __init__(self, service_account_info: Dict, spreadsheet_id: str):
+    @SHEETS_OPERATION_SECONDS.timed(operation="authorize")
+    def __init__(self, service_account_info: Dict, spreadsheet_id: str,
+                 api_base_url: Optional[str] = None):
         """
         Google Sheets クライアントを初期化
         
         Args:
             service_account_info: サービスアカウント情報（ JSON ）
             spreadsheet_id: 対象スプレッドシートの ID
+            api_base_url: Sheets API の送信先（ None の場合は https://sheets.googleapis.com ）
         """
         self.spreadsheet_id = spreadsheet_id
         self.logger = logging.getLogger(__name__)
@@ -40,8 +70,8 @@ class GoogleSheetsClient:
             # サービスアカウントの詳細情報をログ出力
             client_email = service_account_info.get('client_email', 'N/A')
             project_id = service_account_info.get('project_id', 'N/A')
-            self.logger.info(f"使用するサービスアカウント: {client_email}")
-            self.logger.info(f"プロジェクト ID: {project_id}")
+            self.logger.debug(f"使用するサービスアカウント: {client_email}")
+            self.logger.debug(f"プロジェクト ID: {project_id}")
             
             # 認証情報の設定
             credentials = Credentials.from_service_account_info(
@@ -52,6 +82,11 @@ class GoogleSheetsClient:
             self.gc = gspread.authorize(credentials)
             self.worksheet = None
             
+            # 送信先の差し替え（認証や API 呼び出しは gspread の処理をそのまま通す）
+            if api_base_url:
+                self.gc.http_client.session.mount(SHEETS_API_ORIGIN + '/', _BaseURLAdapter(api_base_url))
+                self.logger.debug(f"Sheets API の送信先: {api_base_url}")
+            
             self.logger.debug("gspread クライアントの作成に成功しました")
             
         except Exception as e:
@@ -59,6 +94,7 @@ class GoogleSheetsClient:
             self.logger.error(f"エラータイプ: {type(e).__name__}")
             raise
         
+    @SHEETS_OPERATION_SECONDS.timed(operation="find_worksheet")
     def find_available_worksheet(self) -> Optional[str]:
         """
         利用可能なワークシートを検索
@@ -70,15 +106,15 @@ class GoogleSheetsClient:
             spreadsheet = self.gc.open_by_key(self.spreadsheet_id)
             worksheets = spreadsheet.worksheets()
             
-            self.logger.info(f"スプレッドシートに {len(worksheets)} 個のワークシートが見つかりました")
+            self.logger.debug(f"スプレッドシートに {len(worksheets)} 個のワークシートが見つかりました")
             
             for worksheet in worksheets:
-                self.logger.info(f"利用可能なワークシート: '{worksheet.title}'")
+                self.logger.debug(f"利用可能なワークシート: '{worksheet.title}'")
             
             if worksheets:
                 # 最初のワークシートを使用
                 first_worksheet = worksheets[0]
-                self.logger.info(f"最初のワークシート '{first_worksheet.title}' を使用します")
+                self.logger.debug(f"最初のワークシート '{first_worksheet.title}' を使用します")
                 return first_worksheet.title
             else:
                 self.logger.error("利用可能なワークシートが見つかりません")
@@ -89,6 +125,7 @@ class GoogleSheetsClient:
             self.logger.error(f"エラータイプ: {type(e).__name__}")
             return None
         
+    @SHEETS_OPERATION_SECONDS.timed(operation="connect_worksheet")
     def connect_worksheet(self, worksheet_name: Optional[str] = None) -> bool:
         """
         ワークシートに接続
@@ -112,7 +149,7 @@ class GoogleSheetsClient:
             self.logger.debug(f"ワークシート '{worksheet_name}' への接続を試行しています")
             self.worksheet = spreadsheet.worksheet(worksheet_name)
             
-            self.logger.info(f"ワークシート '{worksheet_name}' に接続しました")
+            self.logger.debug(f"ワークシート '{worksheet_name}' に接続しました")
             return True
             
         except gspread.WorksheetNotFound as e:
@@ -145,11 +182,10 @@ class GoogleSheetsClient:
             if hasattr(e, 'response'):
                 self.logger.error(f"HTTP ステータス: {e.response.status_code}")
                 self.logger.error(f"HTTP レスポンス: {e.response.text}")
-            
-            import traceback
-            self.logger.error(f"スタックトレース: {traceback.format_exc()}")
+            self.logger.debug("ワークシート接続エラーの詳細", exc_info=True)
             return False
     
+    @SHEETS_OPERATION_SECONDS.timed(operation="setup_headers")
     def setup_headers(self) -> bool:
         """
         ヘッダー行を設定（初回のみ実行）
@@ -173,7 +209,7 @@ class GoogleSheetsClient:
                 self.worksheet.insert_row(headers, 1)
                 self.logger.info("ヘッダー行を設定しました")
             else:
-                self.logger.info("ヘッダー行は既に存在します")
+                self.logger.debug("ヘッダー行は既に存在します")
             
             return True
             
@@ -182,12 +218,13 @@ class GoogleSheetsClient:
             self.logger.error(f"エラータイプ: {type(e).__name__}")
             return False
     
-    def append_temperature_data(self, temperature_data: Dict) -> bool:
+    @SHEETS_OPERATION_SECONDS.timed(operation="append")
+    def append_temperature_data(self, temperature_data: SampleLike) -> bool:
         """
         温度データを追加（日本語時間と温度のみ）
         
         Args:
-            temperature_data: 温度データ辞書
+            temperature_data: 温度データ（ Sample または辞書）
             
         Returns:
             bool: 追加成功かどうか
@@ -197,24 +234,26 @@ class GoogleSheetsClient:
             return False
             
         try:
-            # 日本時間を取得
+            # サンプルの取得時刻を日本時間に変換（スプールから再送される場合もあるため）
             from zoneinfo import ZoneInfo
             japan_tz = ZoneInfo("Asia/Tokyo")
-            japan_time = datetime.now(japan_tz)
+            ts = sample_time(temperature_data)
+            japan_time = datetime.fromtimestamp(ts, japan_tz) if ts is not None else datetime.now(japan_tz)
             
             # 日時フォーマット（例: 2025/08/22 07:30）
             formatted_time = japan_time.strftime("%Y/%m/%d %H:%M")
             
             # データ行を準備（日本語時間と温度のみ）
+            temperature = sample_field(temperature_data, 'temperature')
             row_data = [
                 formatted_time,
-                temperature_data.get('temperature', 0)
+                temperature if temperature is not None else 0
             ]
             
             # データを追加
             self.worksheet.append_row(row_data)
-            self.logger.info(f"データを追加しました: 時刻={formatted_time}, "
-                           f"温度={temperature_data.get('temperature')}°C")
+            self.logger.debug(f"データを追加しました: 時刻={formatted_time}, "
+                            f"温度={temperature}°C")
             
             return True
             
@@ -223,6 +262,7 @@ class GoogleSheetsClient:
             self.logger.error(f"エラータイプ: {type(e).__name__}")
             return False
     
+    @SHEETS_OPERATION_SECONDS.timed(operation="get_row_count")
     def get_row_count(self) -> int:
         """
         データ行数を取得
@@ -254,6 +294,7 @@ def create_sheets_client_from_env() -> Optional[GoogleSheetsClient]:
         # 環境変数の取得
         spreadsheet_id = os.getenv('GOOGLE_SHEETS_SPREADSHEET_ID')
         service_account_key = os.getenv('GOOGLE_SERVICE_ACCOUNT_KEY')
+        api_base_url = os.getenv('GOOGLE_SHEETS_API_BASE_URL')
         
         logger.debug(f"GOOGLE_SHEETS_SPREADSHEET_ID の長さ: {len(spreadsheet_id) if spreadsheet_id else 0}")
         logger.debug(f"GOOGLE_SERVICE_ACCOUNT_KEY の長さ: {len(service_account_key) if service_account_key else 0}")
@@ -267,8 +308,8 @@ def create_sheets_client_from_env() -> Optional[GoogleSheetsClient]:
             return None
         
         # スプレッドシート ID の妥当性チェック
-        logger.info(f"対象スプレッドシート ID: {spreadsheet_id}")
-        logger.info(f"スプレッドシート URL: https://docs.google.com/spreadsheets/d/{spreadsheet_id}/edit")
+        logger.debug(f"対象スプレッドシート ID: {spreadsheet_id}")
+        logger.debug(f"スプレッドシート URL: https://docs.google.com/spreadsheets/d/{spreadsheet_id}/edit")
         
         # JSON 文字列をパース
         logger.debug("サービスアカウントキーの JSON 解析を開始します")
@@ -277,7 +318,7 @@ def create_sheets_client_from_env() -> Optional[GoogleSheetsClient]:
         
         # クライアントを作成
         logger.debug("Google Sheets クライアントの作成を開始します")
-        client = GoogleSheetsClient(service_account_info, spreadsheet_id)
+        client = GoogleSheetsClient(service_account_info, spreadsheet_id, api_base_url)
         
         # ワークシートに接続（自動検出）
         logger.debug("ワークシートへの接続を開始します（自動検出）")
@@ -289,7 +330,7 @@ def create_sheets_client_from_env() -> Optional[GoogleSheetsClient]:
         logger.debug("ヘッダーの設定を開始します")
         client.setup_headers()
         
-        logger.info("Google Sheets クライアントを作成しました")
+        logger.debug("Google Sheets クライアントを作成しました")
         return client
         
     except json.JSONDecodeError as e:
@@ -299,17 +340,16 @@ def create_sheets_client_from_env() -> Optional[GoogleSheetsClient]:
     except Exception as e:
         logger.error(f"Google Sheets クライアント作成エラー: {e}")
         logger.error(f"エラータイプ: {type(e).__name__}")
-        import traceback
-        logger.error(f"スタックトレース: {traceback.format_exc()}")
+        logger.debug("Google Sheets クライアント作成エラーの詳細", exc_info=True)
         return None
 
 
-def save_to_sheets(temperature_data: Dict) -> bool:
+def save_to_sheets(temperature_data: SampleLike) -> bool:
     """
     温度データを Google Sheets に保存
     
     Args:
-        temperature_data: 温度データ辞書
+        temperature_data: 温度データ（ Sample または辞書）
         
     Returns:
         bool: 保存成功かどうか
@@ -327,16 +367,17 @@ def save_to_sheets(temperature_data: Dict) -> bool:
         # データを保存
         logger.debug("温度データの保存を開始します")
         success = client.append_temperature_data(temperature_data)
+        SHEETS_APPENDS.inc(result="success" if success else "failure")
         
-        if success:
+        # 行数の取得はシート全体をダウンロードするため、デバッグ時のみ行う
+        if success and logger.isEnabledFor(logging.DEBUG):
             row_count = client.get_row_count()
-            logger.info(f"Google Sheets への保存完了（総行数: {row_count}）")
+            logger.debug(f"Google Sheets への保存完了（総行数: {row_count}）")
         
         return success
         
     except Exception as e:
         logger.error(f"Google Sheets 保存エラー: {e}")
         logger.error(f"エラータイプ: {type(e).__name__}")
-        import traceback
-        logger.error(f"スタックトレース: {traceback.format_exc()}")
+        logger.debug("Google Sheets 保存エラーの詳細", exc_info=True)
         return False
\ No newline at end of file
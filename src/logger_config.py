@@ -1,58 +1,199 @@
+import atexit
+import json
 import logging
 import logging.handlers
+import queue
+import threading
+import time
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Tuple
+
+# 設定済みのリスナーと設定内容（同じ設定での再呼び出しでは何もしない）
+_listener: Optional[logging.handlers.QueueListener] = None
+_configured_key: Optional[Tuple] = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Cloud Logging が解釈できる 1 行 JSON 形式のフォーマッター"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'severity': record.levelname,
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """同じ呼び出し箇所からのログを一定時間あたり rate 件に制限するフィルター"""
+
+    def __init__(self, rate: int, interval: float = 60.0):
+        super().__init__()
+        self.rate = rate
+        self.interval = interval
+        self._windows: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # エラー以上のログは常に出力する
+        if record.levelno >= logging.ERROR:
+            return True
+
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.getMessage()} (同様のログ {suppressed} 件を抑制しました)"
+                    record.args = None
+                return True
+
+            if window[1] < self.rate:
+                window[1] += 1
+                return True
+
+            window[2] += 1
+            return False
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """フォーマット処理をリスナースレッドに任せる QueueHandler"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # メッセージの展開だけを行い、フォーマットや例外の整形は行わない
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # キューが溢れた場合は収集処理を止めないようにログを破棄する
+            pass
+
+
+def _stop_listener():
+    global _listener, _configured_key
+
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+    _listener = None
+    _configured_key = None
+
+
+atexit.register(_stop_listener)
+
 
 def setup_logging(
     log_file: Optional[Path] = None,
     log_level: str = "INFO",
     console_output: bool = True,
     max_bytes: int = 10 * 1024 * 1024,  # 10MB
-    backup_count: int = 5
+    backup_count: int = 5,
+    json_format: bool = False,
+    rate_limit: int = 0,
+    rate_limit_interval: float = 60.0,
+    queue_size: int = 10000
 ) -> logging.Logger:
-    """ログ設定を初期化"""
-    
-    # ログレベルを設定
-    numeric_level = getattr(logging, log_level.upper(), logging.INFO)
-    
-    # ルートロガーを設定
+    """ログ設定を初期化
+
+    ファイル/コンソールへの出力は QueueListener のスレッドで行う。
+    同じ設定で再度呼び出された場合は既存の設定をそのまま使う。
+    """
+    global _listener, _configured_key
+
+    # ルートロガーを取得
     logger = logging.getLogger()
-    logger.setLevel(numeric_level)
-    
-    # 既存のハンドラーをクリア
-    logger.handlers.clear()
-    
-    # フォーマッターを作成
-    formatter = logging.Formatter(
-        '%(asctime) s - %(name) s - %(levelname) s - %(message) s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    
-    # コンソールハンドラーを追加
-    if console_output:
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(numeric_level)
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-    
-    # ファイルハンドラーを追加
-    if log_file:
-        # ログディレクトリを作成
-        log_file.parent.mkdir(parents=True, exist_ok=True)
-        
-        # ローテーションファイルハンドラーを使用
-        file_handler = logging.handlers.RotatingFileHandler(
-            log_file,
-            maxBytes=max_bytes,
-            backupCount=backup_count,
-            encoding='utf-8'
+
+    key = (str(log_file), log_level.upper(), console_output, max_bytes, backup_count,
+           json_format, rate_limit, rate_limit_interval)
+
+    with _setup_lock:
+        if _configured_key == key:
+            return logger
+
+        # 既存のハンドラーとリスナーを停止
+        _stop_listener()
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+
+        # ログレベルを設定
+        numeric_level = getattr(logging, log_level.upper(), logging.INFO)
+        logger.setLevel(numeric_level)
+
+        # フォーマッターを作成
+        if json_format:
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter(
+                '%(asctime) s - %(name) s - %(levelname) s - %(message) s',
+                datefmt='%Y-%m-%d %H:%M:%S'
+            )
+
+        handlers = []
+
+        # コンソールハンドラーを追加
+        if console_output:
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(numeric_level)
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+
+        # ファイルハンドラーを追加
+        if log_file:
+            # ログディレクトリを作成
+            log_file.parent.mkdir(parents=True, exist_ok=True)
+
+            # ローテーションファイルハンドラーを使用
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=max_bytes,
+                backupCount=backup_count,
+                encoding='utf-8'
+            )
+            file_handler.setLevel(numeric_level)
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+
+        # ルートロガーにはキューへの投入だけを行うハンドラーを設定
+        log_queue = queue.Queue(maxsize=queue_size)
+        queue_handler = _NonBlockingQueueHandler(log_queue)
+        queue_handler.setLevel(numeric_level)
+        if rate_limit > 0:
+            queue_handler.addFilter(RateLimitFilter(rate_limit, rate_limit_interval))
+        logger.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
         )
-        file_handler.setLevel(numeric_level)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-    
+        _listener.start()
+        _configured_key = key
+
     return logger
 
+
+def flush_logging():
+    """キューに残っているログを出力し終えるまで待機"""
+    with _setup_lock:
+        if _listener is None:
+            return
+        # stop() はキューを処理し終えてから戻るため、停止後に再開する
+        _listener.stop()
+        _listener.start()
+
+
 def get_logger(name: str) -> logging.Logger:
     """指定された名前のロガーを取得"""
-    return logging.getLogger(name)
\ No newline at end of file
+    return logging.getLogger(name)
@@ -0,0 +1,248 @@
+"""
+メトリクス収集モジュール
+カウンター・ゲージ・レイテンシのヒストグラムを保持し、 Prometheus テキスト形式で出力する
+"""
+
+import bisect
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """メトリクスの共通処理"""
+
+    metric_type = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_Metric):
+    """単調増加するカウンター"""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items
+        ]
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [{'labels': dict(key), 'value': value} for key, value in sorted(self._values.items())]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(Counter):
+    """任意の値を設定できるゲージ"""
+
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """バケット境界ごとの件数と合計を保持するヒストグラム"""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [バケット別件数..., 合計, 件数, 最大値]
+        self._series: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0] * (len(self.buckets) + 1) + [0.0, 0, 0.0]
+                self._series[key] = series
+            series[index] += 1
+            series[-3] += value
+            series[-2] += 1
+            if value > series[-1]:
+                series[-1] = value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """ブロックの所要時間を記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def timed(self, **labels):
+        """関数の所要時間を記録するデコレーター"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            return int(series[-2]) if series else 0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """バケットから分位点を推定（バケット上限を返す）"""
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if not series or not series[-2]:
+                return None
+            target = q * series[-2]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                if cumulative >= target:
+                    return bound
+            return series[-1]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = self._header()
+        for key, series in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {int(series[-2])}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series[-3])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {int(series[-2])}")
+        return lines
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        return [
+            {
+                'labels': dict(key),
+                'count': int(series[-2]),
+                'sum': round(series[-3], 6),
+                'max': round(series[-1], 6),
+            }
+            for key, series in items
+        ]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class MetricsRegistry:
+    """メトリクスの登録と出力を行うレジストリ"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name: str, help_text: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, help_text, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"メトリクス '{name}' は別の種類で登録されています")
+            return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._register(Gauge, name, help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, buckets=buckets)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render_prometheus(self) -> str:
+        """Prometheus テキスト形式で出力"""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, List[Dict]]:
+        """JSON レスポンスに含めるための要約"""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        return {name: data for name, data in ((name, metric.snapshot()) for name, metric in metrics) if data}
+
+    def reset(self):
+        """記録済みの値を消去"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,461 @@
+"""
+一括インポート・移行ツール
+大きな CSV をチャンク単位で読み込み、複数プロセスで解析してからまとめてストレージに書き込む
+"""
+
+import csv
+import json
+import os
+import sqlite3
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .data_storage import CSVStorage, SQLiteStorage
+
+COLUMNS = ('timestamp', 'device_id', 'temperature', 'humidity', 'light_level', 'device_type', 'version')
+
+# 列名の別名（ Google Sheets から書き出した CSV など）
+COLUMN_ALIASES = {
+    'timestamp': ('timestamp', '日時', 'datetime', 'time'),
+    'device_id': ('device_id', 'デバイス', 'device'),
+    'temperature': ('temperature', '温度'),
+    'humidity': ('humidity', '湿度'),
+    'light_level': ('light_level', '照度'),
+    'device_type': ('device_type',),
+    'version': ('version',),
+}
+
+TIMESTAMP_FORMATS = ('%Y年%m月%d日 %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M')
+
+# 解析済みの行: COLUMNS の順の値
+ParsedRow = Tuple
+
+
+def _parse_timestamp(value: str) -> Optional[str]:
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        pass
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_number(value, as_int: bool = False):
+    if value is None or value == '':
+        return None
+    try:
+        return int(float(value)) if as_int else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_chunk(rows: List[List], positions: List[Optional[int]], default_device_id: Optional[str]) -> Tuple[List[ParsedRow], int]:
+    """チャンク内の行を解析し、(解析できた行, 解析できなかった行数) を返す（ワーカープロセスで実行）"""
+    parsed = []
+    invalid = 0
+
+    def value_at(row: List, column: int):
+        position = positions[column]
+        if position is None or position >= len(row):
+            return None
+        return row[position]
+
+    for row in rows:
+        raw_timestamp = value_at(row, 0)
+        timestamp = _parse_timestamp(str(raw_timestamp)) if raw_timestamp is not None else None
+        device_id = value_at(row, 1) or default_device_id
+        if timestamp is None or not device_id:
+            invalid += 1
+            continue
+        parsed.append((
+            timestamp,
+            device_id,
+            _parse_number(value_at(row, 2)),
+            _parse_number(value_at(row, 3)),
+            _parse_number(value_at(row, 4), as_int=True),
+            value_at(row, 5) or None,
+            value_at(row, 6) or None,
+        ))
+    return parsed, invalid
+
+
+def resolve_columns(header: List[str]) -> List[Optional[int]]:
+    """ヘッダー行から COLUMNS の各列の位置を求める"""
+    normalized = [name.strip().lower() for name in header]
+    positions = []
+    for column in COLUMNS:
+        position = None
+        for alias in COLUMN_ALIASES[column]:
+            if alias in normalized:
+                position = normalized.index(alias)
+                break
+        positions.append(position)
+    if positions[0] is None:
+        raise ValueError(f"タイムスタンプの列が見つかりません: {header}")
+    return positions
+
+
+class _SQLiteLoader:
+    """SQLite への一括書き込み（ idx_timestamp は読み込み完了後に作成する）
+
+    チェックポイントは書き込み先の import_checkpoints テーブルに、行と同じトランザクションで保存する。
+    WAL と synchronous = NORMAL ではクラッシュ時に直近のトランザクションが失われることがあるが、
+    行とチェックポイントは必ず一緒に失われるため、再開時に読み飛ばす行は書き込み済みの行だけになる。
+    """
+
+    def __init__(self, db_path: Path, checkpoint_key: str):
+        # テーブルと一意インデックスを作成しておく（再開時の重複は INSERT OR IGNORE で無視される）
+        SQLiteStorage(db_path)
+        self.db_path = db_path
+        self.checkpoint_key = checkpoint_key
+        self.conn = sqlite3.connect(db_path)
+        self._journal_mode = self.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS import_checkpoints (
+                source TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_keys (device_id TEXT, timestamp TEXT)")
+        self.conn.execute("DROP INDEX IF EXISTS idx_timestamp")
+        self.conn.commit()
+
+    def load_checkpoint(self) -> Dict:
+        row = self.conn.execute(
+            "SELECT state FROM import_checkpoints WHERE source = ?", (self.checkpoint_key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def write(self, rows: List[ParsedRow]) -> int:
+        before = self.conn.total_changes
+        self.conn.executemany(SQLiteStorage.INSERT_SQL, rows)
+        return self.conn.total_changes - before
+
+    def missing_keys(self, keys: List[Tuple[str, str]]) -> int:
+        """書き込み中のトランザクションから見て、書き込み先にない (device_id, timestamp) の数を返す"""
+        self.conn.execute("DELETE FROM import_keys")
+        self.conn.executemany("INSERT INTO import_keys (device_id, timestamp) VALUES (?, ?)", keys)
+        return self.conn.execute("""
+            SELECT COUNT(*) FROM import_keys k
+            WHERE NOT EXISTS (
+                SELECT 1 FROM temperature_data t
+                WHERE t.device_id = k.device_id AND t.timestamp = k.timestamp
+            )
+        """).fetchone()[0]
+
+    def commit(self, checkpoint: Dict):
+        self.conn.execute("""
+            INSERT INTO import_checkpoints (source, state) VALUES (?, ?)
+            ON CONFLICT(source) DO UPDATE SET state = excluded.state
+        """, (self.checkpoint_key, json.dumps(checkpoint)))
+        self.conn.commit()
+
+    def clear_checkpoint(self):
+        self.conn.execute("DELETE FROM import_checkpoints WHERE source = ?", (self.checkpoint_key,))
+        self.conn.commit()
+
+    def finish(self):
+        self.conn.commit()
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON temperature_data(timestamp)")
+        self.conn.execute("PRAGMA synchronous = FULL")
+        self.conn.commit()
+        if self._journal_mode.lower() != 'wal':
+            self.conn.execute(f"PRAGMA journal_mode = {self._journal_mode}")
+
+    def close(self):
+        self.conn.close()
+
+    def range_stats(self, start: str, end: str) -> Dict:
+        row = self.conn.execute("""
+            SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM temperature_data
+            WHERE timestamp >= ? AND timestamp <= ?
+        """, (start, end)).fetchone()
+        return {'count': row[0], 'min': row[1], 'max': row[2]}
+
+
+class _CSVLoader:
+    """CSV への一括追記（重複は既存の重複排除インデックスで除外）
+
+    チェックポイントは JSON ファイルに保存し、追記した行を fsync してから書き込む。
+    """
+
+    def __init__(self, file_path: Path, checkpoint_path: Path):
+        self.storage = CSVStorage(file_path)
+        self.checkpoint_path = checkpoint_path
+        # 照合用にファイルから読み戻したキーと、読み戻した位置
+        self._stored_keys: set = set()
+        self._verified_size = 0
+
+    def load_checkpoint(self) -> Dict:
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def write(self, rows: List[ParsedRow]) -> int:
+        return self.storage.append_values(rows)
+
+    def missing_keys(self, keys: List[Tuple[str, str]]) -> int:
+        """追記した行をディスクに書き出してから読み戻し、ファイルにない (device_id, timestamp) の数を返す"""
+        with open(self.storage.file_path, 'rb') as f:
+            os.fsync(f.fileno())
+            if self._verified_size:
+                f.seek(self._verified_size)
+                lines = f.read().decode('utf-8').splitlines()
+            else:
+                lines = f.read().decode('utf-8').splitlines()[1:]
+            self._verified_size = f.tell()
+        for row in csv.reader(lines):
+            if len(row) > 1:
+                self._stored_keys.add((row[1], row[0]))
+        return sum(1 for key in set(keys) if key not in self._stored_keys)
+
+    def commit(self, checkpoint: Dict):
+        tmp_path = self.checkpoint_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def clear_checkpoint(self):
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
+
+    def finish(self):
+        pass
+
+    def close(self):
+        pass
+
+    def range_stats(self, start: str, end: str) -> Dict:
+        count = 0
+        first = last = None
+        for row in self.storage.iter_range_rows(datetime.fromisoformat(start)):
+            if row[0] > end:
+                continue
+            count += 1
+            first = row[0] if first is None or row[0] < first else first
+            last = row[0] if last is None or row[0] > last else last
+        return {'count': count, 'min': first, 'max': last}
+
+
+def _create_loader(target_type: str, target_path: Path, checkpoint_path: Path, checkpoint_key: str):
+    if target_type.lower() == "csv":
+        return _CSVLoader(target_path, checkpoint_path)
+    return _SQLiteLoader(target_path, checkpoint_key)
+
+
+def _iter_csv_chunks(path: Path, chunk_rows: int, skip_rows: int) -> Tuple[List[str], Iterator[List[List[str]]]]:
+    """CSV をヘッダーと chunk_rows 行ずつのチャンクに分けて読み込む"""
+    f = open(path, 'r', encoding='utf-8-sig', newline='')
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        f.close()
+        raise ValueError(f"空の CSV ファイルです: {path}")
+
+    def chunks():
+        with f:
+            skipped = 0
+            chunk = []
+            for row in reader:
+                if skipped < skip_rows:
+                    skipped += 1
+                    continue
+                chunk.append(row)
+                if len(chunk) >= chunk_rows:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    return header, chunks()
+
+
+def _iter_sqlite_chunks(path: Path, chunk_rows: int, skip_rows: int) -> Tuple[List[str], Iterator[List[List]]]:
+    """SQLite のテーブルを id 順に chunk_rows 行ずつ読み込む"""
+    def chunks():
+        with closing(sqlite3.connect(path)) as conn:
+            cursor = conn.execute(f"""
+                SELECT {', '.join(COLUMNS)} FROM temperature_data
+                ORDER BY id LIMIT -1 OFFSET ?
+            """, (skip_rows,))
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield [list(row) for row in rows]
+
+    return list(COLUMNS), chunks()
+
+
+class Importer:
+    """CSV / SQLite から別のストレージへの一括インポート
+
+    解析はワーカープロセスで並行して行い、書き込みは transaction_rows 行ごとに
+    1 トランザクションでまとめて行う。コミットのたびにその範囲の行が書き込み先にあることを照合して
+    チェックポイントを保存し、中断した場合は次回同じコマンドで続きから再開する。
+    on_rows を指定した場合は、書き込んだチャンクごとに行（辞書）のリストを渡して呼び出す（アラートの評価など）。
+    """
+
+    def __init__(
+        self,
+        source_path: Path,
+        target_type: str,
+        target_path: Path,
+        source_type: str = "csv",
+        workers: Optional[int] = None,
+        chunk_rows: int = 20000,
+        transaction_rows: int = 200000,
+        default_device_id: Optional[str] = None,
+        checkpoint_path: Optional[Path] = None,
+        on_rows: Optional[Callable[[List[Dict]], None]] = None
+    ):
+        self.source_path = Path(source_path)
+        self.source_type = source_type.lower()
+        self.target_type = target_type.lower()
+        self.target_path = Path(target_path)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_rows = chunk_rows
+        self.transaction_rows = transaction_rows
+        self.default_device_id = default_device_id
+        self.checkpoint_path = Path(checkpoint_path) if checkpoint_path else \
+            self.target_path.with_name(self.target_path.name + '.import.json')
+        self.on_rows = on_rows
+        self.logger = logging.getLogger(__name__)
+
+    def _source_signature(self) -> Dict:
+        stat = os.stat(self.source_path)
+        return {'source': str(self.source_path.resolve()), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _load_checkpoint(self, loader) -> Dict:
+        """同じ入力ファイルに対するチェックポイントがあれば読み込む"""
+        checkpoint = loader.load_checkpoint()
+        if not checkpoint:
+            return {}
+        if checkpoint.get('signature') != self._source_signature():
+            self.logger.warning("入力ファイルが変更されているため、チェックポイントを使わずに最初から読み込みます")
+            return {}
+        return checkpoint
+
+    def run(self) -> Dict:
+        """インポートを実行し、件数と範囲ごとの照合結果を返す"""
+        loader = _create_loader(self.target_type, self.target_path, self.checkpoint_path,
+                                str(self.source_path.resolve()))
+        try:
+            checkpoint = self._load_checkpoint(loader)
+            stats = checkpoint.get('stats') or {
+                'rows_read': 0, 'rows_parsed': 0, 'rows_invalid': 0, 'rows_inserted': 0,
+                'source_min': None, 'source_max': None,
+            }
+            stats.setdefault('ranges', [])
+            if stats['rows_read']:
+                self.logger.info(f"チェックポイントから再開します（ {stats['rows_read']} 行読み込み済み）")
+
+            if self.source_type == "sqlite":
+                header, chunks = _iter_sqlite_chunks(self.source_path, self.chunk_rows, stats['rows_read'])
+            else:
+                header, chunks = _iter_csv_chunks(self.source_path, self.chunk_rows, stats['rows_read'])
+            positions = resolve_columns(header)
+
+            self._load(loader, chunks, positions, stats)
+            loader.finish()
+            result = self._verify(loader, stats)
+            # 照合に失敗した範囲は続きからでは読み直せないため、再実行時は最初から読み込む
+            loader.clear_checkpoint()
+        finally:
+            loader.close()
+        return result
+
+    def _load(self, loader, chunks: Iterator[List[List]], positions: List[Optional[int]], stats: Dict):
+        uncommitted = 0
+        range_start = stats['rows_read']
+        keys: List[Tuple[str, str]] = []
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            # 読み込みが解析より先行しすぎないよう、投入済みのチャンク数を制限する
+            pending = deque()
+            chunk_iter = iter(chunks)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < self.workers * 2:
+                    chunk = next(chunk_iter, None)
+                    if chunk is None:
+                        exhausted = True
+                        break
+                    future = executor.submit(parse_chunk, chunk, positions, self.default_device_id)
+                    pending.append((len(chunk), future))
+                if not pending:
+                    break
+
+                # 投入順に書き込み、読み込み済みの行数がチェックポイントと一致するようにする
+                rows_read, future = pending.popleft()
+                parsed, invalid = future.result()
+                stats['rows_inserted'] += loader.write(parsed)
+                if self.on_rows is not None and parsed:
+                    self.on_rows([dict(zip(COLUMNS, row)) for row in parsed])
+                stats['rows_read'] += rows_read
+                stats['rows_parsed'] += len(parsed)
+                stats['rows_invalid'] += invalid
+                for row in parsed:
+                    keys.append((row[1], row[0]))
+                    if stats['source_min'] is None or row[0] < stats['source_min']:
+                        stats['source_min'] = row[0]
+                    if stats['source_max'] is None or row[0] > stats['source_max']:
+                        stats['source_max'] = row[0]
+
+                uncommitted += rows_read
+                if uncommitted >= self.transaction_rows:
+                    self._commit(loader, stats, range_start, keys)
+                    range_start = stats['rows_read']
+                    keys = []
+                    uncommitted = 0
+                    self.logger.info(f"{stats['rows_read']} 行を読み込みました（新規 {stats['rows_inserted']} 件）")
+
+        if uncommitted or not stats['ranges']:
+            self._commit(loader, stats, range_start, keys)
+
+    def _commit(self, loader, stats: Dict, range_start: int, keys: List[Tuple[str, str]]):
+        """この範囲の行がすべて書き込み先にあることを照合し、結果をチェックポイントと一緒にコミット"""
+        timestamps = [key[1] for key in keys]
+        stats['ranges'].append({
+            'rows': [range_start, stats['rows_read']],
+            'min': min(timestamps) if timestamps else None,
+            'max': max(timestamps) if timestamps else None,
+            'keys': len(set(keys)),
+            'missing': loader.missing_keys(keys) if keys else 0,
+        })
+        loader.commit({'signature': self._source_signature(), 'stats': stats})
+
+    def _verify(self, loader, stats: Dict) -> Dict:
+        """入力の範囲ごとの照合結果をまとめる（書き込み先の同期間の件数は参考として返す）"""
+        result = dict(stats)
+        result['rows_duplicate'] = stats['rows_parsed'] - stats['rows_inserted']
+        result['failed_ranges'] = [entry for entry in stats['ranges'] if entry['missing']]
+        result['ok'] = not result['failed_ranges']
+        if stats['source_min'] is None:
+            result.update({'target_count': 0, 'target_min': None, 'target_max': None})
+            return result
+
+        target = loader.range_stats(stats['source_min'], stats['source_max'])
+        result['target_count'] = target['count']
+        result['target_min'] = target['min']
+        result['target_max'] = target['max']
+        return result
@@ -0,0 +1,204 @@
+"""
+オブジェクトストア
+スナップショットやポーリング・アラートの状態を保存する先（ローカルディレクトリ / Google Cloud Storage ）。
+版を指定した条件付き書き込み（ put_if ）で、複数のインスタンスからの更新を競合なく行える。
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+
+class ObjectStore(ABC):
+    """スナップショットの保存先の基底クラス"""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes):
+        pass
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def get_with_version(self, key: str) -> Tuple[Optional[bytes], Optional[str]]:
+        """内容と版を返す（存在しない場合は (None, None) ）"""
+        pass
+
+    @abstractmethod
+    def put_if(self, key: str, data: bytes, version: Optional[str]) -> bool:
+        """現在の版が version と一致する場合だけ書き込む（ None は存在しない場合だけ）。一致しなければ False"""
+        pass
+
+    @abstractmethod
+    def list(self, prefix: str) -> List[str]:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+
+class LocalDirectoryStore(ObjectStore):
+    """ローカルディレクトリを保存先とするストア（テスト・単一ホスト向け）"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 同時に書き込む他のプロセスと一時ファイルが重ならないようにする
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _version(data: Optional[bytes]) -> Optional[str]:
+        return hashlib.sha256(data).hexdigest() if data is not None else None
+
+    def get_with_version(self, key: str) -> Tuple[Optional[bytes], Optional[str]]:
+        data = self.get(key)
+        return data, self._version(data)
+
+    def put_if(self, key: str, data: bytes, version: Optional[str]) -> bool:
+        # 版の確認と書き込みの間に他のプロセスが書き込まないよう、キーごとのロックファイルで排他する
+        lock_path = self._path(key).with_name(self._path(key).name + '.lock')
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                if self._version(self.get(key)) != version:
+                    return False
+                self.put(key, data)
+                return True
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def list(self, prefix: str) -> List[str]:
+        directory = self._path(prefix).parent if not prefix.endswith('/') else self._path(prefix)
+        if not directory.exists():
+            return []
+        keys = []
+        for path in directory.rglob('*'):
+            if path.is_file() and not path.name.endswith(('.tmp', '.lock')):
+                key = path.relative_to(self.root).as_posix()
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class GCSStore(ObjectStore):
+    """Google Cloud Storage を保存先とするストア（ google-auth の認証情報で JSON API を直接呼び出す）"""
+
+    API_URL = "https://storage.googleapis.com/storage/v1/b"
+    UPLOAD_URL = "https://storage.googleapis.com/upload/storage/v1/b"
+    SCOPES = ['https://www.googleapis.com/auth/devstorage.read_write']
+
+    def __init__(self, bucket: str, prefix: str = "", timeout: float = 30.0):
+        import google.auth
+        from google.auth.transport.requests import AuthorizedSession
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.timeout = timeout
+
+        key_json = os.getenv('GOOGLE_SERVICE_ACCOUNT_KEY')
+        if key_json:
+            from google.oauth2.service_account import Credentials
+            credentials = Credentials.from_service_account_info(json.loads(key_json), scopes=self.SCOPES)
+        else:
+            credentials, _ = google.auth.default(scopes=self.SCOPES)
+        self.session = AuthorizedSession(credentials)
+
+    def _object_url(self, key: str) -> str:
+        return f"{self.API_URL}/{self.bucket}/o/{quote(self.prefix + key, safe='')}"
+
+    def put(self, key: str, data: bytes):
+        response = self.session.post(
+            f"{self.UPLOAD_URL}/{self.bucket}/o",
+            params={'uploadType': 'media', 'name': self.prefix + key},
+            data=data,
+            headers={'Content-Type': 'application/octet-stream'},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_with_version(key)[0]
+
+    def get_with_version(self, key: str) -> Tuple[Optional[bytes], Optional[str]]:
+        # 版にはオブジェクトの世代番号（ generation ）を使う
+        response = self.session.get(self._object_url(key), params={'alt': 'media'}, timeout=self.timeout)
+        if response.status_code == 404:
+            return None, None
+        response.raise_for_status()
+        return response.content, response.headers.get('x-goog-generation')
+
+    def put_if(self, key: str, data: bytes, version: Optional[str]) -> bool:
+        response = self.session.post(
+            f"{self.UPLOAD_URL}/{self.bucket}/o",
+            params={'uploadType': 'media', 'name': self.prefix + key, 'ifGenerationMatch': version or '0'},
+            data=data,
+            headers={'Content-Type': 'application/octet-stream'},
+            timeout=self.timeout
+        )
+        if response.status_code == 412:
+            return False
+        response.raise_for_status()
+        return True
+
+    def list(self, prefix: str) -> List[str]:
+        keys = []
+        params = {'prefix': self.prefix + prefix, 'fields': 'items(name),nextPageToken'}
+        while True:
+            response = self.session.get(f"{self.API_URL}/{self.bucket}/o", params=params, timeout=self.timeout)
+            response.raise_for_status()
+            body = response.json()
+            keys.extend(item['name'][len(self.prefix):] for item in body.get('items', []))
+            if not body.get('nextPageToken'):
+                return sorted(keys)
+            params['pageToken'] = body['nextPageToken']
+
+    def delete(self, key: str):
+        response = self.session.delete(self._object_url(key), timeout=self.timeout)
+        if response.status_code != 404:
+            response.raise_for_status()
+
+
+def create_object_store(url: Optional[str]) -> Optional[ObjectStore]:
+    """'gs://bucket/prefix' またはローカルディレクトリのパスから保存先を作成（未指定は None ）"""
+    if not url:
+        return None
+    if url.startswith('gs://'):
+        bucket, _, prefix = url[len('gs://'):].partition('/')
+        return GCSStore(bucket, prefix)
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    return LocalDirectoryStore(Path(url))
@@ -0,0 +1,337 @@
+"""
+デバイスごとの適応的な取得間隔
+値の変化の速さとアラートのしきい値への近さから取得間隔を伸縮し、 1 日の API 呼び出し数の上限内に収める
+"""
+
+import json
+import math
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .alerts import RateOfChangeRule, Rule
+from .metrics import metrics
+from .sample import SampleLike, sample_field
+from .object_store import LocalDirectoryStore, ObjectStore, create_object_store
+
+POLLING_INTERVAL = metrics.gauge("polling_interval_seconds", "デバイスごとの現在の取得間隔")
+POLLING_BUDGET_REMAINING = metrics.gauge("polling_budget_remaining", "本日の API 呼び出し数の残り")
+POLLING_DEFERRED = metrics.counter(
+    "polling_deferred_total", "取得時刻を過ぎたが API 呼び出し数の上限で見送った取得数"
+)
+POLLING_STATE_CONFLICTS = metrics.counter(
+    "polling_state_conflicts_total", "他のインスタンスと同時に状態を更新したため再試行した回数"
+)
+
+STATE_KEY = "polling_state.json"
+# 他のインスタンスとの競合で状態を保存できない場合に再試行する回数
+STATE_ATTEMPTS = 5
+
+# 変化の速さの目安（ 1 時間あたりこれだけ変化すると最短間隔にする）
+RATE_SCALES = {'temperature': 2.0, 'humidity': 10.0, 'light_level': 5.0}
+# しきい値までの距離の目安（これより近づくと間隔を縮め始める）
+THRESHOLD_MARGINS = {'temperature': 2.0, 'humidity': 10.0, 'light_level': 3.0}
+
+
+def _urgency(device_id: str, previous: Optional[List], timestamp: float, values: Dict,
+             rules: List[Rule]) -> float:
+    """0（変化なし）〜 1（最短間隔で取得すべき）の緊急度を返す"""
+    urgency = 0.0
+    if previous is not None and timestamp > previous[0]:
+        hours = (timestamp - previous[0]) / 3600
+        for field, scale in RATE_SCALES.items():
+            value, last = values.get(field), previous[1].get(field)
+            if value is not None and last is not None:
+                urgency = max(urgency, abs(value - last) / hours / scale)
+
+    for rule in rules:
+        value = values.get(rule.field)
+        if value is None or not rule.applies_to(device_id):
+            continue
+        margin = THRESHOLD_MARGINS.get(rule.field, 1.0)
+        for bound in (getattr(rule, 'above', None), getattr(rule, 'below', None)):
+            if bound is not None:
+                urgency = max(urgency, 1 - abs(bound - value) / margin)
+        if isinstance(rule, RateOfChangeRule) and previous is not None and timestamp > previous[0]:
+            last = previous[1].get(rule.field)
+            if last is not None:
+                change = (value - last) / (timestamp - previous[0]) * rule.per_minutes * 60
+                urgency = max(urgency, abs(change) / rule.max_change)
+    return min(1.0, urgency)
+
+
+class PollingPolicy:
+    """デバイスごとの取得間隔と 1 日の API 呼び出し数を管理する
+
+    間隔は緊急度に応じて min_interval 〜 max_interval の間で決め（対数スケールで補間）、
+    短くする場合はすぐに、長くする場合は backoff 倍ずつ伸ばす。本日の残りの呼び出し数で
+    現在の間隔を維持できない場合は、全デバイスの間隔を同じ比率で伸ばして上限内に収める。
+
+    状態は store に保存して次回の実行・他のインスタンスと共有する。取得するデバイスは
+    claim_due_devices で保存先の版を条件に予約するため、複数のインスタンスが同時に実行しても
+    同じデバイスを重ねて取得せず、呼び出し数は全インスタンスの合計で上限に収まる。
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 300.0,
+        max_interval: float = 3600.0,
+        daily_budget: int = 9000,
+        rules: Optional[List[Rule]] = None,
+        store: Optional[ObjectStore] = None,
+        state_key: str = STATE_KEY,
+        backoff: float = 1.5
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.daily_budget = daily_budget
+        self.rules = rules or []
+        self.store = store
+        self.state_key = state_key
+        self.backoff = backoff
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        # device_id → {'interval': 秒, 'last_poll': 時刻, 'last': [時刻, {項目: 値}]}
+        self._devices: Dict[str, Dict] = {}
+        self._day = None
+        self._used = 0
+        # 保存先に未反映の呼び出し数と、更新したデバイス
+        self._unsaved_calls = 0
+        self._dirty = set()
+        # 予約時に呼び出し 1 回分を計上済みのデバイス
+        self._reserved = set()
+        self.refresh()
+
+    def _read_state(self):
+        """保存先の状態と版を読み込む（読み込めない場合は (None, None) ）"""
+        if self.store is None:
+            return None, None
+        try:
+            data, version = self.store.get_with_version(self.state_key)
+            return (json.loads(data) if data else None), version
+        except Exception as e:
+            self.logger.error(f"取得間隔の状態の読み込みに失敗しました: {e}")
+            return None, None
+
+    def _apply_locked(self, saved: Optional[Dict]):
+        if saved is None:
+            return
+        self._devices = saved.get('devices', {})
+        self._day = saved.get('day')
+        self._used = saved.get('used', 0)
+
+    def refresh(self) -> Optional[str]:
+        """保存先の状態を読み込み直し（他のインスタンスの取得も反映する）、その版を返す"""
+        saved, version = self._read_state()
+        with self._lock:
+            self._apply_locked(saved)
+            self._unsaved_calls = 0
+            self._dirty.clear()
+        return version
+
+    def _merge_locked(self, saved: Optional[Dict]) -> Dict:
+        """保存先の状態に、このインスタンスの未反映の更新を重ねる"""
+        if saved is None or saved.get('day') is None or (self._day or '') > saved['day']:
+            used = self._used
+        elif saved['day'] == self._day:
+            used = saved.get('used', 0) + self._unsaved_calls
+        else:
+            # 保存先はすでに翌日の状態（このインスタンスの呼び出しは前日分）
+            used = saved.get('used', 0)
+        devices = dict(saved.get('devices', {})) if saved else {}
+        for device_id in self._dirty:
+            devices[device_id] = self._devices[device_id]
+        day = max(filter(None, (self._day, saved.get('day') if saved else None)), default=None)
+        return {'day': day, 'used': used, 'devices': devices}
+
+    def _write(self, content: Dict, version: Optional[str]) -> bool:
+        try:
+            return self.store.put_if(self.state_key, json.dumps(content).encode('utf-8'), version)
+        except Exception as e:
+            self.logger.error(f"取得間隔の状態の保存に失敗しました: {e}")
+            return False
+
+    def save_state(self):
+        """未反映の更新を保存先の最新の状態に重ねて保存（他のインスタンスと競合した場合は読み直して再試行）"""
+        if self.store is None:
+            return
+        for _ in range(STATE_ATTEMPTS):
+            saved, version = self._read_state()
+            with self._lock:
+                if not self._unsaved_calls and not self._dirty:
+                    return
+                merged = self._merge_locked(saved)
+            if self._write(merged, version):
+                with self._lock:
+                    self._apply_locked(merged)
+                    self._unsaved_calls = 0
+                    self._dirty.clear()
+                return
+            POLLING_STATE_CONFLICTS.inc()
+        self.logger.error("他のインスタンスとの競合が続いたため、取得間隔の状態を保存できませんでした")
+
+    def _roll_day_locked(self, now: float):
+        day = datetime.fromtimestamp(now).date().isoformat()
+        if day != self._day:
+            self._day = day
+            self._used = 0
+
+    def _device_locked(self, device_id: str) -> Dict:
+        state = self._devices.get(device_id)
+        if state is None:
+            state = {'interval': self.min_interval, 'last_poll': None, 'last': None}
+            self._devices[device_id] = state
+        return state
+
+    def _budget_scale_locked(self, device_ids: List[str], now: float) -> float:
+        """本日の残りの呼び出し数に収めるために間隔に掛ける倍率（ 1 以上）"""
+        tomorrow = datetime.fromtimestamp(now).date() + timedelta(days=1)
+        remaining_seconds = datetime.combine(tomorrow, datetime.min.time()).timestamp() - now
+        remaining_calls = self.daily_budget - self._used
+        if remaining_calls <= 0:
+            return math.inf
+        demand = sum(remaining_seconds / self._device_locked(device_id)['interval'] for device_id in device_ids)
+        return max(1.0, demand / remaining_calls)
+
+    def effective_intervals(self, device_ids: List[str], now: Optional[float] = None) -> Dict[str, float]:
+        """呼び出し数の上限を反映した、デバイスごとの現在の取得間隔"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._roll_day_locked(now)
+            scale = self._budget_scale_locked(device_ids, now)
+            return {device_id: self._device_locked(device_id)['interval'] * scale for device_id in device_ids}
+
+    def due_devices(self, device_ids: List[str], now: Optional[float] = None) -> List[str]:
+        """取得時刻を迎えたデバイスを、予定時刻を過ぎている割合の大きい順に返す（残りの呼び出し数まで）"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._roll_day_locked(now)
+            scale = self._budget_scale_locked(device_ids, now)
+            overdue = []
+            for device_id in device_ids:
+                state = self._device_locked(device_id)
+                interval = state['interval'] * scale
+                if state['last_poll'] is None:
+                    overdue.append((math.inf, device_id))
+                elif now - state['last_poll'] >= interval:
+                    overdue.append(((now - state['last_poll']) / interval, device_id))
+            overdue.sort(key=lambda item: item[0], reverse=True)
+            remaining = max(0, self.daily_budget - self._used)
+            POLLING_BUDGET_REMAINING.set(remaining)
+            if len(overdue) > remaining:
+                POLLING_DEFERRED.inc(len(overdue) - remaining)
+            return [device_id for _, device_id in overdue[:remaining]]
+
+    def claim_due_devices(self, device_ids: List[str], now: Optional[float] = None) -> List[str]:
+        """取得時刻を迎えたデバイスを予約して返す
+
+        保存先の最新の状態から対象を決め、取得時刻と呼び出し 1 回分を計上した状態を
+        読み込んだ版を条件に書き込む。他のインスタンスが先に書き込んでいた場合は読み直して決め直す。
+        """
+        now = time.time() if now is None else now
+        for _ in range(STATE_ATTEMPTS):
+            version = self.refresh()
+            due = self.due_devices(device_ids, now)
+            if not due:
+                return []
+            with self._lock:
+                for device_id in due:
+                    self._device_locked(device_id)['last_poll'] = now
+                    self._dirty.add(device_id)
+                self._reserved.update(due)
+                self._used += len(due)
+                self._unsaved_calls += len(due)
+                content = {'day': self._day, 'used': self._used, 'devices': self._devices}
+            if self.store is None:
+                return due
+            if self._write(content, version):
+                with self._lock:
+                    self._unsaved_calls = 0
+                    self._dirty.clear()
+                return due
+            with self._lock:
+                self._reserved.difference_update(due)
+            POLLING_STATE_CONFLICTS.inc()
+        self.logger.warning("他のインスタンスとの競合が続いたため、今回の取得を見送ります")
+        return []
+
+    def next_due(self, device_ids: List[str], now: Optional[float] = None) -> float:
+        """次にいずれかのデバイスの取得時刻を迎える時刻"""
+        now = time.time() if now is None else now
+        intervals = self.effective_intervals(device_ids, now)
+        with self._lock:
+            times = [
+                now if self._devices[device_id]['last_poll'] is None
+                else self._devices[device_id]['last_poll'] + interval
+                for device_id, interval in intervals.items()
+            ]
+        if not times or math.isinf(min(times)):
+            # 本日の上限に達した場合は翌日まで待つ
+            tomorrow = datetime.fromtimestamp(now).date() + timedelta(days=1)
+            return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+        return min(times)
+
+    def record(self, device_id: str, data: Optional[SampleLike], now: Optional[float] = None,
+               calls: int = 1):
+        """取得結果（失敗時は None ）と実際の API 呼び出し数（再試行を含む）を記録し、次の取得間隔を決める"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._roll_day_locked(now)
+            # 予約時に 1 回分を計上済みの場合は、再試行の分だけを加える
+            extra = calls - 1 if device_id in self._reserved else calls
+            self._reserved.discard(device_id)
+            self._used += extra
+            self._unsaved_calls += extra
+            self._dirty.add(device_id)
+            state = self._device_locked(device_id)
+            state['last_poll'] = now
+            if not data:
+                return
+
+            values = {}
+            for field in RATE_SCALES:
+                value = sample_field(data, field)
+                if isinstance(value, (int, float)):
+                    values[field] = float(value)
+            urgency = _urgency(device_id, state['last'], now, values, self.rules)
+            target = self.max_interval * (self.min_interval / self.max_interval) ** urgency
+            state['interval'] = min(target, state['interval'] * self.backoff)
+            state['last'] = [now, values]
+            POLLING_INTERVAL.set(state['interval'], device_id=device_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'day': self._day,
+                'used': self._used,
+                'budget': self.daily_budget,
+                'intervals': {device_id: round(state['interval'], 1) for device_id, state in self._devices.items()},
+            }
+
+
+def create_polling_policy(
+    enabled: bool,
+    min_interval: float,
+    max_interval: float,
+    daily_budget: int,
+    rules: Optional[List[Rule]] = None,
+    state_path: Optional[Path] = None,
+    state_store: Optional[str] = None
+) -> Optional[PollingPolicy]:
+    """設定に応じて取得間隔のポリシーを作成（無効の場合は None ）
+
+    state_store（ gs://bucket/prefix またはディレクトリ）を指定した場合はそこに、
+    それ以外は state_path のファイルに状態を保存する。
+    """
+    if not enabled:
+        return None
+    if state_store:
+        store, state_key = create_object_store(state_store), STATE_KEY
+    elif state_path:
+        store, state_key = LocalDirectoryStore(Path(state_path).parent), Path(state_path).name
+    else:
+        store, state_key = None, STATE_KEY
+    return PollingPolicy(min_interval, max_interval, daily_budget, rules=rules, store=store, state_key=state_key)
@@ -0,0 +1,149 @@
+"""
+収集処理のプロファイリング
+cProfile ・ tracemalloc ・スタックのサンプリングで収集処理を計測し、レポートを保存する
+"""
+
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from .object_store import ObjectStore
+
+
+class StackSampler:
+    """一定間隔で全スレッドのスタックを記録し、 flamegraph 用の collapsed 形式で出力する"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _cpu_report(profiler: cProfile.Profile, top: int) -> str:
+    buffer = io.StringIO()
+    stats = pstats.Stats(profiler, stream=buffer)
+    stats.strip_dirs()
+    buffer.write("=== 累積時間順 ===\n")
+    stats.sort_stats('cumulative').print_stats(top)
+    buffer.write("\n=== 関数内の時間順 ===\n")
+    stats.sort_stats('tottime').print_stats(top)
+    return buffer.getvalue()
+
+
+def _hot_functions(profiler: cProfile.Profile, limit: int) -> List[Dict]:
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return [
+        {
+            'function': f"{name} ({filename.rsplit('/', 1)[-1]}:{line})",
+            'calls': calls,
+            'tottime': round(tottime, 6),
+            'cumtime': round(cumtime, 6),
+        }
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in rows
+    ]
+
+
+def _allocation_report(snapshot: tracemalloc.Snapshot, top: int) -> str:
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    stats = snapshot.statistics('lineno')
+    total = sum(stat.size for stat in stats)
+    lines = [f"=== 確保中のメモリ上位 {top} 件（合計 {total / 1024:.1f} KiB ） ==="]
+    for index, stat in enumerate(stats[:top], 1):
+        frame = stat.traceback[0]
+        lines.append(f"#{index}: {frame.filename}:{frame.lineno}: {stat.size / 1024:.1f} KiB ({stat.count} 個)")
+    return "\n".join(lines) + "\n"
+
+
+def profile_cycles(
+    func: Callable[[], object],
+    store: ObjectStore,
+    repeat: int = 1,
+    top: int = 30,
+    collapsed: bool = True,
+    sample_interval: float = 0.005
+) -> Dict:
+    """func を repeat 回実行して計測し、レポートを store に保存して要約を返す"""
+    prefix = datetime.now().strftime('profile-%Y%m%d-%H%M%S')
+    profiler = cProfile.Profile()
+    sampler = StackSampler(sample_interval) if collapsed else None
+
+    tracemalloc.start()
+    if sampler:
+        sampler.start()
+    started = time.perf_counter()
+    try:
+        for _ in range(repeat):
+            profiler.runcall(func)
+    finally:
+        elapsed = time.perf_counter() - started
+        if sampler:
+            sampler.stop()
+        allocations = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    reports = {
+        f"{prefix}/cpu.txt": _cpu_report(profiler, top),
+        f"{prefix}/memory.txt": _allocation_report(allocations, top),
+    }
+    if sampler:
+        reports[f"{prefix}/stacks.collapsed"] = sampler.collapsed()
+
+    saved = []
+    for key, content in reports.items():
+        try:
+            store.put(key, content.encode('utf-8'))
+            saved.append(key)
+        except Exception as e:
+            logging.getLogger(__name__).error(f"プロファイルの保存に失敗しました ({key}): {e}")
+
+    return {
+        'cycles': repeat,
+        'elapsed_seconds': round(elapsed, 6),
+        'peak_memory_bytes': peak,
+        'reports': saved,
+        'hot_functions': _hot_functions(profiler, 10),
+    }
@@ -0,0 +1,368 @@
+"""
+データ参照クエリ
+期間・デバイスを指定して生データまたは集計データを JSON / CSV でストリーミング出力する
+"""
+
+import csv
+import hashlib
+import io
+import json
+import math
+import time
+from datetime import datetime, timedelta
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from .data_storage import DataStorage
+from .downsample import METHODS, downsample
+from .result_cache import CacheEntry, QUERY_CACHE_REQUESTS, row_timestamp
+
+RESOLUTION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+NUMERIC_FIELDS = ('temperature', 'humidity', 'light_level')
+RAW_COLUMNS = ['timestamp', 'device_id', 'temperature', 'humidity', 'light_level', 'device_type', 'version']
+AGGREGATE_COLUMNS = ['timestamp', 'device_id', 'count'] + [
+    f"{field}_{stat}" for field in NUMERIC_FIELDS for stat in ('avg', 'min', 'max')
+]
+DOWNSAMPLE_COLUMNS = ['timestamp', 'device_id', 'temperature', 'humidity', 'light_level']
+FORMATS = ('json', 'csv')
+
+
+class QueryError(ValueError):
+    """クエリパラメータが不正な場合のエラー"""
+
+
+def parse_resolution(value: Optional[str]) -> Optional[int]:
+    """'raw' / '300' / '5m' / '1h' などを集計間隔（秒）に変換（ raw は None ）"""
+    if value is None or value == '' or value == 'raw':
+        return None
+    try:
+        if value[-1] in RESOLUTION_UNITS:
+            seconds = int(value[:-1]) * RESOLUTION_UNITS[value[-1]]
+        else:
+            seconds = int(value)
+    except ValueError:
+        raise QueryError(f"resolution の形式が不正です: {value}")
+    if seconds <= 0:
+        raise QueryError(f"resolution は正の値を指定してください: {value}")
+    return seconds
+
+
+def _parse_datetime(name: str, value: Optional[str]) -> Optional[datetime]:
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise QueryError(f"{name} は ISO 形式で指定してください: {value}")
+
+
+def _parse_points(value: Optional[str]) -> Optional[int]:
+    """間引き後の目標点数（未指定は None ）"""
+    if value is None or value == '':
+        return None
+    try:
+        points = int(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"points は整数で指定してください: {value}")
+    if points < 3:
+        raise QueryError(f"points は 3 以上を指定してください: {value}")
+    return points
+
+
+class QueryParams:
+    """クエリパラメータ"""
+
+    def __init__(self, params: Dict, default_hours: int = 24):
+        self.device_id = params.get('device_id') or None
+        self.format = (params.get('format') or 'json').lower()
+        if self.format not in FORMATS:
+            raise QueryError(f"format は {' / '.join(FORMATS)} のいずれかを指定してください: {self.format}")
+        self.resolution = parse_resolution(params.get('resolution'))
+        self.points = _parse_points(params.get('points'))
+        self.method = (params.get('method') or 'lttb').lower()
+        if self.method not in METHODS:
+            raise QueryError(f"method は {' / '.join(METHODS)} のいずれかを指定してください: {self.method}")
+        if self.points is not None and self.resolution is not None:
+            raise QueryError("points と resolution は同時に指定できません")
+
+        self.start = _parse_datetime('start', params.get('start'))
+        self.end = _parse_datetime('end', params.get('end'))
+        # start が指定されていない場合は現在からの相対期間とする
+        self.relative = self.start is None
+        if self.relative:
+            try:
+                self.hours = float(params.get('hours') or default_hours)
+            except (TypeError, ValueError):
+                raise QueryError(f"hours は数値で指定してください: {params.get('hours')}")
+            if not math.isfinite(self.hours) or self.hours <= 0:
+                raise QueryError(f"hours は正の有限な数値で指定してください: {params.get('hours')}")
+            try:
+                self.start = (self.end or datetime.now()) - timedelta(hours=self.hours)
+            except OverflowError:
+                raise QueryError(f"hours が大きすぎます: {params.get('hours')}")
+            if self.resolution is not None:
+                # 集計する場合は先頭をバケットの境界に揃え、期間がずれても同じバケットになるようにする
+                self.start = datetime.fromtimestamp(
+                    math.floor(self.start.timestamp() / self.resolution) * self.resolution
+                )
+        if self.end is not None and self.end <= self.start:
+            raise QueryError("end は start より後の時刻を指定してください")
+
+    @property
+    def sliding(self) -> bool:
+        """終端のない「直近 N 時間」の期間か（結果キャッシュで末尾だけを追加できる）"""
+        return self.relative and self.end is None and self.points is None
+
+    def result_key(self) -> tuple:
+        """クエリ結果キャッシュのキー（デバイス・期間・集計間隔・間引き方法）"""
+        if self.sliding:
+            range_key = ('last', self.hours)
+        else:
+            range_key = (self.start.timestamp(), self.end.timestamp() if self.end else None)
+        sampling = (self.method, self.points) if self.points is not None else None
+        return (self.device_id, range_key, self.resolution, sampling)
+
+    def cache_key(self) -> str:
+        """ETag の算出に使うパラメータの表現"""
+        if self.relative:
+            # 相対期間は集計間隔（生データは 1 分）単位で丸め、短い間隔のポーリングで同じ ETag になるようにする
+            step = self.resolution or 60
+            start = math.floor(self.start.timestamp() / step) * step
+            range_key = f"last{self.hours}h@{start}"
+        else:
+            range_key = f"{self.start.isoformat()}/{self.end.isoformat() if self.end else ''}"
+        sampling = f"{self.method}:{self.points}" if self.points is not None else ''
+        return f"{self.device_id}|{range_key}|{self.resolution}|{sampling}|{self.format}"
+
+
+def build_etag(params: QueryParams, last_modified: Optional[float]) -> str:
+    """パラメータと最終書き込み時刻から ETag を生成"""
+    digest = hashlib.sha1(f"{params.cache_key()}|{last_modified}".encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def format_http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def is_not_modified(headers: Dict, etag: str, last_modified: Optional[float], relative: bool = False) -> bool:
+    """条件付きリクエストに対して 304 を返せるかを判定
+
+    相対期間（直近 N 時間）は書き込みがなくても期間の先頭が進んで結果が変わるため、
+    期間の先頭を含む ETag だけで判定し、 If-Modified-Since は使わない。
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        candidates = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since and last_modified is not None and not relative:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP 日付は秒単位のため切り捨てて比較する
+        return int(last_modified) <= since
+    return False
+
+
+def _to_number(value, as_int: bool = False):
+    if value is None or value == '':
+        return None
+    try:
+        return int(float(value)) if as_int else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_rows(rows: Iterable[Dict]) -> Iterator[Dict]:
+    """バックエンドごとの差（ CSV は文字列）をなくした生データを返す"""
+    for row in rows:
+        yield {
+            'timestamp': row.get('timestamp'),
+            'device_id': row.get('device_id'),
+            'temperature': _to_number(row.get('temperature')),
+            'humidity': _to_number(row.get('humidity')),
+            'light_level': _to_number(row.get('light_level'), as_int=True),
+            'device_type': row.get('device_type'),
+            'version': row.get('version'),
+        }
+
+
+class _Bucket:
+    """集計バケット（件数・合計・最小・最大）"""
+
+    __slots__ = ('start', 'count', 'sums', 'counts', 'mins', 'maxs')
+
+    def __init__(self, start: float):
+        self.start = start
+        self.count = 0
+        self.sums = [0.0] * len(NUMERIC_FIELDS)
+        self.counts = [0] * len(NUMERIC_FIELDS)
+        self.mins = [math.inf] * len(NUMERIC_FIELDS)
+        self.maxs = [-math.inf] * len(NUMERIC_FIELDS)
+
+    def add(self, row: Dict):
+        self.count += 1
+        for index, field in enumerate(NUMERIC_FIELDS):
+            value = row[field]
+            if value is None:
+                continue
+            self.sums[index] += value
+            self.counts[index] += 1
+            if value < self.mins[index]:
+                self.mins[index] = value
+            if value > self.maxs[index]:
+                self.maxs[index] = value
+
+    def to_dict(self, device_id: str) -> Dict:
+        result = {
+            'timestamp': datetime.fromtimestamp(self.start).isoformat(),
+            'device_id': device_id,
+            'count': self.count,
+        }
+        for index, field in enumerate(NUMERIC_FIELDS):
+            has_value = self.counts[index] > 0
+            result[f"{field}_avg"] = round(self.sums[index] / self.counts[index], 3) if has_value else None
+            result[f"{field}_min"] = self.mins[index] if has_value else None
+            result[f"{field}_max"] = self.maxs[index] if has_value else None
+        return result
+
+
+def aggregate(rows: Iterable[Dict], bucket_seconds: int) -> Iterator[Dict]:
+    """時刻昇順のデータをデバイスごとに bucket_seconds 間隔で集計して返す"""
+    buckets: Dict[str, _Bucket] = {}
+    for row in rows:
+        ts = datetime.fromisoformat(row['timestamp']).timestamp()
+        bucket_start = math.floor(ts / bucket_seconds) * bucket_seconds
+        device_id = row['device_id']
+        bucket = buckets.get(device_id)
+        if bucket is not None and bucket.start != bucket_start:
+            yield bucket.to_dict(device_id)
+            bucket = None
+        if bucket is None:
+            bucket = _Bucket(bucket_start)
+            buckets[device_id] = bucket
+        bucket.add(row)
+
+    for device_id, bucket in buckets.items():
+        yield bucket.to_dict(device_id)
+
+
+def iter_json(rows: Iterable[Dict]) -> Iterator[str]:
+    """JSON 配列として少しずつ出力"""
+    yield '['
+    first = True
+    for row in rows:
+        yield ('' if first else ',') + json.dumps(row, ensure_ascii=False)
+        first = False
+    yield ']\n'
+
+
+def iter_csv(rows: Iterable[Dict], columns: List[str], chunk_rows: int = 500) -> Iterator[str]:
+    """CSV として chunk_rows 行ずつ出力"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def _compute_rows(storage: DataStorage, params: QueryParams, start: datetime,
+                  end: Optional[datetime]) -> Iterator[Dict]:
+    """期間内の結果の行を時刻昇順で返す"""
+    if params.points is not None:
+        # 間引きは辞書を作らずタプルの行から列データを組み立てて行う
+        return downsample(storage.iter_range_rows(start, end, params.device_id),
+                          params.points, params.method)
+
+    rows = normalize_rows(storage.iter_range(start, end, params.device_id))
+    if params.resolution is not None:
+        rows = aggregate(rows, params.resolution)
+    return rows
+
+
+def _filling_cache(rows: Iterable[Dict], cache, key, entry_args: tuple, generation: int) -> Iterator[Dict]:
+    """行をそのまま返しながら溜め、最後まで返し終えたらキャッシュに登録する
+
+    溜めた行が max_rows を超えた時点で溜めるのをやめ、結果全体をメモリに載せずにストリーミングを続ける。
+    """
+    buffered: Optional[List[Dict]] = []
+    for row in rows:
+        if buffered is not None:
+            buffered.append(row)
+            if len(buffered) > cache.max_rows:
+                buffered = None
+        yield row
+    if buffered is not None:
+        cache.put(key, CacheEntry(buffered, *entry_args), generation)
+
+
+def cached_rows(storage: DataStorage, params: QueryParams) -> Iterable[Dict]:
+    """クエリ結果キャッシュを使って結果の行を返す
+
+    「直近 N 時間」のキャッシュは、前回読み込んだ時刻（集計時はその時刻を含むバケットの先頭）
+    以降だけを読み込み直し、期間外になった先頭の行を取り除く。
+    キャッシュにない場合は読み込みながら返し、返し終えた結果をキャッシュに登録する。
+    """
+    cache = storage.result_cache
+    key = params.result_key()
+    now = time.time()
+    entry = cache.get(key)
+
+    if entry is not None and not params.sliding:
+        QUERY_CACHE_REQUESTS.inc(result="hit")
+        return entry.rows
+
+    start = params.start.timestamp()
+    if entry is not None:
+        QUERY_CACHE_REQUESTS.inc(result="tail")
+        # 世代は読み込みの前に取得し、読み込み中の書き込みがあれば置き換えずに読み込み直す
+        generation = cache.generation
+        tail_from = entry.covered_until
+        if params.resolution is not None:
+            tail_from = math.floor(tail_from / params.resolution) * params.resolution
+        tail = list(_compute_rows(storage, params, datetime.fromtimestamp(tail_from), None))
+        rows = [row for row in entry.rows if start <= row_timestamp(row) < tail_from] + tail
+        if cache.replace(key, entry, CacheEntry(rows, params.device_id, start, None, now), generation):
+            return rows
+
+    QUERY_CACHE_REQUESTS.inc(result="miss")
+    generation = cache.generation
+    end = params.end.timestamp() if params.end else None
+    return _filling_cache(_compute_rows(storage, params, params.start, params.end), cache, key,
+                          (params.device_id, start, end, now), generation)
+
+
+def run_query(storage: DataStorage, params: QueryParams) -> Iterator[str]:
+    """クエリを実行し、レスポンス本文を少しずつ返すジェネレーターを返す"""
+    if storage.result_cache is not None:
+        rows = cached_rows(storage, params)
+    else:
+        rows = _compute_rows(storage, params, params.start, params.end)
+
+    if params.points is not None:
+        columns = DOWNSAMPLE_COLUMNS
+    elif params.resolution is not None:
+        columns = AGGREGATE_COLUMNS
+    else:
+        columns = RAW_COLUMNS
+
+    if params.format == 'csv':
+        return iter_csv(rows, columns)
+    return iter_json(rows)
+
+
+def content_type(params: QueryParams) -> str:
+    if params.format == 'csv':
+        return 'text/csv; charset=utf-8'
+    return 'application/json; charset=utf-8'
@@ -0,0 +1,180 @@
+"""
+クエリ結果キャッシュ
+(デバイス, 期間, 集計間隔) ごとの結果を LRU / TTL で保持し、書き込みのあった期間の結果だけを無効化する
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, Hashable, Iterable, List, Optional
+
+from .metrics import metrics
+from .sample import SampleLike, sample_field, sample_time
+
+QUERY_CACHE_REQUESTS = metrics.counter(
+    "query_cache_requests_total", "クエリ結果キャッシュへの問い合わせ数（ hit / tail / miss ）"
+)
+QUERY_CACHE_INVALIDATIONS = metrics.counter(
+    "query_cache_invalidations_total", "書き込みによって無効化したキャッシュ数"
+)
+QUERY_CACHE_ENTRIES = metrics.gauge("query_cache_entries", "クエリ結果キャッシュの件数")
+QUERY_CACHE_ROWS = metrics.gauge("query_cache_rows", "クエリ結果キャッシュが保持している行数")
+
+
+def row_timestamp(row: Dict) -> float:
+    return datetime.fromisoformat(row['timestamp']).timestamp()
+
+
+class CacheEntry:
+    """キャッシュした結果（時刻昇順の行）と、その結果が反映しているデータの範囲"""
+
+    __slots__ = ('rows', 'device_id', 'start', 'end', 'covered_until', 'loaded_at')
+
+    def __init__(self, rows: List[Dict], device_id: Optional[str], start: float,
+                 end: Optional[float], covered_until: float):
+        self.rows = rows
+        self.device_id = device_id
+        self.start = start
+        # end が None の場合は「直近 N 時間」のような終端のない範囲
+        self.end = end
+        # この時刻までのデータを読み込み済み（以降のデータは末尾に追加する）
+        self.covered_until = covered_until
+        self.loaded_at = time.monotonic()
+
+    def affected_by(self, device_id: str, timestamp: float) -> bool:
+        """このサンプルの書き込みで結果が変わるか"""
+        if self.device_id is not None and self.device_id != device_id:
+            return False
+        if timestamp < self.start:
+            return False
+        if self.end is not None:
+            return timestamp < self.end
+        # 終端のない範囲は、読み込み済みの範囲内への書き込み（遅れて届いたサンプル）だけが影響する
+        return timestamp < self.covered_until
+
+
+class QueryResultCache:
+    """件数と行数で上限を設けた LRU キャッシュ"""
+
+    # 読み込み中の書き込みを判定するために保持する直近の書き込み数
+    RECENT_WRITES = 1024
+
+    def __init__(self, max_entries: int = 64, ttl: float = 300.0, max_rows: int = 200000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._rows = 0
+        # 書き込みのたびに進める世代と、直近の書き込み（読み込み中に範囲内へ書き込まれた結果はキャッシュしない）
+        self._generation = 0
+        self._recent_writes: deque = deque()
+        self._evicted_generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        """有効なエントリを返す（見つからない・期限切れの場合は None ）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.loaded_at > self.ttl:
+                self._remove_locked(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, entry: CacheEntry, generation: Optional[int] = None):
+        with self._lock:
+            if generation is not None and self._written_since_locked(entry, generation):
+                return
+            if key in self._entries:
+                self._remove_locked(key)
+            if len(entry.rows) > self.max_rows:
+                return
+            self._entries[key] = entry
+            self._rows += len(entry.rows)
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._remove_locked(next(iter(self._entries)))
+            self._update_gauges_locked()
+
+    def _written_since_locked(self, entry: CacheEntry, generation: int) -> bool:
+        if generation == self._generation:
+            return False
+        if self._evicted_generation > generation:
+            # 記録が残っていないため、影響があったものとして扱う
+            return True
+        return any(
+            entry.affected_by(device_id, timestamp)
+            for write_generation, device_id, timestamp in self._recent_writes
+            if write_generation > generation
+        )
+
+    def replace(self, key: Hashable, current: CacheEntry, entry: CacheEntry, generation: int) -> bool:
+        """末尾を読み込み直したエントリで current を置き換える（ TTL は current の読み込み時刻から数える）
+
+        読み込み中に新しい範囲へ書き込まれていた場合や、 current がすでに置き換え・削除されていた場合は
+        置き換えずに False を返す（書き込まれていた場合は current も削除する）。
+        """
+        with self._lock:
+            if self._entries.get(key) is not current:
+                return False
+            self._remove_locked(key)
+            if self._written_since_locked(entry, generation) or len(entry.rows) > self.max_rows:
+                self._update_gauges_locked()
+                return False
+            entry.loaded_at = current.loaded_at
+            self._entries[key] = entry
+            self._rows += len(entry.rows)
+            while self._rows > self.max_rows and self._entries:
+                self._remove_locked(next(iter(self._entries)))
+            self._update_gauges_locked()
+            return True
+
+    def invalidate_writes(self, records: Iterable[SampleLike]):
+        """書き込まれたサンプルが範囲に含まれるエントリを削除"""
+        samples = []
+        for data in records:
+            timestamp = sample_time(data)
+            if timestamp is not None:
+                samples.append((sample_field(data, 'device_id'), timestamp))
+        if not samples:
+            return
+
+        with self._lock:
+            self._generation += 1
+            for device_id, timestamp in samples:
+                self._recent_writes.append((self._generation, device_id, timestamp))
+            while len(self._recent_writes) > self.RECENT_WRITES:
+                self._evicted_generation = self._recent_writes.popleft()[0]
+            stale = [
+                key for key, entry in self._entries.items()
+                if any(entry.affected_by(device_id, timestamp) for device_id, timestamp in samples)
+            ]
+            for key in stale:
+                self._remove_locked(key)
+            if stale:
+                QUERY_CACHE_INVALIDATIONS.inc(len(stale))
+                self._update_gauges_locked()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+            self._update_gauges_locked()
+
+    def _remove_locked(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self._rows -= len(entry.rows)
+
+    def _update_gauges_locked(self):
+        QUERY_CACHE_ENTRIES.set(len(self._entries))
+        QUERY_CACHE_ROWS.set(self._rows)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'rows': self._rows}
@@ -0,0 +1,237 @@
+"""
+温度サンプルの軽量な表現
+1 件ごとの Sample（ NamedTuple ）と、列ごとの配列で保持する SampleBatch を提供する
+"""
+
+import math
+import time
+from array import array
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+
+@lru_cache(maxsize=4096)
+def iso_timestamp(ts: int) -> str:
+    """エポックミリ秒を保存形式（ローカル時刻の ISO 形式、マイクロ秒まで）に変換（同時刻の複数デバイスで結果を共有する）"""
+    seconds, millis = divmod(ts, 1000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=millis * 1000).isoformat()
+
+
+def epoch_millis(value) -> int:
+    """ISO 形式の文字列・ datetime ・数値（エポック秒）をエポックミリ秒（整数）に変換"""
+    if isinstance(value, (int, float)):
+        return round(value * 1000)
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value))
+    # 浮動小数点の誤差を避けるため、秒とマイクロ秒を分けて変換する
+    return int(value.replace(microsecond=0).timestamp()) * 1000 + value.microsecond // 1000
+
+
+def now_millis() -> int:
+    """現在時刻のエポックミリ秒"""
+    return time.time_ns() // 1_000_000
+
+
+def _number(value, as_int: bool = False):
+    """数値に変換（欠損値は None ）"""
+    if value is None or value == '':
+        return None
+    return int(float(value)) if as_int else float(value)
+
+
+class Sample(NamedTuple):
+    """1 件の温度サンプル（時刻はエポックミリ秒）
+
+    同じデバイスを 1 秒以内に続けて取得しても (device_id, timestamp) が重ならないよう、
+    時刻はミリ秒まで保持する。
+    """
+
+    ts: int
+    device_id: str
+    temperature: Optional[float] = None
+    humidity: Optional[float] = None
+    light_level: Optional[int] = None
+    device_type: Optional[str] = None
+    version: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Sample':
+        return cls(
+            epoch_millis(data['timestamp']),
+            data['device_id'],
+            _number(data.get('temperature')),
+            _number(data.get('humidity')),
+            _number(data.get('light_level'), as_int=True),
+            data.get('device_type'),
+            data.get('version'),
+        )
+
+    @property
+    def timestamp(self) -> str:
+        return iso_timestamp(self.ts)
+
+    def to_dict(self) -> Dict:
+        return {
+            'timestamp': self.timestamp,
+            'device_id': self.device_id,
+            'temperature': self.temperature,
+            'humidity': self.humidity,
+            'light_level': self.light_level,
+            'device_type': self.device_type,
+            'version': self.version,
+        }
+
+    def row(self) -> Tuple:
+        """ストレージの列順（ timestamp, device_id, temperature, humidity, light_level, device_type, version ）の値"""
+        return (iso_timestamp(self[0]),) + self[1:]
+
+
+SampleLike = Union[Sample, Dict]
+
+
+def sample_time(data: SampleLike) -> Optional[float]:
+    """サンプルの時刻をエポック秒で返す（辞書の時刻は精度を保ったまま変換し、解析できない場合は None ）"""
+    if isinstance(data, Sample):
+        return data.ts / 1000
+    value = data.get('timestamp')
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def sample_field(data: SampleLike, name: str):
+    """Sample ・辞書のどちらからも項目の値を取り出す"""
+    if isinstance(data, Sample):
+        return getattr(data, name, None)
+    return data.get(name)
+
+
+def as_sample(data: SampleLike) -> Sample:
+    """Sample または従来のサンプル辞書を Sample に変換"""
+    if isinstance(data, Sample):
+        return data
+    return Sample.from_dict(data)
+
+
+def as_samples(records: Iterable[SampleLike]) -> List[Sample]:
+    """サンプルの並びを Sample のリストに変換（変換できないものは除く）"""
+    samples = []
+    for data in records:
+        try:
+            samples.append(as_sample(data))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return samples
+
+
+class SampleBatch:
+    """複数のサンプルを列ごとの配列で保持するコンテナ
+
+    時刻はエポックミリ秒の array('q') 、数値は欠損を NaN とした array('d') 、デバイス ID と
+    (device_type, version) は重複を除いた一覧への添字で保持する。
+    """
+
+    __slots__ = ('ts', 'temperature', 'humidity', 'light_level', 'device_index', 'meta_index',
+                 'devices', 'metas', '_device_lookup', '_meta_lookup')
+
+    def __init__(self, samples: Iterable[SampleLike] = ()):
+        self.ts = array('q')
+        self.temperature = array('d')
+        self.humidity = array('d')
+        self.light_level = array('d')
+        self.device_index = array('I')
+        self.meta_index = array('I')
+        self.devices: List[str] = []
+        self.metas: List[Tuple[Optional[str], Optional[str]]] = []
+        self._device_lookup: Dict[str, int] = {}
+        self._meta_lookup: Dict[Tuple, int] = {}
+        self.extend(samples)
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def _device(self, device_id: str) -> int:
+        index = self._device_lookup.get(device_id)
+        if index is None:
+            index = self._device_lookup[device_id] = len(self.devices)
+            self.devices.append(device_id)
+        return index
+
+    def _meta(self, meta: Tuple) -> int:
+        index = self._meta_lookup.get(meta)
+        if index is None:
+            index = self._meta_lookup[meta] = len(self.metas)
+            self.metas.append(meta)
+        return index
+
+    def add(self, ts: int, device_id: str, temperature: Optional[float], humidity: Optional[float],
+            light_level: Optional[float], device_type: Optional[str] = None, version: Optional[str] = None):
+        """列の値を直接追加（ Sample を作らずに済む）"""
+        self.ts.append(int(ts))
+        self.temperature.append(math.nan if temperature is None else temperature)
+        self.humidity.append(math.nan if humidity is None else humidity)
+        self.light_level.append(math.nan if light_level is None else light_level)
+        self.device_index.append(self._device(device_id))
+        self.meta_index.append(self._meta((device_type, version)))
+
+    def append(self, data: SampleLike):
+        self.add(*as_sample(data))
+
+    def extend(self, samples: Iterable[SampleLike]):
+        for data in samples:
+            self.append(data)
+
+    def __getitem__(self, index: int) -> Sample:
+        temperature = self.temperature[index]
+        humidity = self.humidity[index]
+        light_level = self.light_level[index]
+        device_type, version = self.metas[self.meta_index[index]]
+        return Sample(
+            self.ts[index],
+            self.devices[self.device_index[index]],
+            None if math.isnan(temperature) else temperature,
+            None if math.isnan(humidity) else humidity,
+            None if math.isnan(light_level) else int(light_level),
+            device_type,
+            version,
+        )
+
+    def __iter__(self) -> Iterator[Sample]:
+        for index in range(len(self.ts)):
+            yield self[index]
+
+    def rows(self) -> Iterator[Tuple]:
+        """ストレージの列順の値を Sample を作らずに返す"""
+        devices, metas = self.devices, self.metas
+        for ts, temperature, humidity, light_level, device, meta in zip(
+                self.ts, self.temperature, self.humidity, self.light_level, self.device_index, self.meta_index):
+            yield (iso_timestamp(ts), devices[device],
+                   None if temperature != temperature else temperature,
+                   None if humidity != humidity else humidity,
+                   None if light_level != light_level else int(light_level)) + metas[meta]
+
+    def to_dicts(self) -> List[Dict]:
+        return [sample.to_dict() for sample in self]
+
+    def order(self, reverse: bool = False) -> List[int]:
+        """時刻順の添字の並び"""
+        return sorted(range(len(self.ts)), key=self.ts.__getitem__, reverse=reverse)
+
+    def take(self, indices: Iterable[int]) -> 'SampleBatch':
+        """指定した添字の行だけを持つバッチを返す"""
+        batch = SampleBatch()
+        for index in indices:
+            device_type, version = self.metas[self.meta_index[index]]
+            batch.add(self.ts[index], self.devices[self.device_index[index]], self.temperature[index],
+                      self.humidity[index], self.light_level[index], device_type, version)
+        return batch
+
+    def nbytes(self) -> int:
+        """列の配列が使っているバイト数（デバイス ID などの一覧は除く）"""
+        return sum(column.buffer_info()[1] * column.itemsize for column in (
+            self.ts, self.temperature, self.humidity, self.light_level, self.device_index, self.meta_index
+        ))
@@ -0,0 +1,285 @@
+"""
+直近サンプルのインメモリキャッシュ
+デバイスごとの固定長リングバッファで最近のデータを I/O なしに返す
+"""
+
+import math
+import threading
+from array import array
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .sample import Sample, SampleBatch, SampleLike, sample_field, sample_time
+
+# 保存されている形の行を組み立てる関数
+# (timestamp, device_id, temperature, humidity, light_level, device_type, version) -> 行
+RowFactory = Callable[[str, str, Optional[float], Optional[float], Optional[int], Optional[str], Optional[str]], Dict]
+
+
+def _to_float(value) -> float:
+    """数値を float に変換（欠損値は NaN）"""
+    if value is None or value == '':
+        return math.nan
+    return float(value)
+
+
+def _from_float(value: float, as_int: bool = False):
+    """NaN を None に戻して数値を返す"""
+    if math.isnan(value):
+        return None
+    return int(value) if as_int else value
+
+
+def _timestamp_of(data: SampleLike) -> float:
+    ts = sample_time(data)
+    if ts is None:
+        raise ValueError(f"タイムスタンプを解析できません: {sample_field(data, 'timestamp')}")
+    return ts
+
+
+class RingBuffer:
+    """array ベースの固定長リングバッファ（時刻昇順で追記される前提）"""
+
+    __slots__ = ('capacity', '_ts', '_stamps', '_temperature', '_humidity', '_light',
+                 '_meta', '_start', '_size')
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f"capacity は 1 以上を指定してください: {capacity}")
+        self.capacity = capacity
+        self._ts = array('d', [0.0]) * capacity
+        # 保存されている時刻の文字列（行を組み立てるときにそのまま返す）
+        self._stamps: List[Optional[str]] = [None] * capacity
+        self._temperature = array('d', [0.0]) * capacity
+        self._humidity = array('d', [0.0]) * capacity
+        self._light = array('d', [0.0]) * capacity
+        # device_type / version のタプル（同一オブジェクトを共有するため実質ポインタのみ）
+        self._meta: List[Optional[Tuple]] = [None] * capacity
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _index(self, offset: int) -> int:
+        return (self._start + offset) % self.capacity
+
+    @property
+    def oldest_ts(self) -> Optional[float]:
+        return self._ts[self._start] if self._size else None
+
+    @property
+    def newest_ts(self) -> Optional[float]:
+        return self._ts[self._index(self._size - 1)] if self._size else None
+
+    def append(self, ts: float, stamp: str, temperature: float, humidity: float,
+               light: float, meta: Optional[Tuple]) -> Optional[float]:
+        """サンプルを追加し、押し出されたサンプルの時刻を返す"""
+        evicted = None
+        if self._size == self.capacity:
+            evicted = self._ts[self._start]
+            pos = self._start
+            self._start = (self._start + 1) % self.capacity
+        else:
+            pos = self._index(self._size)
+            self._size += 1
+
+        self._ts[pos] = ts
+        self._stamps[pos] = stamp
+        self._temperature[pos] = temperature
+        self._humidity[pos] = humidity
+        self._light[pos] = light
+        self._meta[pos] = meta
+        return evicted
+
+    def prune_before(self, cutoff: float) -> int:
+        """cutoff より古いサンプルを破棄"""
+        removed = 0
+        while self._size and self._ts[self._start] < cutoff:
+            self._stamps[self._start] = None
+            self._meta[self._start] = None
+            self._start = (self._start + 1) % self.capacity
+            self._size -= 1
+            removed += 1
+        return removed
+
+    def iter_since(self, cutoff: float) -> Iterator[Tuple[float, str, float, float, float, Optional[Tuple]]]:
+        """cutoff 以降のサンプルを新しい順に返す"""
+        for offset in range(self._size - 1, -1, -1):
+            pos = self._index(offset)
+            ts = self._ts[pos]
+            if ts < cutoff:
+                break
+            yield (ts, self._stamps[pos], self._temperature[pos], self._humidity[pos],
+                   self._light[pos], self._meta[pos])
+
+
+class RecentSampleCache:
+    """デバイスごとのリングバッファで構成される直近データキャッシュ"""
+
+    def __init__(self, capacity_per_device: int, max_devices: int = 1000):
+        self.capacity_per_device = capacity_per_device
+        self.max_devices = max_devices
+        self._buffers: Dict[str, RingBuffer] = {}
+        self._meta_cache: Dict[Tuple, Tuple] = {}
+        self._lock = threading.Lock()
+        # この時刻以降のデータはキャッシュが完全に保持している
+        self._covered_since: Optional[float] = None
+        # リングから押し出された最新の時刻（これ以前の範囲はバックエンドが必要）
+        self._evicted_upto = -math.inf
+        # 書き込みの通し番号（初期化中に書き込まれたサンプルの取りこぼしを検出する）
+        self._writes = 0
+
+    @property
+    def is_warm(self) -> bool:
+        return self._covered_since is not None
+
+    def begin_warm(self) -> int:
+        """初期化の読み込みを始める前に呼び出し、 warm() に渡す番号を返す"""
+        with self._lock:
+            return self._writes
+
+    def warm(self, rows: Iterable[SampleLike], covered_since: float, token: Optional[int] = None) -> bool:
+        """バックエンドから読み込んだデータでキャッシュを初期化
+
+        token（ begin_warm() の戻り値）を渡した場合、読み込みの間に書き込まれたサンプルは
+        rows に含まれていない可能性があるため、キャッシュを使わない状態のままにする。
+        """
+        with self._lock:
+            if token is not None and token != self._writes:
+                return False
+            self._buffers.clear()
+            self._meta_cache.clear()
+            self._evicted_upto = -math.inf
+            self._covered_since = covered_since
+
+            parsed = []
+            for row in rows:
+                try:
+                    parsed.append((_timestamp_of(row), row))
+                except (AttributeError, TypeError, ValueError):
+                    continue
+            parsed.sort(key=lambda item: item[0])
+
+            for ts, row in parsed:
+                if not self._append_locked(ts, row):
+                    # デバイス数の上限を超えた場合は部分的なキャッシュを使わない
+                    self._covered_since = None
+                    return False
+            return True
+
+    def invalidate(self):
+        """キャッシュを破棄し、次回参照時にバックエンドから再読み込みさせる"""
+        with self._lock:
+            self._buffers.clear()
+            self._meta_cache.clear()
+            self._covered_since = None
+            self._evicted_upto = -math.inf
+
+    def add(self, data: SampleLike) -> bool:
+        """書き込まれたサンプルをキャッシュに反映"""
+        with self._lock:
+            self._writes += 1
+            if self._covered_since is None:
+                return False
+            try:
+                ts = _timestamp_of(data)
+            except (TypeError, ValueError):
+                return False
+
+            buffer = self._buffers.get(sample_field(data, 'device_id'))
+            newest_ts = buffer.newest_ts if buffer is not None else None
+            if newest_ts is not None and ts == newest_ts:
+                # 同じサンプルの再書き込み（リトライや再送）は保存済みとして扱う
+                return True
+            if newest_ts is not None and ts < newest_ts:
+                # 過去時刻の書き込み（バックフィル等）は順序が崩れるため再読み込みさせる
+                self._covered_since = None
+                return False
+
+            if not self._append_locked(ts, data):
+                self._covered_since = None
+                return False
+            return True
+
+    def _append_locked(self, ts: float, data: SampleLike) -> bool:
+        if isinstance(data, Sample):
+            stamp = data.timestamp
+            device_id, temperature, humidity, light, device_type, version = data[1:]
+        else:
+            stamp = str(data.get('timestamp'))
+            device_id = data.get('device_id')
+            temperature, humidity, light = data.get('temperature'), data.get('humidity'), data.get('light_level')
+            device_type, version = data.get('device_type'), data.get('version')
+        buffer = self._buffers.get(device_id)
+        if buffer is None:
+            if len(self._buffers) >= self.max_devices:
+                return False
+            buffer = RingBuffer(self.capacity_per_device)
+            self._buffers[device_id] = buffer
+
+        meta_key = (device_type, version)
+        meta = self._meta_cache.setdefault(meta_key, meta_key)
+
+        evicted = buffer.append(ts, stamp, _to_float(temperature), _to_float(humidity), _to_float(light), meta)
+        if evicted is not None and evicted > self._evicted_upto:
+            self._evicted_upto = evicted
+        return True
+
+    def covers(self, cutoff: float) -> bool:
+        """cutoff 以降の範囲をキャッシュだけで返せるか"""
+        return (self._covered_since is not None
+                and cutoff >= self._covered_since
+                and cutoff > self._evicted_upto)
+
+    def _collect_since(self, cutoff: float, newest_first: bool = True) -> Optional[List[Tuple]]:
+        with self._lock:
+            if not self.covers(cutoff):
+                return None
+
+            samples = []
+            for device_id, buffer in self._buffers.items():
+                for ts, stamp, temperature, humidity, light, meta in buffer.iter_since(cutoff):
+                    samples.append((ts, stamp, device_id, temperature, humidity, light, meta))
+
+        samples.sort(key=lambda item: item[0], reverse=newest_first)
+        return samples
+
+    def get_batch_since(self, cutoff: float) -> Optional[SampleBatch]:
+        """cutoff 以降のデータを新しい順の SampleBatch で返す（範囲外なら None ）"""
+        samples = self._collect_since(cutoff)
+        if samples is None:
+            return None
+        batch = SampleBatch()
+        for ts, _, device_id, temperature, humidity, light, meta in samples:
+            batch.add(round(ts * 1000), device_id, temperature, humidity, light, *(meta or (None, None)))
+        return batch
+
+    def get_since(self, cutoff: float, make_row: RowFactory, newest_first: bool = False) -> Optional[List[Dict]]:
+        """cutoff 以降のデータを make_row で組み立てた行で返す（範囲外なら None ）
+
+        時刻は保存されている文字列のまま、数値は欠損値を None にして make_row に渡す。
+        """
+        samples = self._collect_since(cutoff, newest_first)
+        if samples is None:
+            return None
+        return [
+            make_row(stamp, device_id, _from_float(temperature), _from_float(humidity),
+                     _from_float(light, as_int=True), *(meta or (None, None)))
+            for ts, stamp, device_id, temperature, humidity, light, meta in samples
+        ]
+
+    def prune_before(self, cutoff: float):
+        """cutoff より古いサンプルを破棄"""
+        with self._lock:
+            for buffer in self._buffers.values():
+                buffer.prune_before(cutoff)
+
+    def stats(self) -> Dict:
+        """キャッシュの使用状況を返す"""
+        with self._lock:
+            return {
+                'devices': len(self._buffers),
+                'samples': sum(len(buffer) for buffer in self._buffers.values()),
+                'capacity_per_device': self.capacity_per_device,
+                'warm': self._covered_since is not None,
+            }
@@ -0,0 +1,302 @@
+"""
+複数ワーカーでの分担収集
+SQLite に保存したリースでワーカーの生存を管理し、コンシステントハッシュでデバイスを割り当てる
+
+リースの SQLite は WAL モードで開くため（共有メモリのインデックスを使う）、
+ワーカーは同じホストのローカルファイルシステム上の DB を共有する必要がある。
+NFS などのネットワークファイルシステム越しに複数ホストで共有することはできない。
+"""
+
+import bisect
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .metrics import metrics
+
+WORKER_CLAIMS = metrics.counter("worker_claims_total", "ワーカーが取得を担当したデバイス数（取得方法別）")
+WORKER_OWNED_DEVICES = metrics.gauge("worker_owned_devices", "このワーカーに割り当てられたデバイス数")
+WORKER_LIVE = metrics.gauge("worker_live_workers", "生存しているワーカー数")
+WORKER_LEASE_LOST = metrics.counter("worker_lease_lost_total", "取得中にリースが切れて取得権を失った回数")
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """仮想ノード付きのコンシステントハッシュ（ワーカーの増減で移動するデバイスを最小にする）"""
+
+    def __init__(self, nodes: List[str], replicas: int = 64):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        ring = sorted((_hash(f"{node}#{index}"), node) for node in nodes for index in range(replicas))
+        for point, node in ring:
+            self._points.append(point)
+            self._owners.append(node)
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class LeaseStore:
+    """ワーカーのリースとデバイスの取得権（取得周期ごと）を管理する SQLite ストア
+
+    取得権は (device_id, slot) の一意キーへの INSERT OR IGNORE で確保するため、
+    割り当てが一時的に重なっても同じ周期に同じデバイスを取得するのは 1 ワーカーだけになる。
+    """
+
+    def __init__(self, db_path: Path, lease_ttl: float = 60.0):
+        self.db_path = Path(db_path)
+        self.lease_ttl = lease_ttl
+        self.logger = logging.getLogger(__name__)
+        self._init_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 複数プロセスからの同時書き込みはロック待ちで直列化する
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_database(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            # WAL は同一ホストのプロセス間でのみ整合する（ネットワークファイルシステムでは使えない）
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS worker_leases (
+                    worker_id TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS device_claims (
+                    device_id TEXT NOT NULL,
+                    slot INTEGER NOT NULL,
+                    worker_id TEXT NOT NULL,
+                    claimed_at REAL NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (device_id, slot)
+                )
+            """)
+
+    def heartbeat(self, worker_id: str, now: Optional[float] = None) -> List[str]:
+        """自分のリースを延長し、生存しているワーカーの一覧を返す"""
+        now = time.time() if now is None else now
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                INSERT INTO worker_leases (worker_id, expires_at) VALUES (?, ?)
+                ON CONFLICT(worker_id) DO UPDATE SET expires_at = excluded.expires_at
+            """, (worker_id, now + self.lease_ttl))
+            conn.execute("DELETE FROM worker_leases WHERE expires_at < ?", (now - self.lease_ttl,))
+            rows = conn.execute(
+                "SELECT worker_id FROM worker_leases WHERE expires_at > ? ORDER BY worker_id", (now,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def renew(self, worker_id: str, now: Optional[float] = None) -> bool:
+        """有効なリースだけを延長する（すでに切れていた場合は False ）"""
+        now = time.time() if now is None else now
+        with closing(self._connect()) as conn:
+            cursor = conn.execute("""
+                UPDATE worker_leases SET expires_at = ? WHERE worker_id = ? AND expires_at > ?
+            """, (now + self.lease_ttl, worker_id, now))
+            return cursor.rowcount == 1
+
+    def release(self, worker_id: str):
+        """リースを返却（他のワーカーがすぐに引き継げるようにする）"""
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM worker_leases WHERE worker_id = ?", (worker_id,))
+
+    def claim(self, device_ids: List[str], slot: int, worker_id: str,
+              now: Optional[float] = None) -> Dict[str, str]:
+        """この周期の取得権を 1 トランザクションで確保し、確保できたデバイスと方法（ claimed / taken_over ）を返す"""
+        now = time.time() if now is None else now
+        claimed = {}
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for device_id in device_ids:
+                    cursor = conn.execute("""
+                        INSERT OR IGNORE INTO device_claims (device_id, slot, worker_id, claimed_at)
+                        VALUES (?, ?, ?, ?)
+                    """, (device_id, slot, worker_id, now))
+                    if cursor.rowcount == 1:
+                        claimed[device_id] = 'claimed'
+                        continue
+
+                    # 取得を終えずに停止したワーカーの取得権は引き継ぐ
+                    cursor = conn.execute("""
+                        UPDATE device_claims SET worker_id = ?, claimed_at = ?
+                        WHERE device_id = ? AND slot = ? AND done = 0 AND worker_id != ?
+                          AND worker_id NOT IN (SELECT worker_id FROM worker_leases WHERE expires_at > ?)
+                    """, (worker_id, now, device_id, slot, worker_id, now))
+                    if cursor.rowcount == 1:
+                        claimed[device_id] = 'taken_over'
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def complete(self, device_ids: List[str], slot: int, worker_id: str,
+                 now: Optional[float] = None) -> List[str]:
+        """取得を終えたデバイスを記録し（停止したワーカーの取得権の引き継ぎ対象から外す）、記録できたデバイスを返す
+
+        リースが切れていた場合や、取得権がすでに他のワーカーに引き継がれていた場合は記録しない。
+        """
+        now = time.time() if now is None else now
+        completed = []
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                alive = conn.execute(
+                    "SELECT 1 FROM worker_leases WHERE worker_id = ? AND expires_at > ?", (worker_id, now)
+                ).fetchone()
+                if alive:
+                    for device_id in device_ids:
+                        cursor = conn.execute("""
+                            UPDATE device_claims SET done = 1
+                            WHERE device_id = ? AND slot = ? AND worker_id = ?
+                        """, (device_id, slot, worker_id))
+                        if cursor.rowcount == 1:
+                            completed.append(device_id)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        return completed
+
+    def prune(self, before_slot: int) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("DELETE FROM device_claims WHERE slot < ?", (before_slot,)).rowcount
+
+
+class ShardedWorker:
+    """リースを更新しながら、自分に割り当てられたデバイスを周期ごとに 1 回ずつ取得するワーカー
+
+    リースが切れたワーカーはハッシュリングから外れ、そのデバイスは残りのワーカーに
+    割り当て直される。割り当ての確認はリースの有効期間の 1/3 ごとに行い、取得中は別スレッドで
+    同じ間隔でリースを延長する（取得がリースの有効期間より長くかかっても引き継がれない）。
+    """
+
+    def __init__(
+        self,
+        store: LeaseStore,
+        device_ids: List[str],
+        collect: Callable[[List[str]], Dict[str, bool]],
+        worker_id: Optional[str] = None,
+        poll_interval: float = 1800.0,
+        keep_slots: int = 48
+    ):
+        self.store = store
+        self.device_ids = list(device_ids)
+        self.collect = collect
+        self.worker_id = worker_id or default_worker_id()
+        self.poll_interval = poll_interval
+        self.keep_slots = keep_slots
+        self.logger = logging.getLogger(__name__)
+        self._stop = threading.Event()
+        self._owned: List[str] = []
+        self._joined = False
+
+    def current_slot(self, now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // self.poll_interval)
+
+    def owned_devices(self, live_workers: List[str]) -> List[str]:
+        ring = HashRing(live_workers)
+        return [device_id for device_id in self.device_ids if ring.owner(device_id) == self.worker_id]
+
+    def run_once(self, now: Optional[float] = None) -> Dict[str, bool]:
+        """リースを更新し、この周期でまだ取得されていない担当デバイスを取得"""
+        now = time.time() if now is None else now
+        live_workers = self.store.heartbeat(self.worker_id, now)
+        if self.worker_id not in live_workers:
+            live_workers.append(self.worker_id)
+        WORKER_LIVE.set(len(live_workers))
+        if not self._joined:
+            # 起動直後は他のワーカーにも見えるようにリースだけを登録し、次の確認から取得を始める
+            self._joined = True
+            return {}
+
+        owned = self.owned_devices(live_workers)
+        if owned != self._owned:
+            self.logger.info(f"担当デバイスが変わりました: {len(self._owned)} → {len(owned)} 台"
+                             f"（ワーカー {len(live_workers)} 台）")
+            self._owned = owned
+        WORKER_OWNED_DEVICES.set(len(owned))
+
+        slot = self.current_slot(now)
+        claimed = self.store.claim(owned, slot, self.worker_id, now)
+        if not claimed:
+            return {}
+        for result in claimed.values():
+            WORKER_CLAIMS.inc(result=result)
+
+        with self._keep_lease() as lease_lost:
+            results = self.collect(list(claimed))
+
+        succeeded = [device_id for device_id, success in results.items() if success]
+        completed = [] if lease_lost.is_set() else self.store.complete(succeeded, slot, self.worker_id)
+        if len(completed) < len(succeeded):
+            # 取得権を失ったため、この周期の取得は他のワーカーがやり直す可能性がある
+            WORKER_LEASE_LOST.inc()
+            self.logger.warning(f"取得中にリースが切れたため、 {len(succeeded) - len(completed)} 台の取得を"
+                                "完了として記録できませんでした")
+        self.store.prune(slot - self.keep_slots)
+        return results
+
+    @contextmanager
+    def _keep_lease(self):
+        """ブロック内の処理中、別スレッドでリースを延長する（切れていた場合は返す Event をセットする）"""
+        lease_lost = threading.Event()
+        done = threading.Event()
+        interval = max(0.1, self.store.lease_ttl / 3)
+
+        def renew():
+            while not done.wait(interval):
+                try:
+                    if not self.store.renew(self.worker_id):
+                        lease_lost.set()
+                        return
+                except sqlite3.Error as e:
+                    self.logger.error(f"リースの更新に失敗しました: {e}")
+
+        thread = threading.Thread(target=renew, name=f"lease-{self.worker_id}", daemon=True)
+        thread.start()
+        try:
+            yield lease_lost
+        finally:
+            done.set()
+            thread.join()
+
+    def run(self):
+        """stop() が呼ばれるまで実行"""
+        tick = max(1.0, self.store.lease_ttl / 3)
+        self.logger.info(f"ワーカー {self.worker_id} を開始します（デバイス {len(self.device_ids)} 台）")
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                except sqlite3.Error as e:
+                    self.logger.error(f"リースの更新に失敗しました: {e}")
+                self._stop.wait(tick)
+        finally:
+            self.store.release(self.worker_id)
+            self.logger.info(f"ワーカー {self.worker_id} を停止しました")
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,305 @@
+"""
+SQLite データベースのスナップショット
+オンラインバックアップ API で取得した複製をブロック単位で比較し、変更されたブロックだけを
+オブジェクトストアに保存する。起動時にデータベースがなければ最新のスナップショットから復元する。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .metrics import metrics
+from .object_store import ObjectStore
+
+MANIFEST_PREFIX = "manifests/"
+BLOCK_PREFIX = "blocks/"
+# 保存中のスナップショットが参照するブロックの一覧（保存を終えたら削除する）
+INFLIGHT_PREFIX = "inflight/"
+# これより古い保存中の記録は、保存の途中で停止したインスタンスのものとみなす
+INFLIGHT_TTL = 3600.0
+MANIFEST_ATTEMPTS = 5
+# 他のインスタンスのスナップショットから取り込む列（ id はデータベースごとに振り直す）
+MERGE_COLUMNS = "timestamp, device_id, temperature, humidity, light_level, device_type, version, created_at"
+
+SNAPSHOT_SECONDS = metrics.histogram("snapshot_operation_seconds", "スナップショットの保存/復元の所要時間")
+SNAPSHOT_BYTES = metrics.counter("snapshot_bytes_total", "スナップショットのブロックのバイト数（ uploaded / skipped / downloaded ）")
+
+
+class SnapshotManager:
+    """SQLite データベースのブロック単位の増分スナップショット
+
+    ブロックは内容のハッシュをキーに保存するため、最新のスナップショットと同じブロックは
+    アップロードしない。マニフェストにはブロックのハッシュの並びを記録する。
+
+    複数のインスタンスが同じ保存先を使う場合に備え、マニフェストは最新のスナップショットを
+    取り込んだうえで次の番号が空いているときだけ書き込み（先を越されたら取り込みからやり直す）、
+    保存中のスナップショットが参照するブロックは inflight/ に記録して古いスナップショットの削除から守る。
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        store: ObjectStore,
+        block_size: int = 256 * 1024,
+        keep: int = 5,
+        min_interval: float = 300.0,
+        upload_workers: int = 8,
+        on_merge: Optional[Callable[[], None]] = None
+    ):
+        self.db_path = Path(db_path)
+        self.store = store
+        self.block_size = block_size
+        self.keep = keep
+        self.min_interval = min_interval
+        self.upload_workers = upload_workers
+        # 他のインスタンスの行を取り込んだときに呼ぶ（ストレージのキャッシュの破棄など）
+        self.on_merge = on_merge
+        self.logger = logging.getLogger(__name__)
+        self.instance_id = uuid.uuid4().hex
+        self._last_manifest: Optional[Dict] = None
+        self._last_snapshot_at = 0.0
+        self._last_snapshot_mtime: Optional[int] = None
+
+    def _manifest_keys(self) -> List[str]:
+        return [key for key in self.store.list(MANIFEST_PREFIX) if key.endswith('.json')]
+
+    def latest_manifest(self) -> Optional[Dict]:
+        keys = self._manifest_keys()
+        if not keys:
+            return None
+        data = self.store.get(keys[-1])
+        return json.loads(data) if data else None
+
+    def _db_mtime(self) -> Optional[int]:
+        mtimes = []
+        for path in (self.db_path, self.db_path.with_name(self.db_path.name + '-wal')):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                continue
+        return max(mtimes) if mtimes else None
+
+    def snapshot_if_due(self) -> bool:
+        """前回から min_interval 秒以上経過し、データベースが更新されていればスナップショットを保存"""
+        mtime = self._db_mtime()
+        if mtime is None or mtime == self._last_snapshot_mtime:
+            return False
+        if self._last_snapshot_at and time.monotonic() - self._last_snapshot_at < self.min_interval:
+            return False
+        return self.snapshot() is not None
+
+    @SNAPSHOT_SECONDS.timed(operation="snapshot")
+    def snapshot(self) -> Optional[Dict]:
+        """最新のスナップショットを取り込んでから、変更されたブロックだけを保存する
+
+        復元（または前回の保存）以降に他のインスタンスがスナップショットを保存していれば、
+        その行をデータベースに取り込んでから保存する。マニフェストは取り込んだスナップショットの
+        次の番号に条件付きで書き込み、その間に他のインスタンスが保存していれば取り込みからやり直す。
+        """
+        mtime = self._db_mtime()
+        try:
+            for _ in range(MANIFEST_ATTEMPTS):
+                latest = self.latest_manifest()
+                if latest is not None and (self._last_manifest is None
+                                           or latest['sequence'] != self._last_manifest['sequence']):
+                    merged = self._merge(latest)
+                    self.logger.info(f"スナップショット #{latest['sequence']} から {merged} 件を取り込みました")
+                    if merged and self.on_merge is not None:
+                        self.on_merge()
+                manifest, uploaded = self._publish(latest)
+                if manifest is not None:
+                    break
+                self._last_manifest = latest
+            else:
+                raise RuntimeError("他のインスタンスとマニフェストの保存が競合し続けたため保存できませんでした")
+        except Exception as e:
+            self.logger.error(f"スナップショットの保存に失敗しました: {e}")
+            return None
+
+        self._last_manifest = manifest
+        self._last_snapshot_at = time.monotonic()
+        self._last_snapshot_mtime = mtime
+        self.logger.info(f"スナップショット #{manifest['sequence']} を保存しました"
+                         f"（ {uploaded}/{len(manifest['blocks'])} ブロックをアップロード）")
+        self._prune()
+        return manifest
+
+    def _publish(self, latest: Optional[Dict]) -> Tuple[Optional[Dict], int]:
+        """オンラインバックアップで一貫した複製を作り、 latest の次の番号で保存する
+
+        他のインスタンスが先にその番号で保存していた場合は (None, 0) を返す。
+        """
+        inflight_key = f"{INFLIGHT_PREFIX}{self.instance_id}.json"
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                copy_path = Path(tmp_dir) / 'snapshot.db'
+                with closing(sqlite3.connect(self.db_path)) as source, \
+                        closing(sqlite3.connect(copy_path)) as target:
+                    source.backup(target)
+                    page_size = target.execute("PRAGMA page_size").fetchone()[0]
+
+                # ブロックのハッシュの並びを先に求める
+                blocks = []
+                with open(copy_path, 'rb') as f:
+                    while True:
+                        block = f.read(self.block_size)
+                        if not block:
+                            break
+                        blocks.append(hashlib.sha256(block).hexdigest())
+                size = copy_path.stat().st_size
+
+                # 参照するブロックを記録してから、アップロードを省略できるブロックを最新のマニフェストから求める
+                # （記録より後に一覧を取得した削除処理は、これらのブロックを削除しない）
+                self.store.put(inflight_key, json.dumps({
+                    'created_at': time.time(), 'blocks': blocks
+                }).encode('utf-8'))
+                existing = set(latest['blocks']) if latest else set()
+
+                uploads = {}
+                with open(copy_path, 'rb') as f:
+                    for digest in blocks:
+                        block = f.read(self.block_size)
+                        if digest in existing or digest in uploads:
+                            SNAPSHOT_BYTES.inc(len(block), direction="skipped")
+                        else:
+                            uploads[digest] = zlib.compress(block, 6)
+                            SNAPSHOT_BYTES.inc(len(block), direction="uploaded")
+
+            with ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+                list(executor.map(lambda item: self.store.put(BLOCK_PREFIX + item[0], item[1]), uploads.items()))
+
+            # ブロックを保存し終えてからマニフェストを書き込む（途中で失敗しても前回のスナップショットは有効）
+            sequence = (latest['sequence'] if latest else 0) + 1
+            manifest = {
+                'created_at': time.time(),
+                'size': size,
+                'page_size': page_size,
+                'block_size': self.block_size,
+                'blocks': blocks,
+                'sequence': sequence,
+                'base': latest['sequence'] if latest else None,
+                'instance': self.instance_id,
+            }
+            key = f"{MANIFEST_PREFIX}{sequence:012d}.json"
+            if not self.store.put_if(key, json.dumps(manifest).encode('utf-8'), None):
+                self.logger.info(f"スナップショット #{sequence} は他のインスタンスが先に保存しました")
+                return None, 0
+            return manifest, len(uploads)
+        finally:
+            try:
+                self.store.delete(inflight_key)
+            except Exception as e:
+                self.logger.warning(f"保存中のスナップショットの記録を削除できませんでした: {e}")
+
+    def _merge(self, manifest: Dict) -> int:
+        """スナップショットの温度データのうち、データベースにない行を取り込む（取り込んだ件数を返す）"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            other_path = Path(tmp_dir) / 'latest.db'
+            self._download(manifest, other_path)
+            with closing(sqlite3.connect(self.db_path)) as conn:
+                conn.execute("ATTACH DATABASE ? AS latest", (str(other_path),))
+                try:
+                    # (device_id, timestamp) の一意インデックスにより、保存済みの行は無視される
+                    with conn:
+                        cursor = conn.execute(f"""
+                            INSERT OR IGNORE INTO temperature_data ({MERGE_COLUMNS})
+                            SELECT {MERGE_COLUMNS} FROM latest.temperature_data
+                        """)
+                    return cursor.rowcount
+                finally:
+                    conn.execute("DETACH DATABASE latest")
+
+    def _prune(self):
+        """古いマニフェストと、残したマニフェスト・保存中のスナップショットから参照されていないブロックを削除
+
+        ブロック → 保存中の記録 → マニフェストの順に一覧を取得する。一覧の取得後にアップロードされた
+        ブロックは削除対象に含まれず、取得前のブロックを使うスナップショットは保存中の記録か
+        （記録を消した後なら）マニフェストのどちらかに必ず現れる。
+        """
+        try:
+            keys = self._manifest_keys()
+            if len(keys) <= self.keep:
+                return
+
+            block_keys = self.store.list(BLOCK_PREFIX)
+            referenced = set()
+            for key in self.store.list(INFLIGHT_PREFIX):
+                data = self.store.get(key)
+                if not data:
+                    continue
+                inflight = json.loads(data)
+                if time.time() - inflight.get('created_at', 0) < INFLIGHT_TTL:
+                    referenced.update(inflight['blocks'])
+
+            for key in keys[:-self.keep]:
+                self.store.delete(key)
+            # 削除の間に他のインスタンスが書き込んだマニフェストも含め、残っているものすべてを確認する
+            for key in self._manifest_keys():
+                data = self.store.get(key)
+                if data:
+                    referenced.update(json.loads(data)['blocks'])
+            for key in block_keys:
+                if key[len(BLOCK_PREFIX):] not in referenced:
+                    self.store.delete(key)
+        except Exception as e:
+            self.logger.warning(f"古いスナップショットの削除に失敗しました: {e}")
+
+    def _download(self, manifest: Dict, path: Path):
+        """マニフェストのブロックを検証しながら path に書き出す"""
+        unique_blocks = list(dict.fromkeys(manifest['blocks']))
+        with ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+            contents = dict(zip(unique_blocks, executor.map(
+                lambda digest: self.store.get(BLOCK_PREFIX + digest), unique_blocks
+            )))
+
+        with open(path, 'wb') as f:
+            for digest in manifest['blocks']:
+                compressed = contents[digest]
+                if compressed is None:
+                    raise ValueError(f"ブロック {digest} が見つかりません")
+                block = zlib.decompress(compressed)
+                if hashlib.sha256(block).hexdigest() != digest:
+                    raise ValueError(f"ブロック {digest} の内容が一致しません")
+                f.write(block)
+                SNAPSHOT_BYTES.inc(len(block), direction="downloaded")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @SNAPSHOT_SECONDS.timed(operation="restore")
+    def restore(self) -> bool:
+        """最新のスナップショットからデータベースを復元（スナップショットがなければ False ）"""
+        try:
+            manifest = self.latest_manifest()
+            if manifest is None:
+                return False
+
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.db_path.with_name(self.db_path.name + '.restore')
+            self._download(manifest, tmp_path)
+
+            for suffix in ('-wal', '-shm'):
+                try:
+                    os.remove(self.db_path.with_name(self.db_path.name + suffix))
+                except FileNotFoundError:
+                    pass
+            os.replace(tmp_path, self.db_path)
+        except Exception as e:
+            self.logger.error(f"スナップショットからの復元に失敗しました: {e}")
+            return False
+
+        self._last_manifest = manifest
+        self._last_snapshot_at = time.monotonic()
+        self._last_snapshot_mtime = self._db_mtime()
+        self.logger.info(f"スナップショット #{manifest['sequence']} からデータベースを復元しました"
+                         f"（ {manifest['size']} バイト）")
+        return True
@@ -0,0 +1,521 @@
+"""
+ストア・アンド・フォワード用スプール
+取得したサンプルを追記専用ファイルに記録し、バックグラウンドで各シンクへ再送する
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .metrics import metrics
+from .sample import Sample, SampleLike
+
+SEGMENT_PREFIX = "spool-"
+SEGMENT_SUFFIX = ".log"
+CHECKPOINT_FILE = "checkpoint.json"
+LOCK_FILE = "spool.lock"
+
+SPOOL_APPENDS = metrics.counter("spool_appends_total", "スプールに追記したサンプル数")
+SPOOL_DELIVERED = metrics.counter("spool_delivered_total", "スプールからシンクへ送信したサンプル数")
+SPOOL_SINK_FAILURES = metrics.counter("spool_sink_failures_total", "シンクへの送信に失敗した回数")
+SPOOL_PENDING = metrics.gauge("spool_pending_records", "シンクごとの未送信サンプル数")
+SPOOL_DROPPED = metrics.counter("spool_dropped_total", "上限を超えたため送信せずに破棄したサンプル数")
+
+# シンクはサンプル（ Sample または辞書）を受け取り、成功したら True を返す
+Sink = Callable[[SampleLike], bool]
+# バッチシンクはサンプルのリストを受け取り、すべて処理できたら True を返す
+# （属性 batch_size / max_batch_age / retry_after があれば再送ワーカーがそれに従う）
+BatchSink = Callable[[List[SampleLike]], bool]
+
+
+class SpoolLockedError(RuntimeError):
+    """スプールのディレクトリを別のプロセスが使用している場合のエラー"""
+
+
+class Spool:
+    """シーケンス番号付きの追記専用スプールファイル
+
+    チェックポイントとシーケンス番号はプロセス内で管理するため、ディレクトリを排他ロックし、
+    別のプロセスが使用中のスプールは開かない（ SpoolLockedError ）。
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        fsync_batch: int = 16,
+        fsync_interval: float = 1.0,
+        segment_max_bytes: int = 1024 * 1024
+    ):
+        self.directory = Path(directory)
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.segment_max_bytes = segment_max_bytes
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment_path: Optional[Path] = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock_file = None
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._acquire_directory_lock()
+        self._checkpoints = self._load_checkpoints()
+        self._last_seq = self._recover_last_seq()
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    def _acquire_directory_lock(self) -> bool:
+        """ディレクトリの排他ロックを取得し、新たに取得した場合は True を返す"""
+        if self._lock_file is not None:
+            return False
+        lock_file = open(self.directory / LOCK_FILE, 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise SpoolLockedError(f"スプール {self.directory} は別のプロセスが使用中です。"
+                                   "プロセスごとに SPOOL_DIR を分けてください")
+        self._lock_file = lock_file
+        return True
+
+    def _reopen_locked(self):
+        """close() の後に再び使う場合は、ロックを取り直して別のプロセスが進めたチェックポイントを読み直す"""
+        if self._acquire_directory_lock():
+            self._checkpoints = self._load_checkpoints()
+            self._last_seq = self._recover_last_seq()
+
+    def _segment_paths(self) -> List[Path]:
+        return sorted(self.directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))
+
+    @staticmethod
+    def _segment_first_seq(path: Path) -> int:
+        return int(path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    def _recover_last_seq(self) -> int:
+        """既存セグメントから最後のシーケンス番号を復元"""
+        last_seq = max(self._checkpoints.values(), default=0)
+        segments = self._segment_paths()
+        if segments:
+            for seq, _ in self._read_segment(segments[-1]):
+                last_seq = max(last_seq, seq)
+        return last_seq
+
+    def _read_segment(self, path: Path) -> Iterator[Tuple[int, SampleLike]]:
+        """セグメントを読み込む（書き込み途中で切れた末尾行は無視）"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break
+                    try:
+                        record = json.loads(line)
+                        if 'm' in record:
+                            yield record['seq'], Sample(*record['m'])
+                        elif 's' in record:
+                            # 時刻がエポック秒だった頃のレコード
+                            ts, *values = record['s']
+                            yield record['seq'], Sample(ts * 1000, *values)
+                        else:
+                            yield record['seq'], record['data']
+                    except (ValueError, KeyError, TypeError):
+                        self.logger.warning(f"スプールの破損レコードをスキップしました: {path.name}")
+        except FileNotFoundError:
+            return
+
+    def _load_checkpoints(self) -> Dict[str, int]:
+        path = self.directory / CHECKPOINT_FILE
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return {name: int(seq) for name, seq in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, AttributeError) as e:
+            self.logger.warning(f"スプールのチェックポイントを読み込めませんでした: {e}")
+            return {}
+
+    def _save_checkpoints(self):
+        path = self.directory / CHECKPOINT_FILE
+        temp_path = path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._checkpoints, f)
+            f.flush()
+            os.fsync(f.fileno())
+        temp_path.replace(path)
+
+    def _open_segment(self, first_seq: int):
+        self._segment_path = self.directory / f"{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}"
+        self._file = open(self._segment_path, 'a', encoding='utf-8')
+
+    def append(self, data: SampleLike) -> int:
+        """サンプルを追記し、割り当てたシーケンス番号を返す
+
+        Sample は列順の配列（ "m" 、時刻はエポックミリ秒）として、辞書は従来どおり "data" として記録する。
+        """
+        with self._lock:
+            self._reopen_locked()
+            seq = self._last_seq + 1
+            if self._file is None or self._file.tell() >= self.segment_max_bytes:
+                self._close_segment_locked()
+                self._open_segment(seq)
+
+            if isinstance(data, Sample):
+                record = {'seq': seq, 'm': data}
+            else:
+                record = {'seq': seq, 'data': data}
+            line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+            self._file.write(line + '\n')
+            self._file.flush()
+            self._last_seq = seq
+            self._unsynced += 1
+
+            # fsync はバッチ単位でまとめて実行する
+            if (self._unsynced >= self.fsync_batch
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync_locked()
+            SPOOL_APPENDS.inc()
+            return seq
+
+    def sync(self):
+        """未同期の追記をディスクに同期"""
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _close_segment_locked(self):
+        if self._file is not None:
+            self._sync_locked()
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """スプールを同期して閉じ、ディレクトリのロックを解放する"""
+        with self._lock:
+            self._close_segment_locked()
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def read_after(self, seq: int, limit: Optional[int] = None) -> List[Tuple[int, SampleLike]]:
+        """指定したシーケンス番号より後のレコードを返す"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            segments = self._segment_paths()
+
+        records = []
+        for index, path in enumerate(segments):
+            # 次のセグメントの先頭が seq 以下なら、このセグメントは読み飛ばせる
+            if index + 1 < len(segments) and self._segment_first_seq(segments[index + 1]) <= seq + 1:
+                continue
+            for record_seq, data in self._read_segment(path):
+                if record_seq > seq:
+                    records.append((record_seq, data))
+                    if limit is not None and len(records) >= limit:
+                        return records
+        return records
+
+    def get_checkpoint(self, sink_name: str) -> int:
+        """シンクが処理済みのシーケンス番号を返す"""
+        with self._lock:
+            return self._checkpoints.get(sink_name, 0)
+
+    def ack(self, sink_name: str, seq: int):
+        """シンクの処理済みシーケンス番号を記録"""
+        with self._lock:
+            self._reopen_locked()
+            if seq > self._checkpoints.get(sink_name, 0):
+                self._checkpoints[sink_name] = seq
+                self._save_checkpoints()
+
+    def compact(self, sink_names: List[str]) -> int:
+        """全シンクで処理済みのセグメントを削除"""
+        with self._lock:
+            acked = min((self._checkpoints.get(name, 0) for name in sink_names), default=0)
+            segments = self._segment_paths()
+            removed = 0
+            for index, path in enumerate(segments):
+                if index + 1 >= len(segments):
+                    break
+                # 次のセグメントの先頭より前はすべてこのセグメントに含まれる
+                if self._segment_first_seq(segments[index + 1]) - 1 <= acked:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+            return removed
+
+    def trim(self, sink_names: List[str], max_records: int = 0, max_age: float = 0.0) -> Dict[str, int]:
+        """未送信のまま上限を超えたレコードを破棄し、シンクごとの破棄件数を返す
+
+        max_records はシンクごとの未送信件数の上限、 max_age は最後の追記からの経過秒数の上限
+        （セグメント単位で判定する）。破棄したレコードはチェックポイントを進めて送信済みとして扱い、
+        送信できないシンクがあってもスプールが際限なく大きくならないようにする。
+        """
+        with self._lock:
+            self._reopen_locked()
+            floor = self._last_seq - max_records if max_records > 0 else 0
+            if max_age > 0:
+                cutoff = time.time() - max_age
+                segments = self._segment_paths()
+                # 追記中の最後のセグメントは対象にしない
+                for index, path in enumerate(segments[:-1]):
+                    try:
+                        if path.stat().st_mtime >= cutoff:
+                            break
+                    except FileNotFoundError:
+                        continue
+                    floor = max(floor, self._segment_first_seq(segments[index + 1]) - 1)
+
+            dropped = {}
+            for name in sink_names:
+                current = self._checkpoints.get(name, 0)
+                if floor > current:
+                    self._checkpoints[name] = floor
+                    dropped[name] = floor - current
+            if dropped:
+                self._save_checkpoints()
+            return dropped
+
+    def pending(self, sink_names: List[str]) -> Dict[str, int]:
+        """シンクごとの未送信件数を返す"""
+        with self._lock:
+            return {name: self._last_seq - self._checkpoints.get(name, 0) for name in sink_names}
+
+
+class SpoolDrainer:
+    """スプールのレコードを各シンクへ順番に再送するバックグラウンドワーカー
+
+    1 件ずつのシンクは送信のたびに、バッチシンクはバッチごとにチェックポイントを記録する
+    （バッチシンクは (device_id, timestamp) で重複を除く保存先を想定する）。
+    max_pending / max_age を超えた未送信レコードは破棄してスプールの大きさを抑える。
+
+    バッチシンクが batch_size 属性を持つ場合はその件数ずつ送り、 max_batch_age 属性を持つ場合は
+    件数が満たないバッチを最初に見つけてからその秒数まで溜めてから送る（ wait_idle ・ stop では待たずに送る）。
+    送信に失敗したシンクが retry_after 属性で待ち時間を示した場合は、その時間より前には再送しない。
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        sinks: Dict[str, Sink],
+        batch_sinks: Optional[Dict[str, BatchSink]] = None,
+        batch_size: int = 100,
+        retry_interval: float = 5.0,
+        max_retry_interval: float = 300.0,
+        max_pending: int = 0,
+        max_age: float = 0.0
+    ):
+        self.spool = spool
+        self.sinks = sinks
+        self.batch_sinks = batch_sinks or {}
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        # シンクごとの未送信件数・経過秒数の上限（ 0 は無制限）
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.logger = logging.getLogger(__name__)
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._idle = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+        # 件数が満たないバッチを溜め始めた時刻（シンク名ごと）
+        self._batch_started: Dict[str, float] = {}
+        self._max_batch_ages: Dict[str, float] = {}
+        self._flush = threading.Event()
+
+    @property
+    def sink_names(self) -> List[str]:
+        return list(self.sinks) + list(self.batch_sinks)
+
+    def start(self):
+        """バックグラウンドスレッドを開始"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="spool-drainer", daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        """新しいレコードが追記されたことを通知"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                self.drain_once()
+            except Exception as e:
+                self.logger.error(f"スプールの再送中にエラーが発生しました: {e}")
+
+            with self._idle:
+                self._idle.notify_all()
+
+            self._wakeup.wait(timeout=self._next_wait())
+            self.spool.sync()
+
+    def _next_wait(self) -> float:
+        now = time.monotonic()
+        waits = [max(0.0, retry_at - now) for retry_at in self._retry_at.values()]
+        waits += [
+            max(0.0, started + self._max_batch_ages[name] - now) for name, started in self._batch_started.items()
+        ]
+        return min(waits + [self.spool.fsync_interval])
+
+    def drain_once(self) -> int:
+        """各シンクへ未送信レコードを送る（送信件数を返す）"""
+        sent = 0
+        now = time.monotonic()
+        for name, sink in self.sinks.items():
+            if self._retry_at.get(name, 0) > now:
+                continue
+            sent += self._drain_sink(name, sink)
+        for name, batch_sink in self.batch_sinks.items():
+            if self._retry_at.get(name, 0) > now:
+                continue
+            sent += self._drain_batch_sink(name, batch_sink)
+        if self.max_pending or self.max_age:
+            for name, count in self.spool.trim(self.sink_names, self.max_pending, self.max_age).items():
+                SPOOL_DROPPED.inc(count, sink=name)
+                self.logger.error(f"シンク '{name}' の未送信サンプル {count} 件が上限を超えたため破棄しました")
+        self.spool.compact(self.sink_names)
+        for name, pending in self.spool.pending(self.sink_names).items():
+            SPOOL_PENDING.set(pending, sink=name)
+        return sent
+
+    def _drain_sink(self, name: str, sink: Sink) -> int:
+        sent = 0
+        checkpoint = self.spool.get_checkpoint(name)
+        while True:
+            records = self.spool.read_after(checkpoint, limit=self.batch_size)
+            if not records:
+                break
+
+            for seq, data in records:
+                try:
+                    ok = sink(data)
+                except Exception as e:
+                    self.logger.warning(f"シンク '{name}' への送信でエラーが発生しました: {e}")
+                    ok = False
+
+                if not ok:
+                    self._schedule_retry(name, progressed=sent > 0)
+                    return sent
+
+                # 1 件ずつのシンク（ Google Sheets など）は追記が冪等ではないため、
+                # 送信のたびにチェックポイントを記録し、停止後の再送で重複するのを最大 1 件に抑える
+                checkpoint = seq
+                self.spool.ack(name, checkpoint)
+                sent += 1
+                SPOOL_DELIVERED.inc(sink=name)
+
+        self._failures.pop(name, None)
+        self._retry_at.pop(name, None)
+        return sent
+
+    def _drain_batch_sink(self, name: str, batch_sink: BatchSink) -> int:
+        sent = 0
+        checkpoint = self.spool.get_checkpoint(name)
+        batch_size = getattr(batch_sink, 'batch_size', None) or self.batch_size
+        max_batch_age = getattr(batch_sink, 'max_batch_age', None) or 0
+        while True:
+            records = self.spool.read_after(checkpoint, limit=batch_size)
+            if not records:
+                break
+
+            if len(records) < batch_size and max_batch_age > 0 and not self._flush.is_set():
+                # 件数が満たないバッチは、溜め始めてから max_batch_age 秒経つまで送らない
+                started = self._batch_started.setdefault(name, time.monotonic())
+                self._max_batch_ages[name] = max_batch_age
+                if time.monotonic() - started < max_batch_age:
+                    return sent
+            self._batch_started.pop(name, None)
+
+            try:
+                ok = batch_sink([data for _, data in records])
+            except Exception as e:
+                self.logger.warning(f"シンク '{name}' への一括送信でエラーが発生しました: {e}")
+                ok = False
+
+            if not ok:
+                self._schedule_retry(name, progressed=sent > 0, retry_after=getattr(batch_sink, 'retry_after', None))
+                return sent
+
+            checkpoint = records[-1][0]
+            sent += len(records)
+            SPOOL_DELIVERED.inc(len(records), sink=name)
+            self.spool.ack(name, checkpoint)
+
+        self._failures.pop(name, None)
+        self._retry_at.pop(name, None)
+        return sent
+
+    def _schedule_retry(self, name: str, progressed: bool = False, retry_after: Optional[float] = None):
+        SPOOL_SINK_FAILURES.inc(sink=name)
+        # 一部でも送信できていれば、断続的なエラーとみなしてバックオフを初期値に戻す
+        failures = 1 if progressed else self._failures.get(name, 0) + 1
+        self._failures[name] = failures
+        delay = min(self.retry_interval * (2 ** (failures - 1)), self.max_retry_interval)
+        if retry_after is not None:
+            # 送信先が待ち時間を指定した場合はそれに従う
+            delay = retry_after
+        self._retry_at[name] = time.monotonic() + delay
+        self.logger.warning(f"シンク '{name}' への再送を {delay:.0f} 秒後に再試行します")
+
+    def sink_status(self) -> Dict[str, Dict]:
+        """シンクごとの未送信件数、連続失敗回数、次の再送までの秒数を返す"""
+        pending = self.spool.pending(self.sink_names)
+        now = time.monotonic()
+        status = {}
+        for name in self.sink_names:
+            retry_at = self._retry_at.get(name)
+            status[name] = {
+                'pending': pending[name],
+                'failures': self._failures.get(name, 0),
+                'retry_in': round(max(0.0, retry_at - now), 1) if retry_at is not None else None,
+            }
+        return status
+
+    def wait_idle(self, timeout: float) -> bool:
+        """未送信レコードがなくなるまで待機（タイムアウト時は False ）"""
+        deadline = time.monotonic() + timeout
+        # 溜めている途中のバッチも待たずに送らせる
+        self._flush.set()
+        try:
+            while True:
+                pending = self.spool.pending(self.sink_names)
+                if not any(pending.values()):
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None or not self._thread.is_alive():
+                    return False
+                self.notify()
+                with self._idle:
+                    self._idle.wait(timeout=min(remaining, 0.5))
+        finally:
+            self._flush.clear()
+
+    def stop(self, timeout: float = 10.0):
+        """残りのレコードを送信してからスレッドを停止"""
+        if self._thread is not None and self._thread.is_alive():
+            self.wait_idle(timeout)
+            self._stopping.set()
+            self._wakeup.set()
+            self._thread.join(timeout=timeout)
+        self._thread = None
+        self.spool.close()
@@ -4,20 +4,42 @@ import uuid
 import hashlib
 import hmac
 import base64
+import threading
 import requests
 import logging
 from typing import Dict, Optional
-from datetime import datetime
+from .metrics import metrics
+from .sample import Sample, now_millis
+
+API_REQUEST_SECONDS = metrics.histogram(
+    "switchbot_api_request_seconds", "SwitchBot API へのリクエスト 1 回あたりの所要時間"
+)
+API_REQUESTS = metrics.counter(
+    "switchbot_api_requests_total", "SwitchBot API へのリクエスト数（結果別）"
+)
+API_RETRIES = metrics.counter(
+    "switchbot_api_retries_total", "SwitchBot API リクエストの再試行回数"
+)
 
 class SwitchBotAPI:
     """SwitchBot API v1.1 クライアント"""
     
     BASE_URL = "https://api.switch-bot.com/v1.1"
     
-    def __init__(self, token: str, secret: str):
+    def __init__(self, token: str, secret: str, base_url: Optional[str] = None,
+                 retry_backoff: float = 1.0, pool_size: int = 10):
         self.token = token
         self.secret = secret
+        self.base_url = (base_url or self.BASE_URL).rstrip("/")
+        self.retry_backoff = retry_backoff
         self.logger = logging.getLogger(__name__)
+        # 複数デバイスを取得する際に接続を再利用する（並行数に合わせて接続数を確保）
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # スレッドごとの直近の get_device_status で送信したリクエスト数（再試行を含む）
+        self._local = threading.local()
     
     def _generate_headers(self) -> Dict[str, str]:
         """API 認証用のヘッダーを生成"""
@@ -44,52 +66,69 @@ class SwitchBotAPI:
     
     def get_device_status(self, device_id: str, max_retries: int = 3) -> Optional[Dict]:
         """デバイスのステータスを取得"""
-        url = f"{self.BASE_URL}/devices/{device_id}/status"
+        url = f"{self.base_url}/devices/{device_id}/status"
+        self._local.request_count = 0
         
         for attempt in range(max_retries):
+            if attempt:
+                API_RETRIES.inc(endpoint="status")
+            self._local.request_count += 1
             try:
                 headers = self._generate_headers()
-                response = requests.get(url, headers=headers, timeout=30)
+                with API_REQUEST_SECONDS.time(endpoint="status"):
+                    response = self.session.get(url, headers=headers, timeout=30)
                 response.raise_for_status()
                 
                 data = response.json()
                 
                 if data.get("statusCode") == 100:
-                    self.logger.info(f"デバイス {device_id} のステータスを正常に取得しました")
+                    API_REQUESTS.inc(endpoint="status", result="success")
+                    self.logger.debug(f"デバイス {device_id} のステータスを正常に取得しました")
                     return data.get("body")
                 else:
+                    API_REQUESTS.inc(endpoint="status", result="api_error")
                     self.logger.error(f"API エラー: {data.get('message', 'Unknown error')}")
                     return None
                     
             except requests.exceptions.RequestException as e:
+                API_REQUESTS.inc(endpoint="status", result="request_error")
                 self.logger.error(f"API リクエストエラー (試行 {attempt + 1}/{max_retries}): {e}")
                 if attempt == max_retries - 1:
                     raise
-                time.sleep(2 ** attempt)  # 指数バックオフ
+                time.sleep(self.retry_backoff * 2 ** attempt)  # 指数バックオフ
         
         return None
     
-    def get_temperature_data(self, device_id: str) -> Optional[Dict]:
-        """温度データを取得して整形"""
+    def last_request_count(self) -> int:
+        """このスレッドで直近に呼び出した get_device_status が送信したリクエスト数（再試行を含む）"""
+        return getattr(self._local, 'request_count', 0)
+    
+    def get_sample(self, device_id: str) -> Optional[Sample]:
+        """温度データを取得して Sample にする"""
         status = self.get_device_status(device_id)
         
         if not status:
             return None
         
-        return {
-            "timestamp": datetime.now().isoformat(),
-            "device_id": device_id,
-            "temperature": status.get("temperature"),
-            "humidity": status.get("humidity"),
-            "light_level": status.get("lightLevel"),
-            "device_type": status.get("deviceType", "Unknown"),
-            "version": status.get("version", "Unknown")
-        }
+        return Sample(
+            now_millis(),
+            device_id,
+            status.get("temperature"),
+            status.get("humidity"),
+            status.get("lightLevel"),
+            status.get("deviceType", "Unknown"),
+            status.get("version", "Unknown")
+        )
+    
+    def get_temperature_data(self, device_id: str) -> Optional[Dict]:
+        """温度データを取得して辞書に整形"""
+        sample = self.get_sample(device_id)
+        return sample.to_dict() if sample else None
     
     def test_connection(self, device_id: str) -> bool:
         """API 接続をテスト"""
         try:
-            result = self.get_temperature_data(device_id)
+            result = self.get_sample(device_id)
             return result is not None
         except Exception as e:
             self.logger.error(f"接続テストに失敗しました: {e}")
@@ -97,23 +136,27 @@ class SwitchBotAPI:
 
     def get_device_list(self) -> Optional[Dict]:
         """登録済みデバイス一覧を取得"""
-        url = f"{self.BASE_URL}/devices"
+        url = f"{self.base_url}/devices"
         
         try:
             headers = self._generate_headers()
-            response = requests.get(url, headers=headers, timeout=30)
+            with API_REQUEST_SECONDS.time(endpoint="devices"):
+                response = self.session.get(url, headers=headers, timeout=30)
             response.raise_for_status()
             
             data = response.json()
             
             if data.get("statusCode") == 100:
-                self.logger.info("デバイス一覧を正常に取得しました")
+                API_REQUESTS.inc(endpoint="devices", result="success")
+                self.logger.debug("デバイス一覧を正常に取得しました")
                 return data.get("body")
             else:
+                API_REQUESTS.inc(endpoint="devices", result="api_error")
                 self.logger.error(f"API エラー: {data.get('message', 'Unknown error')}")
                 return None
                 
         except requests.exceptions.RequestException as e:
+            API_REQUESTS.inc(endpoint="devices", result="request_error")
             self.logger.error(f"API リクエストエラー: {e}")
             raise
         
@@ -0,0 +1,205 @@
+"""
+時系列データベースへの送信
+サンプルを InfluxDB の line protocol にまとめ、 gzip で圧縮して HTTP で書き込む
+"""
+
+import gzip
+import time
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from .metrics import metrics
+from .sample import SampleLike, as_sample
+
+TSDB_WRITE_SECONDS = metrics.histogram("tsdb_write_seconds", "時系列データベースへの書き込み 1 回あたりの所要時間")
+TSDB_WRITES = metrics.counter("tsdb_writes_total", "時系列データベースへの書き込み回数（結果別）")
+TSDB_POINTS = metrics.counter("tsdb_points_total", "時系列データベースへ書き込んだポイント数")
+TSDB_BYTES = metrics.counter("tsdb_bytes_total", "時系列データベースへ送信したバイト数（圧縮前 raw / 送信 sent ）")
+
+# タグの値と measurement で区切り文字として扱われる文字
+_TAG_ESCAPES = str.maketrans({',': r'\,', ' ': r'\ ', '=': r'\='})
+_MEASUREMENT_ESCAPES = str.maketrans({',': r'\,', ' ': r'\ '})
+
+
+def _tag(key: str, value) -> str:
+    return f",{key}={str(value).translate(_TAG_ESCAPES)}" if value not in (None, '') else ''
+
+
+def encode_lines(records: Iterable[SampleLike], measurement: str = 'environment') -> Tuple[bytes, int]:
+    """サンプルを line protocol（ミリ秒精度）に変換し、本文とポイント数を返す
+
+    デバイス ID と種類をタグ、温度・湿度を float 、照度を integer のフィールドにする。
+    数値のないサンプルと解析できないサンプルは除く。
+    """
+    measurement = measurement.translate(_MEASUREMENT_ESCAPES)
+    prefixes: Dict[Tuple, str] = {}
+    lines: List[str] = []
+    for data in records:
+        try:
+            sample = as_sample(data)
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        fields = []
+        if sample.temperature is not None:
+            fields.append(f"temperature={float(sample.temperature)!r}")
+        if sample.humidity is not None:
+            fields.append(f"humidity={float(sample.humidity)!r}")
+        if sample.light_level is not None:
+            fields.append(f"light_level={int(sample.light_level)}i")
+        if not fields:
+            continue
+
+        # タグの組み合わせはデバイスごとにほぼ一定のため、エスケープ済みの先頭部分を使い回す
+        key = (sample.device_id, sample.device_type)
+        prefix = prefixes.get(key)
+        if prefix is None:
+            prefix = prefixes[key] = (measurement + _tag('device_id', sample.device_id)
+                                      + _tag('device_type', sample.device_type))
+        lines.append(f"{prefix} {','.join(fields)} {sample.ts}")
+
+    if not lines:
+        return b'', 0
+    return ('\n'.join(lines) + '\n').encode('utf-8'), len(lines)
+
+
+class LineProtocolSink:
+    """スプールのバッチシンクとして使う line protocol の書き込みクライアント
+
+    スプールの再送ワーカーは batch_size 件たまるか、最初の未送信サンプルから max_batch_age 秒
+    経つまで送信を待ち、まとめてこのシンクに渡す。送信できなかったバッチはスプールに残り、
+    429 / 503 の場合は Retry-After（ retry_after 属性）の間を空けて再送される。
+    不正なポイント（ 400 / 422 ）は分割して絞り込んだ 1 ポイントだけを破棄し、
+    認証エラーなどその他の 4xx はスプールに残して再送する。
+    """
+
+    def __init__(
+        self,
+        write_url: str,
+        token: Optional[str] = None,
+        measurement: str = 'environment',
+        batch_size: int = 5000,
+        max_batch_age: float = 5.0,
+        compress: bool = True,
+        timeout: float = 10.0,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+        max_retry_after: float = 300.0,
+        pool_size: int = 4
+    ):
+        self.write_url = write_url
+        self.measurement = measurement
+        self.batch_size = batch_size
+        self.max_batch_age = max_batch_age
+        self.compress = compress
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_after = max_retry_after
+        # 直近の送信で書き込み先から指定された待ち時間（再送ワーカーが参照する）
+        self.retry_after: Optional[float] = None
+        self.logger = logging.getLogger(__name__)
+
+        # 送信のたびに接続を張り直さないよう、接続を再利用する
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Content-Type"] = "text/plain; charset=utf-8"
+        if token:
+            self.session.headers["Authorization"] = f"Token {token}"
+        if compress:
+            self.session.headers["Content-Encoding"] = "gzip"
+
+    def __call__(self, records: List[SampleLike]) -> bool:
+        """バッチを書き込み、スプールから削除してよければ True を返す"""
+        self.retry_after = None
+        payload, points = encode_lines(records, self.measurement)
+        if not points:
+            return True
+        return self._write(payload, points)
+
+    def _write(self, payload: bytes, points: int) -> bool:
+        body = gzip.compress(payload, compresslevel=5) if self.compress else payload
+
+        for attempt in range(self.max_retries):
+            if attempt:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                with TSDB_WRITE_SECONDS.time():
+                    response = self.session.post(
+                        self.write_url, params={'precision': 'ms'}, data=body, timeout=self.timeout
+                    )
+            except requests.exceptions.RequestException as e:
+                TSDB_WRITES.inc(result="request_error")
+                self.logger.warning(f"時系列データベースへの書き込みエラー (試行 {attempt + 1}/{self.max_retries}): {e}")
+                continue
+
+            status = response.status_code
+            if 200 <= status < 300:
+                TSDB_WRITES.inc(result="success")
+                TSDB_POINTS.inc(points)
+                TSDB_BYTES.inc(len(payload), kind="raw")
+                TSDB_BYTES.inc(len(body), kind="sent")
+                return True
+
+            if status in (400, 413, 422) and points > 1:
+                # 本文が大きすぎる・不正なポイントを含む場合は、半分に分けて送り直す（不正なポイントだけを絞り込む）
+                TSDB_WRITES.inc(result="split")
+                return self._write_split(payload)
+
+            if status in (429, 503):
+                # 書き込み先が過負荷の場合はここで待たずにスプールに残し、指定された間隔を空けて再送させる
+                TSDB_WRITES.inc(result="throttled")
+                self.retry_after = self._parse_retry_after(response.headers.get('Retry-After'))
+                self.logger.warning(f"時系列データベースが書き込みを制限しています (HTTP {status})")
+                return False
+
+            if status >= 500:
+                TSDB_WRITES.inc(result="server_error")
+                self.logger.warning(f"時系列データベースのサーバーエラー (HTTP {status}, 試行 {attempt + 1}/{self.max_retries})")
+                continue
+
+            if status in (400, 413, 422):
+                # 不正な 1 ポイントは再送しても成功しないため、後続の送信を止めないよう破棄する
+                TSDB_WRITES.inc(result="rejected")
+                self.logger.error(f"時系列データベースが書き込みを拒否したポイントを破棄しました "
+                                  f"(HTTP {status}): {payload[:200]!r} {response.text[:200]}")
+                return True
+
+            # 認証エラーや URL（ org / bucket ）の誤りはスプールに残し、設定が直るまで再送する
+            TSDB_WRITES.inc(result="client_error")
+            self.logger.error(f"時系列データベースへの書き込みが失敗しました。トークンと書き込み URL を確認してください "
+                              f"(HTTP {status}): {response.text[:200]}")
+            return False
+
+        return False
+
+    def _write_split(self, payload: bytes) -> bool:
+        lines = payload.splitlines(keepends=True)
+        middle = len(lines) // 2
+        return (self._write(b''.join(lines[:middle]), middle)
+                and self._write(b''.join(lines[middle:]), len(lines) - middle))
+
+    def _parse_retry_after(self, value: Optional[str]) -> Optional[float]:
+        try:
+            return min(float(value), self.max_retry_after) if value else None
+        except ValueError:
+            return None
+
+
+def create_tsdb_sink(
+    write_url: Optional[str],
+    token: Optional[str] = None,
+    measurement: str = 'environment',
+    batch_size: int = 5000,
+    max_batch_age: float = 5.0,
+    compress: bool = True
+) -> Optional[LineProtocolSink]:
+    """設定に応じて時系列データベースのシンクを作成（ URL が未設定の場合は None ）"""
+    if not write_url:
+        return None
+    return LineProtocolSink(write_url, token=token, measurement=measurement, batch_size=batch_size,
+                            max_batch_age=max_batch_age, compress=compress)
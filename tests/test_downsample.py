@@ -0,0 +1,83 @@
+"""
+間引き（ LTTB / 最小・最大）の点数の上限と形状の保持
+"""
+
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.downsample import FIELDS, METHODS, downsample
+
+BASE = datetime(2026, 1, 1)
+
+
+def _rows(count: int, device_id: str = 'A'):
+    rows = []
+    for n in range(count):
+        timestamp = (BASE + timedelta(minutes=n)).isoformat()
+        temperature = 20 + 5 * math.sin(n / 50)
+        # 湿度は 1 点だけ突出した値を持ち、照度は 10 件に 1 件だけ値がある
+        humidity = 95.0 if n == 777 else 50 + math.cos(n / 80)
+        light_level = n % 7 if n % 10 == 0 else None
+        rows.append((timestamp, device_id, temperature, humidity, light_level))
+    return rows
+
+
+def _selected(points, field):
+    return [point for point in points if point[field] is not None]
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_each_field_stays_within_the_point_budget(method):
+    points = list(downsample(_rows(5000), 100, method))
+
+    for field in FIELDS:
+        assert 0 < len(_selected(points, field)) <= 100
+    timestamps = [point['timestamp'] for point in points]
+    assert timestamps == sorted(timestamps)
+    assert len(set(timestamps)) == len(timestamps)
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_sparse_field_is_downsampled_independently(method):
+    points = list(downsample(_rows(5000), 100, method))
+
+    # 照度は値のある 500 点から選ばれ、他のフィールドの点の選び方に左右されない
+    light = _selected(points, 'light_level')
+    assert all(datetime.fromisoformat(point['timestamp']).minute % 10 == 0 for point in light)
+    assert len(light) <= 100
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_extremes_and_endpoints_are_kept(method):
+    rows = _rows(5000)
+    points = list(downsample(rows, 100, method))
+
+    humidity = _selected(points, 'humidity')
+    assert max(point['humidity'] for point in humidity) == 95.0
+    if method == 'lttb':
+        assert humidity[0]['timestamp'] == rows[0][0]
+        assert humidity[-1]['timestamp'] == rows[-1][0]
+
+
+def test_short_series_is_returned_unchanged():
+    rows = _rows(50)
+    points = list(downsample(rows, 100))
+
+    assert [point['timestamp'] for point in points] == [row[0] for row in rows]
+    assert [point['temperature'] for point in points] == [row[2] for row in rows]
+
+
+def test_devices_are_downsampled_separately():
+    rows = sorted(_rows(1000, 'A') + _rows(300, 'B'))
+    points = list(downsample(rows, 50))
+
+    for device_id in ('A', 'B'):
+        device_points = [point for point in points if point['device_id'] == device_id]
+        assert 0 < len(_selected(device_points, 'temperature')) <= 50
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError):
+        list(downsample(_rows(10), 5, 'average'))
@@ -0,0 +1,95 @@
+"""
+一括インポートの中断と再開
+"""
+
+import csv
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.migration import Importer
+
+ROWS = 50
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'source.csv'
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['timestamp', 'device_id', 'temperature', 'humidity', 'light_level'])
+        for n in range(ROWS):
+            writer.writerow([(datetime(2026, 1, 1) + timedelta(minutes=n)).isoformat(), 'A', 20 + n % 3, 50, n % 5])
+    return path
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _interrupt_after(chunks: int):
+    calls = []
+
+    def on_rows(rows):
+        calls.append(len(rows))
+        if len(calls) == chunks:
+            raise Interrupted()
+    return on_rows
+
+
+def _importer(source, target_type, target, **kwargs) -> Importer:
+    return Importer(source, target_type, target, workers=1, chunk_rows=10, transaction_rows=10, **kwargs)
+
+
+def _count(target_type, target) -> int:
+    if target_type == 'sqlite':
+        with sqlite3.connect(target) as conn:
+            return conn.execute("SELECT COUNT(*) FROM temperature_data").fetchone()[0]
+    with open(target, encoding='utf-8') as f:
+        return sum(1 for _ in csv.DictReader(f))
+
+
+@pytest.mark.parametrize('target_type, filename', [('sqlite', 'target.db'), ('csv', 'target.csv')])
+def test_interrupted_import_resumes_from_checkpoint(tmp_path, source, target_type, filename):
+    target = tmp_path / filename
+
+    # 3 チャンク目を書き込んだ後、コミットする前に中断する
+    with pytest.raises(Interrupted):
+        _importer(source, target_type, target, on_rows=_interrupt_after(3)).run()
+
+    resumed_rows = []
+    result = _importer(source, target_type, target, on_rows=resumed_rows.extend).run()
+
+    # 2 チャンク（ 20 行）はコミット済みのため読み直さない
+    assert len(resumed_rows) == ROWS - 20
+    assert resumed_rows[0]['timestamp'] == (datetime(2026, 1, 1) + timedelta(minutes=20)).isoformat()
+    assert result['ok']
+    assert result['rows_read'] == ROWS
+    assert result['target_count'] == ROWS
+    assert _count(target_type, target) == ROWS
+
+
+def test_checkpoint_is_ignored_when_the_source_changes(tmp_path, source):
+    target = tmp_path / 'target.db'
+    with pytest.raises(Interrupted):
+        _importer(source, 'sqlite', target, on_rows=_interrupt_after(3)).run()
+
+    with open(source, 'a', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerow([datetime(2026, 1, 2).isoformat(), 'A', 20, 50, 1])
+
+    result = _importer(source, 'sqlite', target).run()
+    assert result['rows_read'] == ROWS + 1
+    assert result['rows_duplicate'] == 20
+    assert _count('sqlite', target) == ROWS + 1
+
+
+def test_completed_import_is_idempotent(tmp_path, source):
+    target = tmp_path / 'target.db'
+    first = _importer(source, 'sqlite', target).run()
+    second = _importer(source, 'sqlite', target).run()
+
+    assert first['rows_inserted'] == ROWS
+    assert second['rows_inserted'] == 0
+    assert second['rows_duplicate'] == ROWS
+    assert _count('sqlite', target) == ROWS
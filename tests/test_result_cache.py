@@ -0,0 +1,72 @@
+"""
+クエリ結果キャッシュの書き込みによる無効化
+"""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.data_storage import create_storage
+from src.query import QueryParams, run_query
+
+
+def _sample(timestamp: datetime, device_id: str = 'A', temperature: float = 20.0) -> dict:
+    return {'timestamp': timestamp.isoformat(), 'device_id': device_id, 'temperature': temperature,
+            'humidity': 50.0, 'light_level': 1}
+
+
+def _query(storage, **params) -> list:
+    return json.loads(''.join(run_query(storage, QueryParams({key: str(value) for key, value in params.items()}))))
+
+
+@pytest.fixture(params=['csv', 'sqlite'])
+def storage(request, tmp_path):
+    storage = create_storage(request.param, tmp_path / f"data.{request.param}", result_cache_size=8)
+    base = datetime(2026, 1, 1)
+    storage.save_batch([_sample(base + timedelta(minutes=n)) for n in range(10)])
+    return storage
+
+
+RANGE = {'start': datetime(2026, 1, 1).isoformat(), 'end': datetime(2026, 1, 1, 1).isoformat()}
+
+
+def test_write_inside_the_range_invalidates_the_result(storage):
+    assert len(_query(storage, **RANGE)) == 10
+    assert storage.result_cache.stats()['entries'] == 1
+    assert len(_query(storage, **RANGE)) == 10
+
+    storage.save_temperature_data(_sample(datetime(2026, 1, 1, 0, 30)))
+    assert storage.result_cache.stats()['entries'] == 0
+    assert len(_query(storage, **RANGE)) == 11
+
+
+def test_writes_outside_the_range_or_device_keep_the_result(storage):
+    _query(storage, device_id='A', **RANGE)
+
+    storage.save_batch([_sample(datetime(2026, 1, 2)), _sample(datetime(2026, 1, 1, 0, 30), device_id='B')])
+    assert storage.result_cache.stats()['entries'] == 1
+
+
+def test_aggregated_result_is_invalidated(storage):
+    buckets = _query(storage, resolution='1h', **RANGE)
+    assert buckets[0]['count'] == 10
+
+    storage.save_temperature_data(_sample(datetime(2026, 1, 1, 0, 59), temperature=40.0))
+    buckets = _query(storage, resolution='1h', **RANGE)
+    assert buckets[0]['count'] == 11
+    assert buckets[0]['temperature_max'] == 40.0
+
+
+def test_partially_read_result_is_not_cached(storage):
+    body = run_query(storage, QueryParams(RANGE))
+    next(body)
+    assert storage.result_cache.stats()['entries'] == 0
+
+
+def test_results_above_max_rows_are_streamed_without_caching(tmp_path):
+    storage = create_storage('sqlite', tmp_path / 'data.db', result_cache_size=8, result_cache_rows=5)
+    storage.save_batch([_sample(datetime(2026, 1, 1) + timedelta(minutes=n)) for n in range(10)])
+
+    assert len(_query(storage, **RANGE)) == 10
+    assert storage.result_cache.stats() == {'entries': 0, 'rows': 0}
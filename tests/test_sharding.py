@@ -0,0 +1,87 @@
+"""
+リースによるデバイスの割り当てと、停止したワーカーの取得権の引き継ぎ
+"""
+
+import time
+
+from src.sharding import LeaseStore, ShardedWorker
+
+DEVICES = [f"device-{n}" for n in range(20)]
+
+
+def test_expired_workers_claims_are_taken_over(tmp_path):
+    store = LeaseStore(tmp_path / 'leases.db', lease_ttl=10)
+    now = 1_000_000.0
+
+    store.heartbeat('a', now)
+    assert store.claim(['d1', 'd2'], slot=1, worker_id='a', now=now) == {'d1': 'claimed', 'd2': 'claimed'}
+
+    # a のリースが有効な間は、同じ周期の取得権を他のワーカーは取得できない
+    store.heartbeat('b', now + 5)
+    assert store.claim(['d1', 'd2'], slot=1, worker_id='b', now=now + 5) == {}
+
+    # a が取得を終えずに停止し、リースが切れた後は b が引き継ぐ
+    store.heartbeat('b', now + 20)
+    assert store.claim(['d1', 'd2'], slot=1, worker_id='b', now=now + 20) == {
+        'd1': 'taken_over', 'd2': 'taken_over'
+    }
+    # 遅れて戻ってきた a は完了を記録できない
+    assert store.complete(['d1', 'd2'], slot=1, worker_id='a', now=now + 21) == []
+    assert store.complete(['d1', 'd2'], slot=1, worker_id='b', now=now + 21) == ['d1', 'd2']
+
+
+def test_completed_claims_are_not_taken_over(tmp_path):
+    store = LeaseStore(tmp_path / 'leases.db', lease_ttl=10)
+    now = 1_000_000.0
+
+    store.heartbeat('a', now)
+    store.claim(['d1'], slot=1, worker_id='a', now=now)
+    assert store.complete(['d1'], slot=1, worker_id='a', now=now + 1) == ['d1']
+
+    store.heartbeat('b', now + 20)
+    assert store.claim(['d1'], slot=1, worker_id='b', now=now + 20) == {}
+    # 次の周期は改めて取得する
+    assert store.claim(['d1'], slot=2, worker_id='b', now=now + 20) == {'d1': 'claimed'}
+
+
+def test_released_lease_is_taken_over_immediately(tmp_path):
+    store = LeaseStore(tmp_path / 'leases.db', lease_ttl=60)
+    now = time.time()
+
+    store.heartbeat('a', now)
+    store.claim(['d1'], slot=1, worker_id='a', now=now)
+    store.release('a')
+
+    assert store.heartbeat('b', now + 1) == ['b']
+    assert store.claim(['d1'], slot=1, worker_id='b', now=now + 1) == {'d1': 'taken_over'}
+
+
+def test_devices_move_to_the_surviving_worker(tmp_path):
+    store = LeaseStore(tmp_path / 'leases.db', lease_ttl=30)
+    collected = {'a': [], 'b': []}
+
+    def collector(name):
+        def collect(device_ids):
+            collected[name].extend(device_ids)
+            # a は取得に失敗し続ける（取得権は完了として記録されない）
+            return {device_id: name == 'b' for device_id in device_ids}
+        return collect
+
+    workers = {
+        name: ShardedWorker(store, DEVICES, collector(name), worker_id=name, poll_interval=1e9)
+        for name in ('a', 'b')
+    }
+    now = time.time()
+    for worker in workers.values():
+        worker.run_once(now)
+    for worker in workers.values():
+        worker.run_once(now + 1)
+
+    # 2 台で重複なくすべてのデバイスを分担する
+    assert collected['a'] and collected['b']
+    assert sorted(collected['a'] + collected['b']) == sorted(DEVICES)
+
+    # a のリースが切れると、 a が完了できなかったデバイスを b が引き継ぐ
+    workers['b'].run_once(now + 100)
+    assert sorted(collected['b']) == sorted(DEVICES)
+    assert workers['b'].owned_devices(['b']) == DEVICES
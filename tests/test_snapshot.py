@@ -0,0 +1,104 @@
+"""
+SQLite のスナップショットの復元と、複数インスタンスのスナップショットの取り込み
+"""
+
+import sqlite3
+
+from src.data_storage import SQLiteStorage
+from src.object_store import LocalDirectoryStore
+from src.snapshot import SnapshotManager
+
+
+def _row(device_id: str, minute: int) -> dict:
+    return {'timestamp': f'2026-01-01T00:{minute:02d}:00', 'device_id': device_id, 'temperature': 20.0}
+
+
+def _keys(path) -> set:
+    with sqlite3.connect(path) as conn:
+        return set(conn.execute("SELECT device_id, timestamp FROM temperature_data").fetchall())
+
+
+def _manager(path, store, **kwargs) -> SnapshotManager:
+    return SnapshotManager(path, store, block_size=4096, **kwargs)
+
+
+def test_restore_recreates_the_database(tmp_path):
+    store = LocalDirectoryStore(tmp_path / 'store')
+    storage = SQLiteStorage(tmp_path / 'a.db')
+    storage.save_batch([_row('A', minute) for minute in range(30)])
+    manager = _manager(tmp_path / 'a.db', store)
+    assert manager.snapshot()['sequence'] == 1
+
+    # 変更されたブロックだけをアップロードする
+    uploaded = set(store.list('blocks/'))
+    storage.save_batch([_row('B', 0)])
+    manifest = manager.snapshot()
+    assert manifest['sequence'] == 2
+    assert len(set(store.list('blocks/')) - uploaded) < len(manifest['blocks'])
+
+    restored = _manager(tmp_path / 'b.db', store)
+    assert restored.restore()
+    assert _keys(tmp_path / 'b.db') == _keys(tmp_path / 'a.db')
+
+
+def test_restore_without_snapshot_returns_false(tmp_path):
+    manager = _manager(tmp_path / 'a.db', LocalDirectoryStore(tmp_path / 'store'))
+    assert not manager.restore()
+    assert not (tmp_path / 'a.db').exists()
+
+
+def test_snapshot_merges_rows_from_other_instances(tmp_path):
+    store = LocalDirectoryStore(tmp_path / 'store')
+    storage_a = SQLiteStorage(tmp_path / 'a.db')
+    manager_a = _manager(tmp_path / 'a.db', store)
+    storage_a.save_batch([_row('A', 1)])
+    manager_a.snapshot()
+
+    merged = []
+    manager_b = _manager(tmp_path / 'b.db', store, on_merge=lambda: merged.append(True))
+    assert manager_b.restore()
+    storage_b = SQLiteStorage(tmp_path / 'b.db')
+    storage_b.save_batch([_row('B', 1)])
+
+    # b の保存より先に a が新しいスナップショットを保存する
+    storage_a.save_batch([_row('A', 2)])
+    manager_a.snapshot()
+
+    manifest = manager_b.snapshot()
+    assert manifest['sequence'] == 3
+    assert merged
+    assert _keys(tmp_path / 'b.db') == {('A', _row('A', 1)['timestamp']), ('A', _row('A', 2)['timestamp']),
+                                        ('B', _row('B', 1)['timestamp'])}
+
+    restored = _manager(tmp_path / 'c.db', store)
+    assert restored.restore()
+    assert _keys(tmp_path / 'c.db') == _keys(tmp_path / 'b.db')
+
+
+def test_conflicting_manifest_write_is_retried_after_merging(tmp_path):
+    store = LocalDirectoryStore(tmp_path / 'store')
+    storage_a = SQLiteStorage(tmp_path / 'a.db')
+    manager_a = _manager(tmp_path / 'a.db', store)
+    storage_a.save_batch([_row('A', 1)])
+    manager_a.snapshot()
+
+    manager_b = _manager(tmp_path / 'b.db', store)
+    manager_b.restore()
+    SQLiteStorage(tmp_path / 'b.db').save_batch([_row('B', 1)])
+
+    # b がマニフェストを書き込む直前に a が先に書き込む
+    publish = manager_b._publish
+
+    def racing_publish(latest):
+        manager_b._publish = publish
+        storage_a.save_batch([_row('A', 2)])
+        manager_a.snapshot()
+        return publish(latest)
+
+    manager_b._publish = racing_publish
+    manifest = manager_b.snapshot()
+
+    assert manifest['sequence'] == 3
+    restored = _manager(tmp_path / 'c.db', store)
+    restored.restore()
+    assert len(_keys(tmp_path / 'c.db')) == 3
@@ -0,0 +1,174 @@
+"""
+スプールの再送とチェックポイント（送信中に停止した場合の再開）
+"""
+
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from src.spool import Spool, SpoolDrainer
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 5 件目（ n=4 ）を送信している途中でプロセスが停止するドレイナー（ argv[2] は sink / batch ）
+CRASHING_DRAIN = """
+import os, sys
+from src.spool import Spool, SpoolDrainer
+
+spool = Spool(sys.argv[1])
+for n in range(10):
+    spool.append({'timestamp': f'2026-01-01T00:{n:02d}:00', 'device_id': 'A', 'n': n})
+spool.sync()
+
+def sink(data):
+    if data['n'] == 4:
+        os._exit(1)
+    return True
+
+def batch_sink(records):
+    if records[0]['n'] >= 4:
+        os._exit(1)
+    return True
+
+if sys.argv[2] == 'batch':
+    SpoolDrainer(spool, {}, {'target': batch_sink}, batch_size=4).drain_once()
+else:
+    SpoolDrainer(spool, {'target': sink}, batch_size=4).drain_once()
+"""
+
+
+def _record(n: int) -> dict:
+    return {'timestamp': f'2026-01-01T00:{n:02d}:00', 'device_id': 'A', 'n': n}
+
+
+def _crash_while_draining(directory: Path, kind: str):
+    result = subprocess.run([sys.executable, '-c', CRASHING_DRAIN, str(directory), kind], cwd=ROOT)
+    assert result.returncode == 1
+
+
+@pytest.mark.parametrize('kind', ['sink', 'batch'])
+def test_replay_after_crash_resumes_from_checkpoint(tmp_path, kind):
+    _crash_while_draining(tmp_path, kind)
+
+    spool = Spool(tmp_path)
+    try:
+        # 1 件ずつのシンクは送信済みの 4 件、バッチシンクは最初のバッチ（ 4 件）までが記録されている
+        assert spool.get_checkpoint('target') == 4
+        assert spool.last_seq == 10
+
+        delivered = []
+
+        def sink(data):
+            delivered.append(data['n'])
+            return True
+
+        def batch_sink(records):
+            delivered.extend(record['n'] for record in records)
+            return True
+
+        if kind == 'batch':
+            drainer = SpoolDrainer(spool, {}, {'target': batch_sink}, batch_size=4)
+        else:
+            drainer = SpoolDrainer(spool, {'target': sink}, batch_size=4)
+        assert drainer.drain_once() == 6
+        assert delivered == list(range(4, 10))
+        assert spool.pending(['target']) == {'target': 0}
+    finally:
+        spool.close()
+
+
+def test_torn_tail_record_is_ignored(tmp_path):
+    spool = Spool(tmp_path)
+    for n in range(3):
+        spool.append(_record(n))
+    spool.close()
+
+    # 書き込みの途中で停止した末尾の行
+    segment = sorted(tmp_path.glob('spool-*'))[-1]
+    with open(segment, 'a', encoding='utf-8') as f:
+        f.write('{"seq": 4, "data": {"timest')
+
+    spool = Spool(tmp_path)
+    try:
+        assert spool.last_seq == 3
+        assert [data['n'] for _, data in spool.read_after(0)] == [0, 1, 2]
+    finally:
+        spool.close()
+
+
+def test_failed_sink_keeps_records_and_retries(tmp_path):
+    spool = Spool(tmp_path)
+    try:
+        for n in range(5):
+            spool.append(_record(n))
+
+        delivered = []
+        failures = [2]
+
+        def flaky(data):
+            if data['n'] in failures:
+                failures.remove(data['n'])
+                return False
+            delivered.append(data['n'])
+            return True
+
+        drainer = SpoolDrainer(spool, {'sheets': flaky}, retry_interval=0.01, max_retry_interval=0.01)
+        assert drainer.drain_once() == 2
+        assert spool.get_checkpoint('sheets') == 2
+
+        time.sleep(0.02)
+        assert drainer.drain_once() == 3
+        assert delivered == [0, 1, 2, 3, 4]
+    finally:
+        spool.close()
+
+
+def test_pending_records_are_capped_per_sink(tmp_path):
+    spool = Spool(tmp_path, segment_max_bytes=200)
+    try:
+        for n in range(10):
+            spool.append(_record(n))
+
+        delivered = []
+
+        def down(data):
+            return False
+
+        def up(data):
+            delivered.append(data['n'])
+            return True
+
+        drainer = SpoolDrainer(spool, {'down': down, 'up': up}, max_pending=4)
+        drainer.drain_once()
+        # 送信できないシンクは新しい 4 件だけを残し、送信できたシンクには影響しない
+        assert spool.pending(['down', 'up']) == {'down': 4, 'up': 0}
+        assert delivered == list(range(10))
+        assert [data['n'] for _, data in spool.read_after(spool.get_checkpoint('down'))] == [6, 7, 8, 9]
+    finally:
+        spool.close()
+
+
+def test_old_segments_are_dropped_after_max_age(tmp_path):
+    spool = Spool(tmp_path, segment_max_bytes=200)
+    try:
+        for n in range(10):
+            spool.append(_record(n))
+        spool.sync()
+        segments = sorted(tmp_path.glob('spool-*'))
+        assert len(segments) > 2
+        old = time.time() - 120
+        for segment in segments[:-1]:
+            os.utime(segment, (old, old))
+
+        drainer = SpoolDrainer(spool, {'down': lambda data: False}, max_age=60)
+        drainer.drain_once()
+        # 最後のセグメント（書き込み中）の記録だけが残る
+        remaining = [data['n'] for _, data in spool.read_after(spool.get_checkpoint('down'))]
+        assert remaining and remaining == list(range(remaining[0], 10))
+        assert remaining[0] > 0
+    finally:
+        spool.close()
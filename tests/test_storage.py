@@ -0,0 +1,68 @@
+"""
+ストレージの重複排除（ (device_id, timestamp) による冪等な保存）と直近データキャッシュ
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.data_storage import CachedStorage, create_storage
+from src.sample import Sample, epoch_millis
+
+BACKENDS = [('csv', 'data.csv'), ('sqlite', 'data.db')]
+
+
+def _records(now: datetime, count: int = 5):
+    return [
+        {'timestamp': (now - timedelta(minutes=10 * n)).replace(microsecond=0).isoformat(), 'device_id': 'A',
+         'temperature': 20.0 + n, 'humidity': 50.0, 'light_level': n, 'device_type': 'Meter', 'version': '1'}
+        for n in range(count)
+    ]
+
+
+@pytest.mark.parametrize('backend, filename', BACKENDS)
+def test_reinserting_the_same_samples_is_a_no_op(tmp_path, backend, filename):
+    storage = create_storage(backend, tmp_path / filename)
+    records = _records(datetime.now())
+
+    assert storage.save_batch(records) == 5
+    # スプールの再送で同じサンプルがもう一度届いた場合
+    assert storage.save_batch(records) == 0
+    assert storage.save_temperature_data(records[0]) is True
+    # 同じ時刻の Sample も同じサンプルとして扱う
+    assert storage.save_batch([Sample.from_dict(records[1])]) == 0
+
+    assert len(storage.get_recent_data(24)) == 5
+
+
+@pytest.mark.parametrize('backend, filename', BACKENDS)
+def test_reinsert_after_reopening_is_deduplicated(tmp_path, backend, filename):
+    records = _records(datetime.now())
+    create_storage(backend, tmp_path / filename).save_batch(records[:3])
+
+    # プロセスを再起動した後（重複排除インデックスを作り直した後）の再送
+    storage = create_storage(backend, tmp_path / filename)
+    assert storage.save_batch(records) == 2
+    assert len(storage.get_recent_data(24)) == 5
+
+
+def test_same_second_samples_of_one_device_are_kept(tmp_path):
+    storage = create_storage('sqlite', tmp_path / 'data.db')
+    ts = epoch_millis(datetime.now().replace(microsecond=0))
+    assert storage.save_batch([Sample(ts, 'A', 20.0), Sample(ts + 400, 'A', 20.5)]) == 2
+    assert storage.save_batch([Sample(ts + 400, 'A', 20.5)]) == 0
+
+
+@pytest.mark.parametrize('backend, filename', BACKENDS)
+def test_cached_recent_rows_match_the_backend(tmp_path, backend, filename):
+    storage = create_storage(backend, tmp_path / filename)
+    cached = CachedStorage(storage, cache_size=100)
+    now = datetime.now()
+    storage.save_batch(_records(now)[2:])
+    # 初期化は最初の読み込みまで行わない
+    assert not cached.cache.is_warm
+
+    assert cached.get_recent_data(24) == storage.get_recent_data(24)
+    cached.save_batch(_records(now)[:2])
+    assert cached.get_recent_data(24) == storage.get_recent_data(24)
+    assert [row.device_id for row in cached.get_recent_batch(24)] == ['A'] * 5